@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+
+"""
+rest_arch.admission
+~~~~~~~~~~~~~~~~~~~
+
+Per worker admission control of :class:`rest_arch.app.SKT`, shed excess
+requests fast instead of letting latency grow without bound::
+
+    controller = AdmissionController(max_concurrency=100,
+                                     queue_timeout=0.5,
+                                     latency_target=0.2)
+    if controller.admit(queued_at):
+        try:
+            handle()
+        finally:
+            controller.release(cost)
+"""
+
+import time
+
+
+def parse_request_start(value):
+    """Parse a ``X-Request-Start`` header set by the proxy, e.g.
+    ``t=1462519427.123`` (seconds) or ``1462519427123`` (milliseconds).
+    """
+    if not value:
+        return None
+    if value.startswith('t='):
+        value = value[2:]
+    try:
+        ts = float(value)
+    except ValueError:
+        return None
+    # milliseconds / microseconds
+    while ts > 1e11:
+        ts /= 1000
+    return ts
+
+
+class AdmissionController(object):
+    """
+    :param max_concurrency: max requests in flight, 0 for unlimited
+    :param queue_timeout: shed requests queued longer than seconds before
+                          reaching the worker, 0 disables
+    :param latency_target: when the fastest request finished in the last
+                           ``interval`` seconds is still slower than
+                           seconds, the worker is overloaded and admits
+                           half of its inflight requests until latency
+                           recovers, 0 disables
+    """
+
+    def __init__(self, max_concurrency=0, queue_timeout=0,
+                 latency_target=0, interval=0.1):
+        self.max_concurrency = max_concurrency
+        self.queue_timeout = queue_timeout
+        self.latency_target = latency_target
+        self.interval = interval
+        self.inflight = 0
+        self.admitted = 0
+        self.shed = 0
+        self.overloaded = False
+        self._limit = max_concurrency
+        self._interval_end = 0
+        self._min_latency = None
+
+    @property
+    def limit(self):
+        """Current concurrency limit, 0 for unlimited."""
+        return self._limit
+
+    def admit(self, queued_at=None):
+        """Whether to accept a request, ``queued_at`` is the timestamp
+        the request reached the proxy if known."""
+        if self.queue_timeout and queued_at is not None and \
+                time.time() - queued_at > self.queue_timeout:
+            self.shed += 1
+            return False
+        if self._limit and self.inflight >= self._limit:
+            self.shed += 1
+            return False
+        self.inflight += 1
+        self.admitted += 1
+        return True
+
+    def release(self, cost):
+        self.inflight -= 1
+        if not self.latency_target:
+            return
+        if self._min_latency is None or cost < self._min_latency:
+            self._min_latency = cost
+        now = time.time()
+        if now < self._interval_end:
+            return
+        overloaded = self._min_latency > self.latency_target
+        if overloaded:
+            self._limit = max(1, (self._limit or self.inflight + 1) // 2)
+        else:
+            self._limit = self.max_concurrency
+        self.overloaded = overloaded
+        self._interval_end = now + self.interval
+        self._min_latency = None
+
+    def stats(self):
+        return {
+            'inflight': self.inflight,
+            'admitted': self.admitted,
+            'shed': self.shed,
+            'limit': self._limit,
+            'overloaded': self.overloaded,
+        }
@@ -2,10 +2,28 @@
 
 import os
 import sys
-from flask import Flask
+import time
+import uuid
+import types
+from flask import Flask, request, stream_with_context
 from werkzeug.serving import WSGIRequestHandler
 
 import rest_arch
+from .admission import AdmissionController, parse_request_start
+from .conf import settings as core_settings
+from .consts import (
+    REQUEST_ID_HEADER,
+    RPC_ID_HEADER,
+    REQUEST_START_HEADER,
+    REQUEST_TIMEOUT_HEADER,
+    DEFAULT_TOO_BUSY_ERROR_CODE,
+    DEFAULT_TOO_BUSY_EXC_NAME,
+    DEFAULT_TOO_BUSY_MSG,
+)
+from .ctx import g
+from .exc import ArchSystemExc
+from .serializer import JSONSerializer, negotiate, JSON_CONTENT_TYPE
+from .signals import before_api_called, after_api_called
 
 
 ##
@@ -33,16 +51,173 @@ class SKT(Flask):
     def __init__(self, import_name, settings='settings.py',
                  validator=None, data=None, auth=None, redis=None,
                  url_coverters=None, json_encoder=None, media=None,
-                 **kwargs):
+                 shielded_apis=None, **kwargs):
         super(SKT, self).__init__(import_name, **kwargs)
 
+        if json_encoder is not None:
+            self.json_encoder = json_encoder
+        self.json_serializer = JSONSerializer(json_encoder)
+
         self.settings = settings
         self.load_config()
 
+        self.admission = AdmissionController(
+            max_concurrency=core_settings.SKT_MAX_CONCURRENCY,
+            queue_timeout=core_settings.SKT_QUEUE_TIMEOUT,
+            latency_target=core_settings.SKT_LATENCY_TARGET,
+            interval=core_settings.SKT_LATENCY_INTERVAL)
+        if shielded_apis is None:
+            shielded_apis = self._load_shielded_apis()
+        self.shielded_apis = set(shielded_apis)
+
+        self.before_request(self.admit_request)
+        self.before_request(self.setup_call_meta)
+        self.teardown_request(self.release_request)
+        self.teardown_request(self.teardown_call_meta)
+        self.errorhandler(ArchSystemExc)(self.handle_system_exc)
+        if core_settings.SQLSTATS_ENABLED:
+            from .sqlstats import get_sql_stats
+            get_sql_stats()
+        if core_settings.TRACKER_SAMPLE_RATE:
+            from .tracker import get_tracker
+            get_tracker()
+
     def run(self, host=None, port=None, debug=None, **options):
         options.setdefault('request_handler', SKTWSGIRequestHandler)
         super(SKT, self).run(host, port, debug, **options)
 
+    @staticmethod
+    def _load_shielded_apis():
+        from .skt.env import is_in_container
+        if not is_in_container():
+            return ()
+        from .skt.config import load_app_config
+        return load_app_config().shielded_apis
+
+    def admit_request(self):
+        """Shed the request with a TOO_BUSY error if the worker is
+        overloaded, shielded apis are always admitted."""
+        if request.endpoint in self.shielded_apis or (
+                request.url_rule is not None and
+                request.url_rule.rule in self.shielded_apis):
+            return
+        queued_at = parse_request_start(
+            request.headers.get(REQUEST_START_HEADER))
+        if not self.admission.admit(queued_at):
+            return {
+                'code': DEFAULT_TOO_BUSY_ERROR_CODE,
+                'name': DEFAULT_TOO_BUSY_EXC_NAME,
+                'message': DEFAULT_TOO_BUSY_MSG,
+            }, 503
+        request.environ['rest_arch.admitted_at'] = time.time()
+
+    def release_request(self, exc=None):
+        admitted_at = request.environ.pop('rest_arch.admitted_at', None)
+        if admitted_at is not None:
+            self.admission.release(time.time() - admitted_at)
+
+    def load_stats(self):
+        """``{inflight, admitted, shed, limit, overloaded}`` of this
+        worker."""
+        return self.admission.stats()
+
+    @staticmethod
+    def timeout(seconds):
+        """Default deadline of a view, e.g.::
+
+            @app.route('/foo')
+            @app.timeout(0.5)
+            def foo():
+                pass
+        """
+        def decorated(func):
+            func.request_timeout = seconds
+            return func
+        return decorated
+
+    def _request_timeout(self):
+        view = self.view_functions.get(request.endpoint)
+        timeout = getattr(view, 'request_timeout', None) or \
+            core_settings.SKT_REQUEST_TIMEOUT or None
+        try:
+            header = float(request.headers.get(REQUEST_TIMEOUT_HEADER))
+        except (TypeError, ValueError):
+            return timeout
+        return header if timeout is None else min(header, timeout)
+
+    def _api_name(self):
+        if request.url_rule is not None:
+            return request.url_rule.rule
+        return request.path
+
+    def setup_call_meta(self):
+        """Set ``request_id``, ``seq`` and ``deadline`` of call meta from
+        request headers, generate a new request id if not provided."""
+        g.set_call_meta('request_id',
+                        request.headers.get(REQUEST_ID_HEADER) or
+                        uuid.uuid4().hex)
+        g.set_call_meta('seq', request.headers.get(RPC_ID_HEADER, '1'))
+        timeout = self._request_timeout()
+        if timeout is not None:
+            g.set_deadline(timeout)
+        before_api_called.send(self, api=self._api_name(),
+                               method=request.method)
+        if timeout is not None:
+            g.check_deadline()
+
+    def handle_system_exc(self, exc):
+        return {
+            'code': exc.code,
+            'name': exc.name,
+            'message': exc.message,
+        }, exc.status_code
+
+    def teardown_call_meta(self, exc=None):
+        after_api_called.send(self, exc=exc)
+        if core_settings.SQLSTATS_ENABLED:
+            from .sqlstats import get_sql_stats
+            get_sql_stats().finish_request()
+        g.clear_api_ctx()
+
+    def get_serializer(self):
+        """Serializer of current request, by ``Accept`` header."""
+        serializer = negotiate(request.headers.get('Accept'))
+        if serializer.content_type == JSON_CONTENT_TYPE:
+            return self.json_serializer
+        return serializer
+
+    def get_payload(self):
+        """Decode request body by ``Content-Type`` header."""
+        data = request.get_data()
+        if not data:
+            return None
+        serializer = negotiate(content_type=request.headers.get(
+            'Content-Type'))
+        if serializer.content_type == JSON_CONTENT_TYPE:
+            serializer = self.json_serializer
+        return serializer.loads(data)
+
+    def make_response(self, rv):
+        """Besides types accepted by :meth:`flask.Flask.make_response`,
+        ``dict``, ``list`` and generator bodies are serialized by
+        :meth:`get_serializer`, generators and lists longer than
+        ``SERIALIZER_STREAM_THRESHOLD`` are streamed."""
+        body, rest = rv, ()
+        if isinstance(rv, tuple):
+            body, rest = rv[0], rv[1:]
+        if isinstance(body, (dict, list, types.GeneratorType)):
+            serializer = self.get_serializer()
+            if isinstance(body, types.GeneratorType) or (
+                    isinstance(body, list) and
+                    len(body) > core_settings.SERIALIZER_STREAM_THRESHOLD):
+                data = stream_with_context(serializer.iter_list(body))
+            else:
+                data = serializer.dumps(body)
+            body = self.response_class(data,
+                                       mimetype=serializer.content_type)
+            rv = (body, ) + rest if rest else body
+        return super(SKT, self).make_response(rv)
+
     def load_config(self):
         # load defaults
         self.config.from_object('rest_arch.settings')
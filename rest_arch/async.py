@@ -6,7 +6,9 @@ rest_arch.async
 Define async tasks for all apis.
 """
 
+import time
 import functools
+import contextlib
 import celery
 from celery.utils.log import get_task_logger
 logger = get_task_logger(__name__)
@@ -17,54 +19,194 @@ if not settings.ASYNC_ENABLED:
         'async function disabled, search for ASYNC_ENABLED setting'
     )
 from .skt.env import is_in_container, initialize
-from .skt.config import load_app_config
 from .mock_queue import tasks as queue_tasks
+from .ctx import g
+from .exc import TaskBatchSendExc
+from .routing import get_routing_table
+from .lanes import get_lanes
+from .retry import get_retry_policy
+from .tracker import span
+from . import task_serializer
+
+task_serializer.register()
 
 
 def init_celery_app():
     if is_in_container():
-        app_config = load_app_config()
         if not settings._loaded:
             initialize()
         if not settings.USE_MEMORY_MQ:
-            if 'async_workers' in app_config.config:
-                for q in app_config.config['async_workers']:
-                    settings.celeryconfig.CELERY_QUEUES[q['name']] = {
-                        "exchange": "SKT",
-                        "routing_key": "api.%s" % q['name'],
-                    }
+            for lane in get_lanes():
+                settings.celeryconfig.CELERY_QUEUES[lane.name] = {
+                    "exchange": "SKT",
+                    "routing_key": lane.routing_key,
+                }
             queues = {}
             queues.update(settings.celeryconfig.CELERY_QUEUES)
             settings.celeryconfig.CELERY_QUEUES = queues
     app = celery.Celery()
     app.config_from_object(settings.celeryconfig)
+    lane = get_lanes().current()
+    if lane is not None:
+        app.conf.update(lane.worker_settings())
     return app
 
 app = init_celery_app()
 
 
 def send_task(service_slug, api, *args, **kwargs):
+    batched = g.task_batch is not None
+    with span('task', '{}.{}'.format(service_slug, api), batched=batched):
+        if batched:
+            g.task_batch.add(service_slug, api, *args, **kwargs)
+            return
+        return _send_task(service_slug, api, *args, **kwargs)
+
+
+def _send_task(service_slug, api, *args, **kwargs):
     if settings.USE_MEMORY_MQ:
-        queue_tasks.put_nowait((service_slug, api, args, kwargs))
+        queue_tasks.put((service_slug, api, args, kwargs))
         return
-    r = async_api.si(service_slug, api, *args, **kwargs). \
-        apply_async(**kwargs)
+    r = _signature(service_slug, api, args, kwargs).apply_async(**kwargs)
     if service_slug != "dms":
         logger.info('{}.{}{} {}'.format(service_slug, api, args, r))
     return r
 
 
-@app.task(max_retries=settings.TASK_MAX_RETRY_COUNT, bind=True)
-def async_api(self, service_slug, api_name, *args, **kwargs):
-    if service_slug in ('ess', 'tds'):
+def _signature(service_slug, api, args, kwargs):
+    # `sent_at` is used to measure queue latency of lanes
+    return async_api.si(service_slug, api, *args,
+                        **dict(kwargs, sent_at=time.time()))
+
+
+class TaskBatch(object):
+    """Tasks published together in one flush, over a single broker
+    connection and channel. Tasks failed to publish are sent again one by
+    one, those failed again raise
+    :class:`rest_arch.exc.TaskBatchSendExc`."""
+
+    def __init__(self):
+        self.tasks = []
+
+    def __len__(self):
+        return len(self.tasks)
+
+    def add(self, service_slug, api, *args, **kwargs):
+        self.tasks.append((service_slug, api, args, kwargs))
+
+    def flush(self):
+        tasks, self.tasks = self.tasks, []
+        if not tasks:
+            return []
+        if settings.USE_MEMORY_MQ:
+            for task in tasks:
+                queue_tasks.put(task)
+            return [None] * len(tasks)
+
+        results = [None] * len(tasks)
+        failed = []
+        try:
+            with app.producer_or_acquire() as producer:
+                for i, (service_slug, api, args, kwargs) in \
+                        enumerate(tasks):
+                    try:
+                        results[i] = _signature(
+                            service_slug, api, args, kwargs). \
+                            apply_async(producer=producer, **kwargs)
+                    except Exception:
+                        failed.append(i)
+        except Exception:
+            # no connection at all
+            logger.exception('Error acquiring producer')
+            failed = [i for i, r in enumerate(results) if r is None]
+        logger.info('sent {} tasks in batch, {} failed: {}'.format(
+            len(tasks), len(failed),
+            ', '.join('{}.{}'.format(s, a) for s, a, _, _ in tasks)))
+
+        errors = []
+        for i in failed:
+            service_slug, api, args, kwargs = tasks[i]
+            try:
+                results[i] = _send_task(service_slug, api, *args, **kwargs)
+            except Exception as e:
+                logger.exception('Error sending {}.{}{}'.format(
+                    service_slug, api, args))
+                errors.append((tasks[i], e))
+        if errors:
+            raise TaskBatchSendExc(errors, results)
+        return results
+
+
+def send_tasks(batch):
+    """Publish ``[(service_slug, api, args, kwargs), ...]`` in one
+    flush, see :class:`TaskBatch`."""
+    task_batch = TaskBatch()
+    task_batch.tasks.extend(batch)
+    return task_batch.flush()
+
+
+@contextlib.contextmanager
+def task_batch():
+    """Gather tasks sent by :func:`send_task` in the block and publish
+    them at exit, dropped if the block raises::
+
+        with task_batch():
+            send_task('foo', 'bar', 1)
+            send_task('foo', 'baz', 2)
+    """
+    if g.task_batch is not None:
+        # nested, flushed by the outermost one
+        yield g.task_batch
         return
-    if service_slug == 'biz.member' and \
-            api_name in ('signal_post_make_order',
-                         'signal_post_process_order',
-                         'signal_post_process_refund'):
+    batch = g.task_batch = TaskBatch()
+    try:
+        yield batch
+    except Exception:
+        logger.warn('dropped {} batched tasks'.format(len(batch)))
+        raise
+    finally:
+        g.task_batch = None
+    batch.flush()
+
+
+def _retry_option(kwargs, key, lane_value, default):
+    """Retry option of the task call, else of its lane, else
+    ``default``, a lane setting ``0`` is kept."""
+    if key in kwargs:
+        return kwargs[key]
+    return default if lane_value is None else lane_value
+
+
+@app.task(max_retries=settings.TASK_MAX_RETRY_COUNT, bind=True,
+          serializer=settings.ASYNC_TASK_SERIALIZER,
+          compression=settings.ASYNC_TASK_COMPRESSION)
+def async_api(self, service_slug, api_name, *args, **kwargs):
+    sent_at = kwargs.pop('sent_at', None)
+    retries = self.request.retries
+    lanes = get_lanes()
+    lane = lanes.select(service_slug, api_name, kwargs.get('lane'))
+    if not retries:
+        lanes.record_latency(lane, sent_at, kwargs.get('countdown'))
+
+    routing_table = get_routing_table()
+    if routing_table.is_skipped(service_slug, api_name):
         return
 
-    client = find_client(service_slug, api_name)
+    client = routing_table.find_client(service_slug, api_name)
+    lane_max_retries = lane and lane.max_retries
+    lane_retry_wait = lane and lane.retry_wait
+
+    policy = get_retry_policy(dlq=publish_dead_letter)
+    if not retries:
+        policy.record_call(service_slug)
+
+    def retry(exc, max_retries, retry_wait):
+        if not policy.allow_retry(service_slug, retries, max_retries):
+            policy.dead_letter(service_slug, api_name, args, kwargs, exc,
+                               retries)
+            raise exc
+        self.retry(exc=exc, countdown=policy.backoff(retries, retry_wait),
+                   max_retries=max_retries)
 
     def retry_exc(func):
         @functools.wraps(func)
@@ -72,25 +214,71 @@ def async_api(self, service_slug, api_name, *args, **kwargs):
             try:
                 return func(*args, **kwds)
             except client.error as e:
-                max_retries = kwargs.get('max_retries',
-                                         settings.TASK_TE_MAX_RETRY_COUNT)
-                retry_wait = kwargs.get('retry_wait',
-                                        settings.TASK_THRIFT_ERROR_RETRY_WAIT)
-
-                self.retry(exc=e, countdown=retry_wait,
-                           max_retries=max_retries)
+                retry(e,
+                      _retry_option(kwargs, 'max_retries', lane_max_retries,
+                                    settings.TASK_TE_MAX_RETRY_COUNT),
+                      _retry_option(kwargs, 'retry_wait', lane_retry_wait,
+                                    settings.TASK_THRIFT_ERROR_RETRY_WAIT))
             except BaseException as e:
-                max_retries = kwargs.get('max_retries',
-                                         settings.TASK_UE_MAX_RETRY_COUNT)
-                retry_wait = kwargs.get('retry_wait',
-                                        settings.TASK_UNKOWN_ERROR_RETRY_WAIT)
-
-                self.retry(exc=e, countdown=retry_wait,
-                           max_retries=max_retries)
+                retry(e,
+                      _retry_option(kwargs, 'max_retries', lane_max_retries,
+                                    settings.TASK_UE_MAX_RETRY_COUNT),
+                      _retry_option(kwargs, 'retry_wait', lane_retry_wait,
+                                    settings.TASK_UNKOWN_ERROR_RETRY_WAIT))
 
         return wrapper
 
-    retry_exc(run_api)(client, self.request.id, api_name, *args)
+    g.set_deadline(lane and lane.soft_time_limit or
+                   settings.ASYNC_API_TIMEOUT)
+    try:
+        retry_exc(run_api)(client, self.request.id, api_name, *args)
+    finally:
+        g.clear_api_ctx()
+
+
+def _dlq():
+    from kombu import Exchange, Queue
+    name = settings.ASYNC_DLQ_QUEUE
+    return Queue(name, Exchange('SKT', type='direct'),
+                 routing_key='api.{}'.format(name))
+
+
+def publish_dead_letter(service_slug, api, args, kwargs, exc, retries):
+    """Publish a task out of retries to ``ASYNC_DLQ_QUEUE``, which no
+    worker consumes, to be inspected or replayed."""
+    dlq = _dlq()
+    with app.producer_or_acquire() as producer:
+        producer.publish(
+            {'service': service_slug, 'api': api, 'args': args,
+             'kwargs': kwargs, 'exc': repr(exc), 'retries': retries,
+             'failed_at': time.time()},
+            exchange=dlq.exchange, routing_key=dlq.routing_key,
+            declare=[dlq], serializer=settings.ASYNC_TASK_SERIALIZER)
+
+
+def dlq_depth():
+    """Messages waiting in the dead letter queue."""
+    with app.connection_or_acquire() as conn:
+        # a failed passive declare closes the channel, don't break the
+        # default one
+        channel = conn.channel()
+        try:
+            _, depth, _ = _dlq()(channel).queue_declare(passive=True)
+        except conn.channel_errors:
+            # nothing dead lettered yet
+            return 0
+        finally:
+            try:
+                channel.close()
+            except conn.channel_errors:
+                pass
+        return depth
+
+
+def retry_stats():
+    """Retry and dead letter counters of each service in this worker,
+    see :meth:`rest_arch.retry.RetryPolicy.stats`."""
+    return get_retry_policy(dlq=publish_dead_letter).stats()
 
 
 def run_api(client, request_id, api_name, *args):
@@ -99,22 +287,33 @@ def run_api(client, request_id, api_name, *args):
     logger.info("[{}] {}.{}{}".format(request_id,
                                       service_slug, api_name, args))
 
-    with gevent.Timeout(10):
+    timeout = g.get_timeout(settings.ASYNC_API_TIMEOUT)
+    with gevent.Timeout(timeout):
         if is_in_container():
             call = getattr(client, api_name)
             return call(*args)
         else:
-            with client(timeout=10, fake=settings.FAKE_CLIENT) as c:
+            with client(timeout=timeout, fake=settings.FAKE_CLIENT) as c:
                 call = getattr(c, api_name)
                 return call(*args)
 
 
 class AsyncRouter(object):
+    """Route ``async_api`` tasks to the lane picked by
+    :meth:`rest_arch.lanes.Lanes.select`, or to the queue named by the
+    service slug."""
+
     def route_for_task(self, task, args=None, kwargs=None):
         if task == "rest_arch.async.async_api":
+            kwargs = kwargs or {}
             queue = args[0]
-            if kwargs and kwargs.get('queue', '').startswith(args[0]):
+            if kwargs.get('queue', '').startswith(args[0]):
                 queue = kwargs.get('queue')
+            else:
+                lane = get_lanes().select(args[0], args[1],
+                                          kwargs.get('lane'))
+                if lane is not None:
+                    return lane.route()
             return {
                 'queue': queue,
             }
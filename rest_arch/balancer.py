@@ -0,0 +1,212 @@
+# -*- coding: utf-8 -*-
+
+"""
+rest_arch.balancer
+~~~~~~~~~~~~~~~~~~
+
+Replica balancers used by :class:`rest_arch.db.RoutingSession` to pick a
+slave engine for reads. Balancers are fed with the cursor timings
+collected by :class:`rest_arch.log.SQLLogger`::
+
+    balancer = make_balancer('p2c', slave_engines, weights={'slave': 2})
+    get_sql_logger().add_listener(balancer)
+    engine = balancer.choose()
+"""
+
+import time
+import random
+import logging
+import weakref
+
+logger = logging.getLogger(__name__)
+
+# PEP 249 errors of the connection or the server, not of the query
+REPLICA_ERRORS = ('OperationalError', 'InterfaceError')
+
+
+def is_replica_error(exc):
+    """Whether ``exc`` (raised by a DBAPI driver) tells the replica is
+    unhealthy, errors of the query itself (e.g. ``IntegrityError``,
+    ``ProgrammingError``) don't."""
+    if isinstance(exc, EnvironmentError):
+        # socket errors
+        return True
+    return any(cls.__name__ in REPLICA_ERRORS for cls in type(exc).__mro__)
+
+
+class ReplicaStats(object):
+    """Runtime stats of one replica engine."""
+
+    def __init__(self, role, weight=1):
+        self.role = role
+        self.weight = weight
+        self.latency = 0.0
+        # connections running a statement, a statement interrupted by
+        # `gevent.Timeout` never ends, its entry goes with the connection
+        self.running = weakref.WeakKeyDictionary()
+        self.fails = 0
+        self.ejected_until = 0
+
+    @property
+    def outstanding(self):
+        return len(self.running)
+
+    def is_ejected(self, now):
+        return self.ejected_until > now
+
+    def to_dict(self, now=None):
+        now = now or time.time()
+        return {
+            'weight': self.weight,
+            'latency': self.latency,
+            'outstanding': self.outstanding,
+            'fails': self.fails,
+            'ejected': self.is_ejected(now),
+        }
+
+
+class BaseBalancer(object):
+    """Track per replica latency (EWMA), outstanding queries and
+    consecutive errors, replicas erroring out ``max_fails`` times in a row
+    are ejected for ``eject_seconds``, only errors of
+    :func:`is_replica_error` are counted.
+
+    Subclasses implement :meth:`_choose` to pick one of the alive
+    replicas.
+    """
+
+    def __init__(self, engines, weights=None, decay=0.3, max_fails=3,
+                 eject_seconds=10):
+        """
+        :param dict engines: ``{role: engine}`` of the replicas
+        :param dict weights: ``{role: weight}``, defaults to ``1``
+        :param float decay: EWMA smoothing factor, in ``(0, 1]``
+        """
+        weights = weights or {}
+        self.decay = decay
+        self.max_fails = max_fails
+        self.eject_seconds = eject_seconds
+        self.engines = list(engines.values())
+        self._stats = {
+            engine: ReplicaStats(role, weights.get(role, 1))
+            for role, engine in engines.iteritems()
+        }
+
+    def choose(self):
+        now = time.time()
+        alive = [e for e in self.engines
+                 if not self._stats[e].is_ejected(now)]
+        if not alive:
+            # all replicas ejected, better to try than to fail
+            alive = self.engines
+        if len(alive) == 1:
+            return alive[0]
+        return self._choose(alive)
+
+    def _choose(self, engines):
+        raise NotImplementedError
+
+    def _weighted_choice(self, engines):
+        total = sum(self._stats[e].weight for e in engines)
+        point = random.uniform(0, total)
+        for engine in engines:
+            point -= self._stats[engine].weight
+            if point <= 0:
+                return engine
+        return engines[-1]
+
+    def set_weight(self, role, weight):
+        for stats in self._stats.itervalues():
+            if stats.role == role:
+                stats.weight = weight
+                return
+        raise KeyError(role)
+
+    def stats(self):
+        """Current weights, latencies and ejection states keyed by role."""
+        now = time.time()
+        return {s.role: s.to_dict(now) for s in self._stats.itervalues()}
+
+    # SQLLogger listener interface
+
+    def on_sql_start(self, conn, statement, params):
+        stats = self._stats.get(conn.engine)
+        if stats is not None:
+            stats.running[conn] = True
+
+    def on_sql_end(self, conn, statement, params, cost, exc=None):
+        stats = self._stats.get(conn.engine)
+        if stats is None:
+            return
+        stats.running.pop(conn, None)
+        if exc is not None:
+            if not is_replica_error(exc):
+                return
+            stats.fails += 1
+            if stats.fails >= self.max_fails:
+                stats.ejected_until = time.time() + self.eject_seconds
+                logger.warning('replica %s ejected for %ss after %s errors',
+                               stats.role, self.eject_seconds, stats.fails)
+                stats.fails = 0
+            return
+        stats.fails = 0
+        if cost is None:
+            return
+        if stats.latency:
+            stats.latency += self.decay * (cost - stats.latency)
+        else:
+            stats.latency = cost
+
+
+class RandomBalancer(BaseBalancer):
+    """Weighted random choice."""
+
+    def _choose(self, engines):
+        return self._weighted_choice(engines)
+
+
+class P2CBalancer(BaseBalancer):
+    """Power of two choices: sample two replicas by weight and take the
+    one with lower ``latency * (outstanding + 1) / weight``."""
+
+    def _score(self, engine):
+        stats = self._stats[engine]
+        return stats.latency * (stats.outstanding + 1) / float(stats.weight)
+
+    def _choose(self, engines):
+        a = self._weighted_choice(engines)
+        b = self._weighted_choice(engines)
+        if a is b:
+            b = random.choice([e for e in engines if e is not a])
+        return a if self._score(a) <= self._score(b) else b
+
+
+class LeastOutstandingBalancer(BaseBalancer):
+    """Pick the replica with least outstanding queries per weight."""
+
+    def _choose(self, engines):
+        def key(engine):
+            stats = self._stats[engine]
+            return stats.outstanding / float(stats.weight)
+        least = min(key(e) for e in engines)
+        return random.choice([e for e in engines if key(e) == least])
+
+
+BALANCERS = {
+    'random': RandomBalancer,
+    'p2c': P2CBalancer,
+    'least_outstanding': LeastOutstandingBalancer,
+}
+
+
+def make_balancer(name, engines, **kwds):
+    """Create balancer by name (see :data:`BALANCERS`) or by a
+    :class:`BaseBalancer` subclass."""
+    if isinstance(name, basestring):
+        try:
+            cls = BALANCERS[name]
+        except KeyError:
+            raise ValueError('Unknown db balancer: {!r}'.format(name))
+    else:
+        cls = name
+    return cls(engines, **kwds)
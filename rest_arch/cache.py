@@ -0,0 +1,401 @@
+# -*- coding: utf-8 -*-
+
+"""
+rest_arch.cache
+~~~~~~~~~~~~~~~
+
+Read-through model cache, an in-process LRU tier in front of Redis::
+
+    # settings.py
+    CACHE_SETTINGS = {'foo': 'redis://localhost:6379'}
+
+    # models.py
+    Model = model_base()
+    CacheMixin = make_cache_mixin('foo')
+
+    class User(Model, CacheMixin):
+        __tablename__ = 'user'
+        __cache_unique_keys__ = (('email', ), )
+
+    User.get(1)
+    User.mget([1, 2, 3])
+    User.get_by(email='foo@bar.com')
+
+Cached rows of a model are invalidated after the session commits and
+cache misses are read from master, so a lagging replica can't put the
+rows from before the commit back. The local tier lives for
+``CACHE_LOCAL_TTL`` seconds at most as it can not see invalidations from
+other processes.
+"""
+
+import time
+import weakref
+import logging
+import contextlib
+import cPickle as pickle
+from collections import OrderedDict
+
+from sqlalchemy import event, inspect, tuple_
+from sqlalchemy.orm import object_mapper
+
+from .conf import settings
+from .redis_client import create_redis_client
+
+logger = logging.getLogger(__name__)
+
+_MISSING = object()
+
+
+class LRUCache(object):
+    """In-process LRU cache with ttl, ``maxsize`` bounded."""
+
+    def __init__(self, maxsize=10000, ttl=5):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, default=None):
+        try:
+            expire_at, value = self._data.pop(key)
+        except KeyError:
+            self.misses += 1
+            return default
+        if expire_at < time.time():
+            self.misses += 1
+            return default
+        self._data[key] = (expire_at, value)
+        self.hits += 1
+        return value
+
+    def set(self, key, value):
+        self._data.pop(key, None)
+        self._data[key] = (time.time() + self.ttl, value)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def delete(self, *keys):
+        for key in keys:
+            self._data.pop(key, None)
+
+    def clear(self):
+        self._data.clear()
+
+
+class Cache(object):
+    """Two tier cache, values are pickled in redis. Redis errors are
+    logged and treated as cache misses."""
+
+    def __init__(self, redis, namespace='', ttl=3600, local_size=10000,
+                 local_ttl=5):
+        self.redis = redis
+        self.namespace = namespace
+        self.ttl = ttl
+        self.local = LRUCache(local_size, local_ttl) if local_size else None
+
+    def make_key(self, *parts):
+        key = ':'.join(str(p) for p in parts)
+        if self.namespace:
+            return '{}:{}'.format(self.namespace, key)
+        return key
+
+    def get(self, key, default=None):
+        if self.local is not None:
+            value = self.local.get(key, _MISSING)
+            if value is not _MISSING:
+                return value
+        try:
+            data = self.redis.get(key)
+        except Exception:
+            logger.exception('Error getting cache %r', key)
+            return default
+        if data is None:
+            return default
+        value = pickle.loads(data)
+        if self.local is not None:
+            self.local.set(key, value)
+        return value
+
+    def set(self, key, value):
+        data = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        try:
+            self.redis.setex(key, data, self.ttl)
+        except Exception:
+            logger.exception('Error setting cache %r', key)
+            return
+        if self.local is not None:
+            # keep a detached copy, not the caller's instance
+            self.local.set(key, pickle.loads(data))
+
+    def get_many(self, keys):
+        """Get ``{key: value}`` of hit ``keys``, local tier first then
+        redis in one ``MGET``."""
+        found = {}
+        if self.local is not None:
+            for key in keys:
+                value = self.local.get(key, _MISSING)
+                if value is not _MISSING:
+                    found[key] = value
+            keys = [k for k in keys if k not in found]
+        if not keys:
+            return found
+        try:
+            datas = self.redis.mget(keys)
+        except Exception:
+            logger.exception('Error getting cache %r', keys)
+            return found
+        for key, data in zip(keys, datas):
+            if data is None:
+                continue
+            value = found[key] = pickle.loads(data)
+            if self.local is not None:
+                self.local.set(key, value)
+        return found
+
+    def set_many(self, mapping):
+        """Set ``{key: value}`` in one redis pipeline."""
+        if not mapping:
+            return
+        datas = {key: pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+                 for key, value in mapping.iteritems()}
+        try:
+            pipe = self.redis.pipeline(transaction=False)
+            for key, data in datas.iteritems():
+                pipe.setex(key, data, self.ttl)
+            pipe.execute()
+        except Exception:
+            logger.exception('Error setting cache %r', datas.keys())
+            return
+        if self.local is not None:
+            for key, data in datas.iteritems():
+                self.local.set(key, pickle.loads(data))
+
+    def delete(self, *keys):
+        if not keys:
+            return
+        if self.local is not None:
+            self.local.delete(*keys)
+        try:
+            self.redis.delete(*keys)
+        except Exception:
+            logger.exception('Error deleting cache %r', keys)
+
+    def stats(self):
+        if self.local is None:
+            return {}
+        return {'local_size': len(self.local),
+                'local_hits': self.local.hits,
+                'local_misses': self.local.misses}
+
+
+_caches = {}
+
+
+def get_cache(name):
+    """Get cache by name configured in ``CACHE_SETTINGS``, the config
+    value is a redis dsn or a dict like::
+
+        {'url': 'redis://localhost:6379', 'ttl': 3600,
+         'local_size': 10000, 'local_ttl': 5}
+    """
+    if name in _caches:
+        return _caches[name]
+    try:
+        config = settings.CACHE_SETTINGS[name]
+    except KeyError:
+        raise KeyError(
+            '`%s` cache not configured, check `CACHE_SETTINGS`' % name)
+    if isinstance(config, basestring):
+        config = {'url': config}
+    cache = _caches[name] = Cache(
+        create_redis_client(config['url']),
+        namespace=config.get('namespace', settings.CACHE_NAMESPACE),
+        ttl=config.get('ttl', settings.CACHE_TTL),
+        local_size=config.get('local_size', settings.CACHE_LOCAL_SIZE),
+        local_ttl=config.get('local_ttl', settings.CACHE_LOCAL_TTL))
+    return cache
+
+
+class CacheHook(object):
+    """Collect cache keys of cached models flushed in a session and
+    invalidate them once the session commits."""
+
+    def __init__(self):
+        self.models = set()
+        self._pending = weakref.WeakKeyDictionary()
+        self._listening = False
+
+    def add(self, model):
+        self.models.add(model)
+        if not self._listening:
+            from .db import RoutingSession
+            event.listen(RoutingSession, 'after_flush', self.on_after_flush)
+            event.listen(RoutingSession, 'after_commit',
+                         self.on_after_commit)
+            event.listen(RoutingSession, 'after_soft_rollback',
+                         self.on_after_rollback)
+            self._listening = True
+
+    def on_after_flush(self, session, flush_context):
+        keys = None
+        for objs in (session.new, session.dirty, session.deleted):
+            for obj in objs:
+                if type(obj) not in self.models:
+                    continue
+                if keys is None:
+                    keys = self._pending.setdefault(session, {})
+                keys.setdefault(obj._cache, set()).update(
+                    obj._cache_keys_of(obj))
+
+    def on_after_commit(self, session):
+        pending = self._pending.pop(session, None)
+        if not pending:
+            return
+        for cache, keys in pending.iteritems():
+            cache.delete(*keys)
+
+    def on_after_rollback(self, session, previous_transaction):
+        # outermost rollback
+        if session.is_active:
+            self._pending.pop(session, None)
+
+
+class CacheMixinBase(object):
+    """Base of model cache mixins, see :func:`make_cache_mixin`."""
+
+    _hook = None
+    _cache = None
+    _db_session = None
+
+    #: unique keys available to :meth:`get_by`, e.g. ``(('email', ), )``
+    __cache_unique_keys__ = ()
+
+    @classmethod
+    def _pk_key(cls, pk):
+        if not isinstance(pk, (tuple, list)):
+            pk = (pk, )
+        return cls._cache.make_key(cls.__tablename__, 'pk', *pk)
+
+    @classmethod
+    def _unique_key(cls, fields, values):
+        parts = ['{}={}'.format(f, v) for f, v in zip(fields, values)]
+        return cls._cache.make_key(cls.__tablename__, 'uk', '&'.join(parts))
+
+    @classmethod
+    def _cache_keys_of(cls, obj):
+        """Cache keys of both current and committed values of ``obj``."""
+        state = inspect(obj)
+        mapper = object_mapper(obj)
+        keys = set()
+        identity = state.identity or mapper.primary_key_from_instance(obj)
+        keys.add(cls._pk_key(tuple(identity)))
+        for fields in cls.__cache_unique_keys__:
+            values_list = [[], []]
+            for field in fields:
+                history = state.attrs[field].history
+                values_list[0].append(getattr(obj, field))
+                values_list[1].append(
+                    history.deleted[0] if history.deleted
+                    else getattr(obj, field))
+            for values in values_list:
+                keys.add(cls._unique_key(fields, values))
+        return keys
+
+    @classmethod
+    @contextlib.contextmanager
+    def _fill_session(cls):
+        """Session reading cache misses, from master of a
+        :class:`rest_arch.db.RoutingSession`."""
+        session = cls._db_session()
+        binding = getattr(session, 'binding', None)
+        if binding is None:
+            yield session
+        else:
+            with binding('master'):
+                yield session
+
+    @classmethod
+    def _merge(cls, obj):
+        if obj is None:
+            return None
+        return cls._db_session().merge(obj, load=False)
+
+    @classmethod
+    def get(cls, pk):
+        """Get row by primary key, read through cache."""
+        key = cls._pk_key(pk)
+        obj = cls._cache.get(key)
+        if obj is not None:
+            return cls._merge(obj)
+        with cls._fill_session() as session:
+            obj = session.query(cls).get(pk)
+        if obj is not None:
+            cls._cache.set(key, obj)
+        return obj
+
+    @classmethod
+    def mget(cls, pks):
+        """Get rows by primary keys, in at most three round trips: local
+        cache, redis ``MGET`` and one ``IN`` query for the rest. Returns
+        a list in the order of ``pks``, ``None`` for missing rows.
+        """
+        keys = [cls._pk_key(pk) for pk in pks]
+        objs = {k: cls._merge(v)
+                for k, v in cls._cache.get_many(keys).iteritems()}
+        missing = {}
+        for pk, key in zip(pks, keys):
+            if key not in objs:
+                missing[key] = pk
+        if missing:
+            pk_cols = cls.__mapper__.primary_key
+            if len(pk_cols) == 1:
+                criterion = pk_cols[0].in_(missing.values())
+            else:
+                criterion = tuple_(*pk_cols).in_(missing.values())
+            loaded = {}
+            with cls._fill_session() as session:
+                rows = session.query(cls).filter(criterion).all()
+            for obj in rows:
+                pk = object_mapper(obj).primary_key_from_instance(obj)
+                loaded[cls._pk_key(tuple(pk))] = obj
+            cls._cache.set_many(loaded)
+            objs.update(loaded)
+        return [objs.get(key) for key in keys]
+
+    @classmethod
+    def get_by(cls, **kwargs):
+        """Get row by unique key declared in ``__cache_unique_keys__``,
+        read through cache."""
+        for fields in cls.__cache_unique_keys__:
+            if set(fields) == set(kwargs):
+                break
+        else:
+            raise ValueError('{!r} is not a cached unique key of {}'.format(
+                tuple(kwargs), cls.__name__))
+        key = cls._unique_key(fields, [kwargs[f] for f in fields])
+        pk = cls._cache.get(key)
+        if pk is not None:
+            return cls.get(pk)
+        with cls._fill_session() as session:
+            obj = session.query(cls).filter_by(**kwargs).first()
+        if obj is not None:
+            pk = tuple(object_mapper(obj).primary_key_from_instance(obj))
+            cls._cache.set(key, pk[0] if len(pk) == 1 else pk)
+            cls._cache.set(cls._pk_key(pk), obj)
+        return obj
+
+
+def make_cache_mixin(db_name, cache_name=None):
+    """Make a model mixin reading through cache ``cache_name`` (defaults
+    to ``db_name``) and DB session ``db_name`` of ``DB_SETTINGS``.
+    """
+    from .db import db_manager
+    return type('CacheMixin', (CacheMixinBase, ), {
+        '_hook': CacheHook(),
+        '_cache': get_cache(cache_name or db_name),
+        '_db_session': db_manager.get_session(db_name),
+    })
@@ -1,7 +1,396 @@
 # -*- coding: utf-8 -*-
 
+import time
+import logging
+import cookielib
+import functools
+from collections import OrderedDict, deque
+
 import requests
-import json
+import gevent
+from gevent.event import AsyncResult
+from gevent.lock import BoundedSemaphore
+from requests.adapters import HTTPAdapter
+from requests.packages.urllib3.util.retry import Retry
+
+from .conf import settings
+from .ctx import g
+from .consts import REQUEST_TIMEOUT_HEADER
+from .exc import ArchBackoffExc, ArchTooBusyExc, ArchDeadlineExceededExc
+from .serializer import get_serializer, negotiate
+from .tracker import span
+
+logger = logging.getLogger(__name__)
+
+
+class _BlockAllCookies(cookielib.DefaultCookiePolicy):
+    """Pooled sessions are shared by all callers, never keep cookies."""
+
+    def set_ok(self, cookie, request):
+        return False
+
+    def return_ok(self, cookie, request):
+        return False
+
+
+##
+# circuit breaker & concurrency limit
+##
+class CircuitBreaker(object):
+    """Failure rate circuit breaker of one destination.
+
+    Calls failed or slower than ``slow_call_threshold`` seconds in the last
+    ``window`` seconds are counted, the breaker opens when their rate
+    reaches ``failure_rate`` (with at least ``min_calls`` calls). After
+    ``open_seconds`` it turns half open and lets ``half_open_calls`` probe
+    calls through: the breaker closes if they all succeed, opens again
+    otherwise. Calls through an open breaker raise
+    :class:`rest_arch.exc.ArchBackoffExc`.
+    """
+
+    CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half_open'
+
+    def __init__(self, failure_rate=0.5, min_calls=20, window=10,
+                 slow_call_threshold=None, open_seconds=5,
+                 half_open_calls=1):
+        self.failure_rate = failure_rate
+        self.min_calls = min_calls
+        self.window = window
+        self.slow_call_threshold = slow_call_threshold
+        self.open_seconds = open_seconds
+        self.half_open_calls = half_open_calls
+        self.state = self.CLOSED
+        self.opened_at = 0
+        self.rejected = 0
+        self._calls = deque()
+        self._failures = 0
+        self._probing = 0
+        self._probe_successes = 0
+
+    def _open(self, now):
+        self.state = self.OPEN
+        self.opened_at = now
+        self._calls.clear()
+        self._failures = 0
+
+    def before_call(self):
+        if self.state == self.CLOSED:
+            return
+        if self.state == self.OPEN:
+            if time.time() - self.opened_at < self.open_seconds:
+                self.rejected += 1
+                raise ArchBackoffExc()
+            self.state = self.HALF_OPEN
+            self._probing = self._probe_successes = 0
+        if self._probing >= self.half_open_calls:
+            self.rejected += 1
+            raise ArchBackoffExc()
+        self._probing += 1
+
+    def cancel(self):
+        """Give back the probe slot taken by :meth:`before_call` of a call
+        not made."""
+        if self.state == self.HALF_OPEN and self._probing > 0:
+            self._probing -= 1
+
+    def record(self, cost, failed):
+        if self.slow_call_threshold is not None and \
+                cost > self.slow_call_threshold:
+            failed = True
+        now = time.time()
+        if self.state == self.HALF_OPEN:
+            if failed:
+                self._open(now)
+                return
+            self._probe_successes += 1
+            if self._probe_successes >= self.half_open_calls:
+                self.state = self.CLOSED
+            return
+        if self.state == self.OPEN:
+            return
+
+        calls = self._calls
+        calls.append((now, failed))
+        self._failures += failed
+        while calls and calls[0][0] < now - self.window:
+            self._failures -= calls.popleft()[1]
+        if len(calls) >= self.min_calls and \
+                self._failures >= self.failure_rate * len(calls):
+            self._open(now)
+
+    def stats(self):
+        return {'state': self.state, 'calls': len(self._calls),
+                'failures': self._failures, 'rejected': self.rejected}
+
+
+class AdaptiveLimiter(object):
+    """AIMD in-flight limit of one destination: the limit grows by one
+    per ``limit`` successful calls, and shrinks by ``backoff`` on a failed
+    call or a call slower than ``latency_threshold`` seconds. Calls over
+    the limit raise :class:`rest_arch.exc.ArchTooBusyExc`.
+    """
+
+    def __init__(self, initial=20, min_limit=1, max_limit=200,
+                 backoff=0.9, latency_threshold=None):
+        self.limit = float(initial)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.backoff = backoff
+        self.latency_threshold = latency_threshold
+        self.inflight = 0
+        self.rejected = 0
+
+    def acquire(self):
+        if self.inflight >= int(self.limit):
+            self.rejected += 1
+            raise ArchTooBusyExc()
+        self.inflight += 1
+
+    def release(self, cost, failed):
+        self.inflight -= 1
+        if failed or (self.latency_threshold is not None and
+                      cost > self.latency_threshold):
+            self.limit = max(self.min_limit, self.limit * self.backoff)
+        else:
+            self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+
+    def stats(self):
+        return {'limit': int(self.limit), 'inflight': self.inflight,
+                'rejected': self.rejected}
+
+
+##
+# connection pool
+##
+class HTTPPool(object):
+    """Keep-alive connection pool to one ``host:port``, shared by all
+    :class:`Client` pointing at it, see :func:`get_pool`.
+
+    Calls are guarded by the optional ``breaker`` (a
+    :class:`CircuitBreaker`) and ``limiter`` (an
+    :class:`AdaptiveLimiter`), connection errors and 5xx responses count
+    as failures.
+    """
+
+    def __init__(self, url, pool_size=10, retries=0, block=False,
+                 breaker=None, limiter=None):
+        self.url = url
+        self.in_use = 0
+        self.breaker = breaker
+        self.limiter = limiter
+        self.session = requests.Session()
+        self.session.cookies.set_policy(_BlockAllCookies())
+        self.adapter = HTTPAdapter(
+            pool_connections=1, pool_maxsize=pool_size,
+            max_retries=Retry(total=retries, read=False), pool_block=block)
+        self.session.mount(url, self.adapter)
+
+    def request(self, method, url, **kwargs):
+        if self.breaker is not None:
+            self.breaker.before_call()
+        if self.limiter is not None:
+            try:
+                self.limiter.acquire()
+            except ArchTooBusyExc:
+                if self.breaker is not None:
+                    self.breaker.cancel()
+                raise
+        self.in_use += 1
+        failed = True
+        start = time.time()
+        try:
+            response = self.session.request(method, url, **kwargs)
+            failed = response.status_code >= 500
+            return response
+        finally:
+            self.in_use -= 1
+            cost = time.time() - start
+            if self.limiter is not None:
+                self.limiter.release(cost, failed)
+            if self.breaker is not None:
+                self.breaker.record(cost, failed)
+
+    def stats(self):
+        created = requests_count = idle = 0
+        conn_pools = self.adapter.poolmanager.pools
+        for key in conn_pools.keys():
+            conn_pool = conn_pools.get(key)
+            if conn_pool is None:
+                continue
+            created += conn_pool.num_connections
+            requests_count += conn_pool.num_requests
+            idle += sum(1 for conn in list(conn_pool.pool.queue)
+                        if conn is not None)
+        stats = {
+            'in_use': self.in_use,
+            'idle': idle,
+            'created': created,
+            'reused': max(requests_count - created, 0),
+        }
+        if self.breaker is not None:
+            stats['breaker'] = self.breaker.stats()
+        if self.limiter is not None:
+            stats['limiter'] = self.limiter.stats()
+        return stats
+
+
+pools = {}
+
+
+def get_pool(host, port, **kwargs):
+    """Get the pool of ``host:port``, created by ``kwargs`` (see
+    :class:`HTTPPool`) if not exists."""
+    key = '{}:{}'.format(host, port)
+    pool = pools.get(key)
+    if pool is None:
+        kwargs.setdefault('pool_size', settings.CLIENT_POOL_SIZE)
+        kwargs.setdefault('retries', settings.CLIENT_RETRIES)
+        if 'breaker' not in kwargs and settings.CLIENT_CIRCUIT_BREAKER:
+            kwargs['breaker'] = CircuitBreaker(
+                **settings.CLIENT_CIRCUIT_BREAKER)
+        if 'limiter' not in kwargs and settings.CLIENT_ADAPTIVE_LIMIT:
+            kwargs['limiter'] = AdaptiveLimiter(
+                **settings.CLIENT_ADAPTIVE_LIMIT)
+        pool = pools[key] = HTTPPool('http://{}/'.format(key), **kwargs)
+    return pool
+
+
+def pool_stats():
+    """``{host:port: {in_use, idle, created, reused}}`` of all pools."""
+    return {key: pool.stats() for key, pool in pools.iteritems()}
+
+
+##
+# coalescing
+##
+class SingleFlight(object):
+    """Concurrent calls of the same key share one in-flight call, all
+    callers get its result or exception::
+
+        single_flight.do(('GET', url), functools.partial(pool.request, ...),
+                         timeout=g.get_timeout())
+
+    The call runs in its own greenlet without the ``deadline`` of the
+    caller who started it, each caller waits at most its own ``timeout``
+    seconds then gets a :class:`gevent.Timeout`, the call goes on for the
+    others.
+    """
+
+    def __init__(self):
+        self.calls = {}
+        self.coalesced = 0
+
+    def do(self, key, func, timeout=None):
+        result = self.calls.get(key)
+        if result is not None:
+            self.coalesced += 1
+        else:
+            result = self.calls[key] = AsyncResult()
+            gevent.spawn(self._run, key, func, result)
+        return result.get(timeout=timeout)
+
+    def _run(self, key, func, result):
+        g.call_meta_data.pop('deadline', None)
+        try:
+            result.set(func())
+        except BaseException as e:
+            # also a `gevent.Timeout` or kill, callers would block forever
+            # otherwise
+            result.set_exception(e)
+        finally:
+            del self.calls[key]
+
+
+single_flight = SingleFlight()
+
+
+class ResponseCache(object):
+    """Short ttl response cache: entries are fresh for ``ttl`` seconds
+    and may be served stale for ``stale_ttl`` more seconds while being
+    revalidated in background."""
+
+    FRESH, STALE = 'fresh', 'stale'
+
+    def __init__(self, ttl, stale_ttl=0, maxsize=1000):
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.maxsize = maxsize
+        self.hits = self.stale_hits = self.misses = 0
+        self._data = OrderedDict()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key):
+        """Return ``(response, state)``, ``(None, None)`` if missed."""
+        try:
+            fresh_until, stale_until, response = self._data.pop(key)
+        except KeyError:
+            self.misses += 1
+            return None, None
+        now = time.time()
+        if stale_until < now:
+            self.misses += 1
+            return None, None
+        self._data[key] = (fresh_until, stale_until, response)
+        if fresh_until >= now:
+            self.hits += 1
+            return response, self.FRESH
+        self.stale_hits += 1
+        return response, self.STALE
+
+    def set(self, key, response):
+        now = time.time()
+        self._data.pop(key, None)
+        self._data[key] = (now + self.ttl, now + self.ttl + self.stale_ttl,
+                           response)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def stats(self):
+        return {'size': len(self._data), 'hits': self.hits,
+                'stale_hits': self.stale_hits, 'misses': self.misses}
+
+
+##
+# fan-out
+##
+def gather(calls, concurrency=None, timeout=None, call_timeout=None):
+    """Run ``calls`` (callables without arguments) concurrently on
+    greenlets, return their results or exceptions in order::
+
+        gather([functools.partial(c1.get, '/foo'),
+                functools.partial(c2.post, '/bar', {'a': 1})],
+               concurrency=5, timeout=2, call_timeout=1)
+
+    :param concurrency: max calls running at the same time
+    :param timeout: total deadline in seconds, capped by the remaining
+                    time of current request, unfinished calls are killed
+                    and get a :class:`gevent.Timeout`
+    :param call_timeout: deadline in seconds of each call
+    """
+    remaining = g.get_remaining_time()
+    if remaining is not None:
+        timeout = remaining if timeout is None else min(timeout, remaining)
+
+    semaphore = BoundedSemaphore(concurrency or len(calls) or 1)
+    results = [None] * len(calls)
+
+    def run(index, call):
+        with semaphore:
+            try:
+                with gevent.Timeout(call_timeout):
+                    results[index] = call()
+            except (Exception, gevent.Timeout) as e:
+                results[index] = e
+
+    greenlets = [gevent.spawn(run, i, call) for i, call in enumerate(calls)]
+    gevent.joinall(greenlets, timeout=timeout)
+    for index, greenlet in enumerate(greenlets):
+        if not greenlet.ready():
+            greenlet.kill(block=False)
+            results[index] = gevent.Timeout(timeout)
+    return results
 
 
 ##
@@ -9,24 +398,196 @@ import json
 ##
 class Client(object):
 
-    def __init__(self, host, port):
+    def __init__(self, host, port, timeout=None, pool_size=None,
+                 retries=None, serializer='json', coalesce=None,
+                 cache_ttl=None, stale_ttl=None, apis=()):
+        """
+        :param timeout: ``(connect, read)`` timeout in seconds, defaults
+                        to ``CLIENT_CONNECT_TIMEOUT``/``CLIENT_READ_TIMEOUT``
+        :param pool_size: max keep-alive connections to ``host:port``
+        :param retries: retries of idempotent requests on connection
+                        errors
+        :param serializer: ``json`` or ``msgpack``, content type of post
+                           payloads and accepted responses
+        :param coalesce: share one in-flight call among concurrent
+                         identical GETs, defaults to ``CLIENT_COALESCE``
+        :param cache_ttl: cache successful GET responses for seconds,
+                          defaults to ``CLIENT_CACHE_TTL``, 0 disables
+        :param stale_ttl: serve expired responses for seconds more while
+                          revalidating, defaults to ``CLIENT_CACHE_STALE_TTL``
+        :param apis: apis and signals served, used to route async tasks
+        """
+        self.apis = frozenset(apis)
+        self.serializer = get_serializer(serializer)
+        self.coalesce = settings.CLIENT_COALESCE \
+            if coalesce is None else coalesce
+        if cache_ttl is None:
+            cache_ttl = settings.CLIENT_CACHE_TTL
+        if stale_ttl is None:
+            stale_ttl = settings.CLIENT_CACHE_STALE_TTL
+        self.cache = ResponseCache(cache_ttl, stale_ttl,
+                                   settings.CLIENT_CACHE_SIZE) \
+            if cache_ttl else None
+        self.host = host
+        self.port = port
         self.url = "http://{}:{}".format(host, port)
+        self._timeout = timeout
+        self._pool_kwargs = {}
+        if pool_size is not None:
+            self._pool_kwargs['pool_size'] = pool_size
+        if retries is not None:
+            self._pool_kwargs['retries'] = retries
+
+    @property
+    def pool(self):
+        return get_pool(self.host, self.port, **self._pool_kwargs)
+
+    @property
+    def timeout(self):
+        if self._timeout is None:
+            return (settings.CLIENT_CONNECT_TIMEOUT,
+                    settings.CLIENT_READ_TIMEOUT)
+        return self._timeout
+
+    def _request_options(self, headers):
+        """Timeout and headers of a call, capped by and propagating the
+        remaining time of current request."""
+        timeout = self.timeout
+        remaining = g.get_remaining_time()
+        if remaining is not None:
+            if remaining <= 0:
+                raise ArchDeadlineExceededExc()
+            if isinstance(timeout, tuple):
+                timeout = tuple(min(t, remaining) for t in timeout)
+            else:
+                timeout = min(timeout, remaining)
+            headers[REQUEST_TIMEOUT_HEADER] = '%.3f' % remaining
+        return {'headers': headers, 'timeout': timeout}
+
+    def multi(self, calls, **kwargs):
+        """Concurrent GET/POST calls to this client, e.g.::
+
+            client.multi([('get', '/foo'), ('post', '/bar', {'a': 1})])
+
+        ``kwargs`` are passed to :func:`gather`.
+        """
+        return gather([functools.partial(getattr(self, call[0]), *call[1:])
+                       for call in calls], **kwargs)
+
+    def _get(self, route):
+        with span('client', 'GET ' + route, url=self.url) as s:
+            response = self.pool.request(
+                'GET', self.url + route,
+                **self._request_options(
+                    {'Accept': self.serializer.content_type}))
+            s.set_tag('status', response.status_code)
+        return response
+
+    def _fetch(self, key, route):
+        if self.coalesce or self.cache is not None:
+            try:
+                response = single_flight.do(
+                    key, functools.partial(self._get, route),
+                    timeout=g.get_timeout())
+            except gevent.Timeout:
+                if g.get_remaining_time() == 0:
+                    raise ArchDeadlineExceededExc()
+                raise
+        else:
+            response = self._get(route)
+        if self.cache is not None and response.ok:
+            self.cache.set(key, response)
+        return response
+
+    def _revalidate(self, key, route):
+        # the request serving the stale response may be done already
+        g.detach()
+        try:
+            self._fetch(key, route)
+        except Exception:
+            logger.exception('Error revalidating %s%s', self.url, route)
 
     def get(self, route):
-        return requests.get(self.url + route)
+        """GET ``route``, coalesced and cached if enabled. Responses are
+        shared by all callers, don't modify them."""
+        key = ('GET', self.url + route, self.serializer.content_type)
+        if self.cache is not None:
+            response, state = self.cache.get(key)
+            if state == ResponseCache.STALE:
+                if key not in single_flight.calls:
+                    gevent.spawn(self._revalidate, key, route)
+                return response
+            if response is not None:
+                return response
+        return self._fetch(key, route)
 
     # default content-type: json
     def post(self, route, payload, json_format=True):
+        headers = {'Accept': self.serializer.content_type}
         if json_format:
-            headers = {'Content-Type': 'application/json'}
-        else:
-            headers = None
-        return requests.post(
-            self.url + route,
-            headers=headers,
-            data=json.dumps(payload)
-        )
-
-clients = {
+            headers['Content-Type'] = self.serializer.content_type
+        with span('client', 'POST ' + route, url=self.url) as s:
+            response = self.pool.request(
+                'POST',
+                self.url + route,
+                data=self.serializer.dumps(payload),
+                **self._request_options(headers)
+            )
+            s.set_tag('status', response.status_code)
+        return response
+
+    @staticmethod
+    def loads(response):
+        """Decode ``response`` body by its ``Content-Type``."""
+        serializer = negotiate(
+            content_type=response.headers.get('Content-Type'))
+        return serializer.loads(response.content)
+
+
+##
+# registry
+##
+class ClientRegistry(dict):
+    """Dict of ``{app_name: client}`` counting its changes, so
+    :class:`rest_arch.routing.RoutingTable` knows when to rebuild."""
+
+    def __init__(self, *args, **kwargs):
+        super(ClientRegistry, self).__init__(*args, **kwargs)
+        self.version = 0
+
+    def _changed(self):
+        self.version += 1
+
+    def __setitem__(self, key, value):
+        super(ClientRegistry, self).__setitem__(key, value)
+        self._changed()
+
+    def __delitem__(self, key):
+        super(ClientRegistry, self).__delitem__(key)
+        self._changed()
+
+    def update(self, *args, **kwargs):
+        super(ClientRegistry, self).update(*args, **kwargs)
+        self._changed()
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self[key] = default
+        return self[key]
+
+    def pop(self, *args):
+        self._changed()
+        return super(ClientRegistry, self).pop(*args)
+
+    def popitem(self):
+        self._changed()
+        return super(ClientRegistry, self).popitem()
+
+    def clear(self):
+        super(ClientRegistry, self).clear()
+        self._changed()
+
+
+clients = ClientRegistry({
     'skt.test': Client('localhost', 8010)
-}
+})
@@ -190,7 +190,10 @@ class CeleryConfig(DefaultConfig):
         'CELERY_TASK_RESULT_EXPIRES': 60 * 20,
         'CELERY_TIMEZONE': 'Asia/Shanghai',
         'CELERY_ENABLE_UTC': False,
-        'CELERY_ACCEPT_CONTENT': ['pickle', 'msgpack', 'json'],
+        # `arch_msgpack` by content type, which is accepted even if the
+        # serializer isn't registered (no msgpack installed)
+        'CELERY_ACCEPT_CONTENT': ['pickle', 'msgpack', 'json',
+                                  'application/x-arch-msgpack'],
         'CELERY_TASK_SERIALIZER': 'pickle',
         'CELERY_RESULT_SERIALIZER': 'pickle',
         'CELERYD_MAX_TASKS_PER_CHILD': 5000,
@@ -219,27 +222,111 @@ class Config(DefaultConfig):
     __DEFAULT_SETTINGS__ = {
         # cache
         'MZDEVICE': '',
-        'CACHE_SETTINGS': {},
+        'CACHE_SETTINGS': default_empty({}),
+        'CACHE_NAMESPACE': default_empty(''),
+        'CACHE_TTL': 60 * 60,
+        'CACHE_LOCAL_SIZE': 10000,
+        'CACHE_LOCAL_TTL': 5,
 
         # logging
         'SQLLOGGER_SWITCH': lambda: False,
+        'SQLLOGGER_ASYNC': False,
+        'SQLLOGGER_BUFFER_SIZE': 10000,
+        'SQLLOGGER_BATCH_SIZE': 500,
+        'SQLLOGGER_FLUSH_INTERVAL': 0.1,
+        'SQLLOGGER_TEMPLATE_CACHE_SIZE': 1000,
+        'SQLSTATS_ENABLED': False,
+        'SQLSTATS_N_PLUS_ONE_THRESHOLD': 5,
+        # tracing, see `rest_arch.tracker`, a sample rate of 0 disables,
+        # spans are exported to `file:///path` or `udp://host:port`
+        'TRACKER_SAMPLE_RATE': 0,
+        'TRACKER_EXPORT': default_empty(''),
+        'TRACKER_BUFFER_SIZE': 10000,
+        'TRACKER_BATCH_SIZE': 100,
+        'TRACKER_FLUSH_INTERVAL': 1,
 
         # async
         'ASYNC_ENABLED': True,
         'ASYNC_CELERYCONFIG': '',
+        # serializer and compression of `async.async_api` messages, set
+        # to `arch_msgpack`/`arch_zlib` (see `rest_arch.task_serializer`)
+        # once all consumers accept them
+        'ASYNC_TASK_SERIALIZER': 'pickle',
+        'ASYNC_TASK_COMPRESSION': 'gzip',
+        'TASK_COMPRESSION_THRESHOLD': 1024,
+        # {service: [api, ...]} of tasks never executed, `None` for all
+        # apis of the service
+        'ASYNC_SKIP_RULES': {
+            'ess': None,
+            'tds': None,
+            'biz.member': ['signal_post_make_order',
+                           'signal_post_process_order',
+                           'signal_post_process_refund'],
+        },
+        # same as `ASYNC_SKIP_RULES`, for tasks of the memory queue
+        'MEMORY_MQ_SKIP_RULES': {
+            'ees': None,
+        },
         'USE_MEMORY_MQ': False,
+        'MEMORY_MQ_SIZE': 10000,
+        'MEMORY_MQ_WORKERS': 10,
+        'MEMORY_MQ_PUT_TIMEOUT': 1,
         'TASK_THRIFT_ERROR_RETRY_WAIT': 5,
-        'TASK_MAX_RETRY_COUNT': 12 * 60 * 60 / 5,
         'TASK_UNKOWN_ERROR_RETRY_WAIT': 15,
-        'TASK_TE_MAX_RETRY_COUNT': 12 * 60 * 60 / 15,
-        'TASK_UE_MAX_RETRY_COUNT': 12 * 60 * 60 / 15,
-
+        # retry for about 12h of backoff, counts are
+        # `rest_arch.retry.max_retries_within(12 * 60 * 60, wait, cap)`
+        'TASK_MAX_RETRY_COUNT': 292,
+        'TASK_TE_MAX_RETRY_COUNT': 292,
+        'TASK_UE_MAX_RETRY_COUNT': 291,
+        # retries back off exponentially with full jitter from the retry
+        # waits above, at most `TASK_RETRY_BUDGET_RATIO` of fresh calls
+        # (plus `TASK_RETRY_BUDGET_MIN`) of a service are retried in the
+        # window, the others go to `ASYNC_DLQ_QUEUE`
+        'TASK_RETRY_BACKOFF_CAP': 5 * 60,
+        'TASK_RETRY_BUDGET_RATIO': 0.2,
+        'TASK_RETRY_BUDGET_WINDOW': 60,
+        'TASK_RETRY_BUDGET_MIN': 10,
+        'ASYNC_DLQ_QUEUE': 'dead_letter',
+        'ASYNC_API_TIMEOUT': 10,
+
+
+        # admission control, 0 disables
+        'SKT_MAX_CONCURRENCY': 0,
+        'SKT_QUEUE_TIMEOUT': 0,
+        'SKT_LATENCY_TARGET': 0,
+        'SKT_LATENCY_INTERVAL': 0.1,
+        # default request deadline in seconds, 0 for none
+        'SKT_REQUEST_TIMEOUT': 0,
+
+        # serializer
+        'SERIALIZER_STREAM_THRESHOLD': 1000,
+        # encode JSON by ujson, its output differs from stdlib json
+        'SERIALIZER_UJSON': False,
+
+        # client
+        'CLIENT_POOL_SIZE': 10,
+        'CLIENT_RETRIES': 0,
+        'CLIENT_CONNECT_TIMEOUT': 1,
+        'CLIENT_READ_TIMEOUT': 10,
+        'CLIENT_COALESCE': False,
+        'CLIENT_CACHE_TTL': 0,
+        'CLIENT_CACHE_STALE_TTL': 0,
+        'CLIENT_CACHE_SIZE': 1000,
+        # kwargs of `client.CircuitBreaker` / `client.AdaptiveLimiter`,
+        # e.g. {'failure_rate': 0.5, 'open_seconds': 5}, empty disables
+        'CLIENT_CIRCUIT_BREAKER': default_empty({}),
+        'CLIENT_ADAPTIVE_LIMIT': default_empty({}),
 
         # db
         'DB_POOL_SIZE': 10,
         'DB_MAX_OVERFLOW': 1,
         'DB_POOL_RECYCLE': 1200,
         'DB_SETTINGS': default_empty({}),
+        'DB_BALANCER': 'random',
+        'DB_BALANCER_EWMA_DECAY': 0.3,
+        'DB_REPLICA_MAX_FAILS': 3,
+        'DB_REPLICA_EJECT_SECONDS': 10,
+        'DB_REPLICATION_PROBE_TTL': 0.5,
     }
     explicit = True
 
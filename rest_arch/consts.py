@@ -1,6 +1,7 @@
 # -*- coding: utf-8 -*-
 
 PLACE_HOLDER = '-'
+SENSITIVE_PLACE_HOLDER = '***'
 
 DEFAULT_TOO_BUSY_ERROR_CODE = -1
 DEFAULT_TOO_BUSY_EXC_NAME = 'TOO_BUSY_ERROR'
@@ -8,6 +9,19 @@ DEFAULT_TOO_BUSY_MSG = u"SOME THING TOO BUSY"
 
 DEFAULT_BACKOFF_ERROR_CODE = -3
 DEFAULT_BACKOFF_EXC_NAME = 'BACKOFF_ERROR'
+DEFAULT_BACKOFF_MSG = u"SOME THING UNAVAILABLE, BACKOFF"
+
+DEFAULT_DEADLINE_EXCEEDED_ERROR_CODE = -4
+DEFAULT_DEADLINE_EXCEEDED_EXC_NAME = 'DEADLINE_EXCEEDED_ERROR'
+DEFAULT_DEADLINE_EXCEEDED_MSG = u"DEADLINE EXCEEDED"
 
 SHIELDED_API_KEY = 'shielded_apis'
 DEFAULT_STATSD = ""
+
+SQL_COMMENT_START = '/* E:'
+SQL_COMMENT_END = ':E */ '
+
+REQUEST_ID_HEADER = 'X-Request-Id'
+RPC_ID_HEADER = 'X-Rpc-Id'
+REQUEST_START_HEADER = 'X-Request-Start'
+REQUEST_TIMEOUT_HEADER = 'X-Request-Timeout'
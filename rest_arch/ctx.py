@@ -1,50 +1,187 @@
 # -*- coding: utf-8 -*-
 
-import threading
+"""
+rest_arch.ctx
+~~~~~~~~~~~~~
+
+Request context of the current greenlet, ``g``::
+
+    g.set_call_meta('request_id', request_id)
+    g.get_call_meta('seq')
+
+The context is stored on the greenlet itself, it doesn't depend on
+``threading.local`` being monkeypatched, and each thread has its own as
+each thread runs its own greenlets.
+
+Greenlets spawned by gevent start with a copy of the spawner's context
+(like :mod:`contextvars`), so fan-out calls keep the ``request_id`` and
+``seq`` of the request, while their changes stay in the child. The
+pending ``task_batch`` is not inherited. Work outliving the request
+calls :meth:`ConnCtx.detach` to drop its deadline and tracing span, long
+running workers started in a request call :meth:`ConnCtx.clear_all`.
+
+Clearing a context swaps in new containers, the old ones are left to
+the garbage collector.
+"""
+
+import time
+
+from gevent import Greenlet
+from greenlet import getcurrent
+
 from .consts import PLACE_HOLDER
-from .skt import env
+from .exc import ArchDeadlineExceededExc
 
+_CTX_ATTR = '_rest_arch_ctx'
+
+# call meta bound to the request, see `ConnCtx.detach`
+REQUEST_BOUND_META = ('deadline', 'span')
+
+
+class _Context(object):
+
+    __slots__ = ('conn_ctx', 'call_meta_data', 'logging_meta',
+                 'user_request_ctx', 'rendered_logging_meta',
+                 'required_logging_meta', 'required_logging_meta_key',
+                 'task_batch')
 
-class ConnCtx(threading.local):
     def __init__(self):
-        env.require('gevent_patched')
-        super(ConnCtx, self).__init__()
         self.conn_ctx = {}
         self.call_meta_data = {}
         self.logging_meta = {}
         self.user_request_ctx = {}  # user data
+        # logging caches, see `rest_arch.log.RestFormatter`
+        self.rendered_logging_meta = None
+        self.required_logging_meta = None
+        self.required_logging_meta_key = None
+        # pending tasks, see `rest_arch.async.task_batch`
+        self.task_batch = None
+
+    def copy(self):
+        ctx = _Context.__new__(_Context)
+        ctx.conn_ctx = self.conn_ctx.copy()
+        ctx.call_meta_data = self.call_meta_data.copy()
+        ctx.logging_meta = self.logging_meta.copy()
+        ctx.user_request_ctx = self.user_request_ctx.copy()
+        ctx.rendered_logging_meta = self.rendered_logging_meta
+        ctx.required_logging_meta = self.required_logging_meta
+        ctx.required_logging_meta_key = self.required_logging_meta_key
+        ctx.task_batch = None
+        return ctx
+
+
+def _current():
+    current = getcurrent()
+    try:
+        return current._rest_arch_ctx
+    except AttributeError:
+        ctx = current._rest_arch_ctx = _Context()
+        return ctx
+
+
+def _inherit(greenlet):
+    # called by `Greenlet.start` in the spawning greenlet
+    parent = getattr(getcurrent(), _CTX_ATTR, None)
+    if parent is not None:
+        setattr(greenlet, _CTX_ATTR, parent.copy())
+
+
+Greenlet.add_spawn_callback(_inherit)
+
+
+def _context_attr(name):
+    def fget(self):
+        return getattr(_current(), name)
+
+    def fset(self, value):
+        setattr(_current(), name, value)
+    return property(fget, fset)
+
+
+class ConnCtx(object):
+
+    conn_ctx = _context_attr('conn_ctx')
+    call_meta_data = _context_attr('call_meta_data')
+    logging_meta = _context_attr('logging_meta')
+    user_request_ctx = _context_attr('user_request_ctx')
+    rendered_logging_meta = _context_attr('rendered_logging_meta')
+    required_logging_meta = _context_attr('required_logging_meta')
+    required_logging_meta_key = _context_attr('required_logging_meta_key')
+    task_batch = _context_attr('task_batch')
 
     def clear_api_ctx(self):
-        self.call_meta_data.clear()
-        self.logging_meta.clear()
+        ctx = _current()
+        ctx.call_meta_data = {}
+        ctx.logging_meta = {}
+        ctx.rendered_logging_meta = None
 
     def clear_conn_ctx(self):
-        self.conn_ctx.clear()
+        _current().conn_ctx = {}
 
     def clear_user_request_ctx(self):
-        self.user_request_ctx.clear()
+        _current().user_request_ctx = {}
 
     def set_call_meta(self, key, value):
-        self.call_meta_data[key] = value
+        _current().call_meta_data[key] = value
 
     def set_conn_meta(self, key, value):
-        self.conn_ctx[key] = value
+        _current().conn_ctx[key] = value
 
     def set_user_request_ctx(self, key, value):
-        self.user_request_ctx[key] = value
+        _current().user_request_ctx[key] = value
 
     def get_call_meta(self, key):
-        return self.call_meta_data.get(key, PLACE_HOLDER)
+        return _current().call_meta_data.get(key, PLACE_HOLDER)
+
+    def get_remaining_time(self):
+        """Seconds left before the ``deadline`` (a timestamp) of call
+        meta, ``None`` if there is no deadline."""
+        deadline = _current().call_meta_data.get('deadline')
+        if deadline is None:
+            return None
+        return max(deadline - time.time(), 0)
+
+    def set_deadline(self, timeout):
+        """Set the deadline ``timeout`` seconds later, never extends an
+        earlier one."""
+        call_meta = _current().call_meta_data
+        deadline = time.time() + timeout
+        current = call_meta.get('deadline')
+        if current is not None and current < deadline:
+            deadline = current
+        call_meta['deadline'] = deadline
+        return deadline
+
+    def get_timeout(self, default=None):
+        """``default`` capped by the remaining time, raise
+        :class:`rest_arch.exc.ArchDeadlineExceededExc` if it is spent."""
+        remaining = self.get_remaining_time()
+        if remaining is None:
+            return default
+        if remaining <= 0:
+            raise ArchDeadlineExceededExc()
+        if default is None:
+            return remaining
+        return min(default, remaining)
+
+    def check_deadline(self):
+        if self.get_remaining_time() == 0:
+            raise ArchDeadlineExceededExc()
 
     def get_conn_meta(self, key):
-        return self.conn_ctx.get(key, PLACE_HOLDER)
+        return _current().conn_ctx.get(key, PLACE_HOLDER)
 
     def get_user_request_ctx(self, key):
-        return self.user_request_ctx[key]
+        return _current().user_request_ctx[key]
+
+    def detach(self):
+        """Drop the deadline and tracing span of the request from call
+        meta, for work going on after the request ends."""
+        call_meta = _current().call_meta_data
+        for key in REQUEST_BOUND_META:
+            call_meta.pop(key, None)
 
     def clear_all(self):
-        self.clear_api_ctx()
-        self.clear_conn_ctx()
-        self.clear_user_request_ctx()
+        setattr(getcurrent(), _CTX_ATTR, _Context())
 
 g = ConnCtx()
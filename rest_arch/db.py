@@ -18,8 +18,11 @@ from sqlalchemy.orm import Session, scoped_session, sessionmaker
 from sqlalchemy.exc import SQLAlchemyError
 
 from .skt.env import is_in_dev
+from .balancer import make_balancer
+from .replication import make_replication_probe
 from .log import get_sql_logger
 from .conf import settings
+from .consts import SQL_COMMENT_START, SQL_COMMENT_END
 from .ctx import g
 
 db_ctx = threading.local()
@@ -58,11 +61,30 @@ class RoutingSession(Session):
     _name = None
 
     def __init__(self, engines, *args, **kwds):
+        """
+        :param balancer: :class:`.balancer.BaseBalancer` picking a slave
+                         for reads, random choice if not provided
+        :param sticky_window: read-your-writes mode, seconds for reads to
+                              stick to master after a flush or commit,
+                              ``0`` to disable
+        :param replication_probe: :class:`.replication.ReplicationProbe`,
+                                  if provided, reads go back to a replica
+                                  once it caught up with the commit
+        """
+        balancer = kwds.pop('balancer', None)
+        sticky_window = kwds.pop('sticky_window', 0)
+        replication_probe = kwds.pop('replication_probe', None)
         super(RoutingSession, self).__init__(*args, **kwds)
         self.engines = engines
         self.slave_engines = [e for role, e in engines.items()
                               if role != 'master']
         assert self.slave_engines, ValueError("DB slave configs is wrong!")
+        self.balancer = balancer
+        self.sticky_window = sticky_window
+        self.replication_probe = replication_probe
+        self._sticky_until = None
+        self._write_committed = False
+        self._write_position = None
         self._id = self.gen_id()
         get_sql_logger().ctx.current_session_id = self._id
 
@@ -71,13 +93,50 @@ class RoutingSession(Session):
             return self.engines[self._name]
         elif self._flushing:
             return self.engines['master']
+        if self.balancer is not None:
+            slave = self.balancer.choose()
         else:
-            return random.choice(self.slave_engines)
+            slave = random.choice(self.slave_engines)
+        if self._sticky_until is not None and self._stick_to_master(slave):
+            return self.engines['master']
+        return slave
+
+    def _mark_write(self, committed):
+        if not self.sticky_window:
+            return
+        self._sticky_until = time.time() + self.sticky_window
+        self._write_committed = committed
+        self._write_position = None
+
+    def _stick_to_master(self, slave):
+        if time.time() >= self._sticky_until:
+            self._sticky_until = None
+            return False
+        if self.replication_probe is None or not self._write_committed:
+            return True
+        if self._write_position is None:
+            self._write_position = self.replication_probe.position(
+                self.engines['master'], role='master', cached=False)
+        return not self.replication_probe.caught_up(slave,
+                                                    self._write_position)
 
     def using_bind(self, name):
         self._name = name
         return self
 
+    @contextlib.contextmanager
+    def binding(self, name):
+        """Like :meth:`using_bind`, only within the block::
+
+            with session.binding('master'):
+                session.query(User).get(1)
+        """
+        origin, self._name = self._name, name
+        try:
+            yield self
+        finally:
+            self._name = origin
+
     def rollback(self):
         with gevent.Timeout(5):
             super(RoutingSession, self).rollback()
@@ -105,6 +164,17 @@ class RoutingSession(Session):
             pid, tid, clock, address, hash_key)).hexdigest()[:20]
 
 
+@event.listens_for(RoutingSession, 'after_flush')
+def _after_flush(session, flush_context):
+    session._mark_write(committed=False)
+
+
+@event.listens_for(RoutingSession, 'after_commit')
+def _after_commit(session):
+    if session._sticky_until is not None:
+        session._mark_write(committed=True)
+
+
 def patch_engine(engine):
     pool = engine.pool
     pool._origin_recyle = pool._recycle
@@ -113,7 +183,8 @@ def patch_engine(engine):
     return engine
 
 
-def make_session(engines, force_scope=False, info=None):
+def make_session(engines, force_scope=False, info=None, balancer=None,
+                 sticky_window=0, replication_probe=None):
     if is_in_dev() or force_scope:
         scopefunc = scope_func
     else:
@@ -124,6 +195,9 @@ def make_session(engines, force_scope=False, info=None):
             class_=RoutingSession,
             expire_on_commit=False,
             engines=engines,
+            balancer=balancer,
+            sticky_window=sticky_window,
+            replication_probe=replication_probe,
             info=info or {"name": uuid.uuid4().hex},
         ),
         scopefunc=scopefunc
@@ -133,6 +207,9 @@ def make_session(engines, force_scope=False, info=None):
 
 def create_engine(*args, **kwds):
     engine = patch_engine(sqlalchemy_create_engine(*args, **kwds))
+    # before sql listeners are notified, which are never notified of the
+    # end of a rejected statement
+    event.listen(engine, 'before_cursor_execute', deadline_guard)
     get_sql_logger().register(engine)
     event.listen(engine, 'before_cursor_execute', sql_commenter, retval=True)
     return engine
@@ -159,15 +236,24 @@ def gen_commit_deco(DBSession, raise_exc, error_code):
     return decorated
 
 
+def deadline_guard(conn, cursor, statement, params, context, executemany):
+    """Fail fast instead of querying once the deadline of current request
+    is spent. Running statements are not interrupted, as killing a driver
+    in the middle of a reply leaves the pooled connection unusable."""
+    g.check_deadline()
+
+
 def sql_commenter(conn, cursor, statement, params, context, executemany):
     if hasattr(g, 'call_meta_data') and 'request_id' in g.call_meta_data:
         request_id = g.get_call_meta('request_id')
         rpc_id = g.get_call_meta('seq')
         role = conn._execution_options.get('role', 'unknown')
-        statement = "/* E:rid=%s&rpcid=%s&role=%s:E */ %s" % (
+        statement = "%srid=%s&rpcid=%s&role=%s%s%s" % (
+            SQL_COMMENT_START,
             request_id,
             rpc_id,
             role,
+            SQL_COMMENT_END,
             statement
         )
     return statement, params
@@ -199,6 +285,7 @@ class RecycleField(object):
 class DBManager(object):
     def __init__(self):
         self.session_map = {}
+        self.balancer_map = {}
 
     def create_sessions(self):
         for db, db_configs in settings.DB_SETTINGS.iteritems():
@@ -217,8 +304,33 @@ class DBManager(object):
                              "please check your config".format(name))
         session = self._make_session(name, config)
         self.session_map[name] = session
+        self.balancer_map[name] = session.session_factory.kw['balancer']
         return session
 
+    def get_balancer_stats(self, name):
+        """Current weights and latencies of replicas of session ``name``,
+        e.g.::
+
+            {'slave': {'weight': 1, 'latency': 0.002, 'outstanding': 0,
+                       'fails': 0, 'ejected': False}}
+        """
+        return self.balancer_map[name].stats()
+
+    @classmethod
+    def _make_balancer(cls, engines, config):
+        slave_engines = {role: e for role, e in engines.iteritems()
+                         if role != 'master'}
+        balancer = make_balancer(
+            config.get('balancer', settings.DB_BALANCER),
+            slave_engines,
+            weights=config.get('weights'),
+            decay=config.get('ewma_decay', settings.DB_BALANCER_EWMA_DECAY),
+            max_fails=config.get('max_fails', settings.DB_REPLICA_MAX_FAILS),
+            eject_seconds=config.get('eject_seconds',
+                                     settings.DB_REPLICA_EJECT_SECONDS))
+        get_sql_logger().add_listener(balancer)
+        return balancer
+
     @classmethod
     def _make_session(cls, db, config):
         urls = config['urls']
@@ -233,7 +345,15 @@ class DBManager(object):
                 pool_recycle=pool_recycle, execution_options={'role': role})
             for role, dsn in urls.iteritems()
         }
-        return make_session(engines, info={"name": db})
+        balancer = cls._make_balancer(engines, config)
+        probe = make_replication_probe(
+            config.get('replication_probe'),
+            ttl=config.get('replication_probe_ttl',
+                           settings.DB_REPLICATION_PROBE_TTL))
+        return make_session(
+            engines, info={"name": db}, balancer=balancer,
+            sticky_window=config.get('read_your_writes', 0),
+            replication_probe=probe)
 
     def close_sessions(self, should_close_connection=False):
         dbsessions = self.session_map
@@ -251,6 +371,7 @@ class DBManager(object):
     @classmethod
     def create_engine(cls, *args, **kwds):
         engine = patch_engine(sqlalchemy_create_engine(*args, **kwds))
+        event.listen(engine, 'before_cursor_execute', deadline_guard)
         get_sql_logger().register(engine)
         event.listen(engine, 'before_cursor_execute', sql_commenter,
                      retval=True)
@@ -1,5 +1,17 @@
 # -*- coding: utf-8 -*-
 
+from .consts import (
+    DEFAULT_TOO_BUSY_ERROR_CODE,
+    DEFAULT_TOO_BUSY_EXC_NAME,
+    DEFAULT_TOO_BUSY_MSG,
+    DEFAULT_BACKOFF_ERROR_CODE,
+    DEFAULT_BACKOFF_EXC_NAME,
+    DEFAULT_BACKOFF_MSG,
+    DEFAULT_DEADLINE_EXCEEDED_ERROR_CODE,
+    DEFAULT_DEADLINE_EXCEEDED_EXC_NAME,
+    DEFAULT_DEADLINE_EXCEEDED_MSG,
+)
+
 
 class ServerRestartException(Exception):
     """Raised if a `ping` request incomes but our sever is shutting down."""
@@ -10,6 +22,45 @@ class ArchWarningException(Exception):
     pass
 
 
+###
+# System Exc
+###
+
+class ArchSystemExc(Exception):
+    """ System base exc, carries an error ``code`` and ``name`` """
+    code = None
+    name = None
+    message = None
+    status_code = 503
+
+    def __init__(self, message=None):
+        if message is not None:
+            self.message = message
+        super(ArchSystemExc, self).__init__(self.message)
+
+
+class ArchTooBusyExc(ArchSystemExc):
+    """Raised when a concurrency limit is reached."""
+    code = DEFAULT_TOO_BUSY_ERROR_CODE
+    name = DEFAULT_TOO_BUSY_EXC_NAME
+    message = DEFAULT_TOO_BUSY_MSG
+
+
+class ArchBackoffExc(ArchSystemExc):
+    """Raised when a dependency is known to be unhealthy, retry later."""
+    code = DEFAULT_BACKOFF_ERROR_CODE
+    name = DEFAULT_BACKOFF_EXC_NAME
+    message = DEFAULT_BACKOFF_MSG
+
+
+class ArchDeadlineExceededExc(ArchSystemExc):
+    """Raised when the deadline of current request is spent."""
+    code = DEFAULT_DEADLINE_EXCEEDED_ERROR_CODE
+    name = DEFAULT_DEADLINE_EXCEEDED_EXC_NAME
+    message = DEFAULT_DEADLINE_EXCEEDED_MSG
+    status_code = 504
+
+
 ###
 # Message's Exc
 ###
@@ -29,3 +80,17 @@ class ConsumerConfigBadFormatExc(ArchMessageExc):
 
 class BrokerUrlsNotConfigedExc(ArchMessageExc):
     message = 'Message queue\'s broker urls is not configured in app.yaml'
+
+
+class TaskBatchSendExc(ArchMessageExc):
+    """Raised when tasks of a batch failed to send, ``errors`` are
+    ``[(task, exc), ...]`` of all of them and ``results`` the results of
+    the batch, ``None`` for the failed ones."""
+
+    def __init__(self, errors, results):
+        self.errors = errors
+        self.results = results
+        self.message = 'Failed to send {} of {} batched tasks: {}'.format(
+            len(errors), len(results), ', '.join(
+                '{}.{}'.format(task[0], task[1]) for task, _ in errors))
+        super(TaskBatchSendExc, self).__init__(self.message)
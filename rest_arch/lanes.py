@@ -0,0 +1,203 @@
+# -*- coding: utf-8 -*-
+
+"""
+rest_arch.lanes
+~~~~~~~~~~~~~~~
+
+Priority lanes of async tasks, declared as ``async_workers`` in
+``app.yaml``::
+
+    async_workers:
+      - name: order_critical
+        priority: 10
+        match: ['biz.order.make_order', 'biz.order.pay_*']
+        concurrency: 20
+        prefetch: 1
+        soft_time_limit: 5
+        time_limit: 10
+        max_retries: 3
+        retry_wait: 1
+      - name: signals
+        priority: -10
+        match: ['*.signal_*']
+        concurrency: 4
+        prefetch: 8
+
+Each entry is a queue with routing key ``api.<name>``. A task goes to
+the lane given by its ``lane`` kwarg, otherwise to the highest priority
+lane whose ``match`` patterns (``service.api``, default ``<name>.*``)
+match. A worker of a lane is started with ``SKT_ASYNC_LANE=<name>``, it
+then consumes the lane's queue with the lane's concurrency, prefetch and
+time limits.
+"""
+
+import os
+import time
+import fnmatch
+import logging
+
+from .log import logging_meta
+
+logger = logging.getLogger(__name__)
+
+LANE_ENVVAR = 'SKT_ASYNC_LANE'
+
+# queue latency histogram buckets, in seconds
+BUCKETS = (0.01, 0.05, 0.1, 0.5, 1, 5, 30, 60)
+
+
+class LaneStats(object):
+    """Queue latency of tasks consumed from a lane."""
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.histogram = [0] * (len(BUCKETS) + 1)
+
+    def add(self, latency):
+        latency = max(latency, 0)
+        self.count += 1
+        self.total += latency
+        self.max = max(self.max, latency)
+        for i, bucket in enumerate(BUCKETS):
+            if latency <= bucket:
+                self.histogram[i] += 1
+                break
+        else:
+            self.histogram[-1] += 1
+
+    def to_dict(self):
+        histogram = ['<=%gs:%d' % kv for kv in zip(BUCKETS, self.histogram)]
+        histogram.append('>%gs:%d' % (BUCKETS[-1], self.histogram[-1]))
+        return {
+            'count': self.count,
+            'avg': self.total / self.count if self.count else 0,
+            'max': self.max,
+            'histogram': ','.join(histogram),
+        }
+
+
+class Lane(object):
+
+    OPTIONS = ('name', 'priority', 'match', 'concurrency', 'prefetch',
+               'soft_time_limit', 'time_limit', 'max_retries', 'retry_wait')
+
+    def __init__(self, name, priority=0, match=None, concurrency=None,
+                 prefetch=None, soft_time_limit=None, time_limit=None,
+                 max_retries=None, retry_wait=None):
+        self.name = name
+        self.priority = priority
+        self.match = tuple(match or ('{}.*'.format(name), ))
+        self.concurrency = concurrency
+        self.prefetch = prefetch
+        self.soft_time_limit = soft_time_limit
+        self.time_limit = time_limit
+        self.max_retries = max_retries
+        self.retry_wait = retry_wait
+        self.stats = LaneStats()
+
+    @property
+    def routing_key(self):
+        return 'api.{}'.format(self.name)
+
+    def matches(self, service, api):
+        key = '{}.{}'.format(service, api)
+        return any(fnmatch.fnmatchcase(key, p) for p in self.match)
+
+    def route(self):
+        """Routing options of tasks sent to this lane."""
+        route = {'queue': self.name}
+        if self.soft_time_limit is not None:
+            route['soft_time_limit'] = self.soft_time_limit
+        if self.time_limit is not None:
+            route['time_limit'] = self.time_limit
+        return route
+
+    def worker_settings(self):
+        """Celery settings of a worker consuming this lane."""
+        conf = {}
+        if self.concurrency is not None:
+            conf['CELERYD_CONCURRENCY'] = self.concurrency
+        if self.prefetch is not None:
+            conf['CELERYD_PREFETCH_MULTIPLIER'] = self.prefetch
+        if self.soft_time_limit is not None:
+            conf['CELERYD_TASK_SOFT_TIME_LIMIT'] = self.soft_time_limit
+        if self.time_limit is not None:
+            conf['CELERYD_TASK_TIME_LIMIT'] = self.time_limit
+        return conf
+
+
+class Lanes(object):
+    """Lanes ordered by priority, highest first."""
+
+    def __init__(self, lanes=()):
+        self.lanes = sorted(lanes, key=lambda l: -l.priority)
+        self.by_name = {lane.name: lane for lane in self.lanes}
+        self._selected = {}
+
+    @classmethod
+    def from_config(cls, async_workers):
+        lanes = []
+        for conf in async_workers or ():
+            unknown = set(conf) - set(Lane.OPTIONS)
+            if unknown:
+                logger.warn('unknown options of async worker %s: %s',
+                            conf.get('name'), ', '.join(sorted(unknown)))
+            lanes.append(Lane(**{k: v for k, v in conf.iteritems()
+                                 if k in Lane.OPTIONS}))
+        return cls(lanes)
+
+    def __iter__(self):
+        return iter(self.lanes)
+
+    def get(self, name):
+        return self.by_name.get(name)
+
+    def select(self, service, api, lane=None):
+        """Lane of a task, ``None`` if no lane matches."""
+        if lane is not None and lane in self.by_name:
+            return self.by_name[lane]
+        key = (service, api)
+        try:
+            return self._selected[key]
+        except KeyError:
+            for candidate in self.lanes:
+                if candidate.matches(service, api):
+                    break
+            else:
+                candidate = None
+            self._selected[key] = candidate
+            return candidate
+
+    def current(self):
+        """Lane consumed by this worker, by ``SKT_ASYNC_LANE``."""
+        return self.get(os.environ.get(LANE_ENVVAR))
+
+    def record_latency(self, lane, sent_at, countdown=0):
+        if lane is None or sent_at is None:
+            return
+        lane.stats.add(time.time() - sent_at - (countdown or 0))
+
+    def stats(self):
+        return {lane.name: lane.stats.to_dict() for lane in self.lanes}
+
+    def log_stats(self):
+        for name, stats in self.stats().iteritems():
+            with logging_meta(**stats):
+                logger.info('async lane %s queue latency', name)
+
+
+lanes = None
+
+
+def get_lanes():
+    global lanes
+    if lanes is None:
+        from .skt.env import is_in_container
+        async_workers = None
+        if is_in_container():
+            from .skt.config import load_app_config
+            async_workers = load_app_config().async_workers
+        lanes = Lanes.from_config(async_workers)
+    return lanes
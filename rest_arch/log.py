@@ -2,13 +2,30 @@
 
 import logging
 import os
+import re
+import json
 import time
+import atexit
 import contextlib
+import collections
+import socket
 import threading
+import weakref
+from logging.handlers import SysLogHandler, SYSLOG_UDP_PORT
 
 from sqlalchemy import event
 
-from .consts import PLACE_HOLDER
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+from .consts import (
+    PLACE_HOLDER,
+    SENSITIVE_PLACE_HOLDER,
+    SQL_COMMENT_START,
+    SQL_COMMENT_END
+)
 from .utils import LIB_DIR_PATH
 
 from .skt.config import load_app_config
@@ -16,6 +33,8 @@ from .skt import env
 from .ctx import g
 from .conf import settings
 
+logger = logging.getLogger(__name__)
+
 
 def obj2str(obj):
     """Try to convert an object to string format."""
@@ -26,6 +45,24 @@ def obj2str(obj):
     return repr(obj)
 
 
+def obj2text(obj):
+    """Decode byte strings in ``obj`` (recursively) as UTF-8, a JSON
+    encoder fails to join non-ASCII bytes with unicode."""
+    if isinstance(obj, str):
+        return obj.decode('utf8', 'replace')
+    elif isinstance(obj, dict):
+        return {obj2text(k): obj2text(v) for k, v in obj.iteritems()}
+    elif isinstance(obj, (list, tuple)):
+        return [obj2text(v) for v in obj]
+    return obj
+
+
+def render_logging_meta(meta):
+    """Render logging meta as `` k => v`` pairs."""
+    return ''.join(' %s => %s' % (obj2str(k), obj2str(v))
+                   for k, v in meta.iteritems())
+
+
 @contextlib.contextmanager
 def logging_meta(**kwargs):
     """Logging with key-value meta, e.g.
@@ -33,9 +70,14 @@ def logging_meta(**kwargs):
 
         with logging_meta(key=val) as ctx:
             # do logging
+
+    The rendered meta is cached until the context exits, so the yielded
+    dict is read-only: changes made to it in the block are not logged,
+    nest another ``logging_meta`` instead.
     """
     conflicts = {}
     meta = g.logging_meta
+    origin_rendered = g.rendered_logging_meta
 
     # if has conflicts, record the original kvs
     for key in kwargs:
@@ -44,12 +86,14 @@ def logging_meta(**kwargs):
 
     try:
         meta.update(kwargs)
+        g.rendered_logging_meta = render_logging_meta(meta)
         yield meta
     finally:
         # recovery the original conflict kvs
         for key in kwargs:
             meta.pop(key)
         meta.update(conflicts)
+        g.rendered_logging_meta = origin_rendered
 
 
 class RestFormatter(logging.Formatter):
@@ -66,37 +110,447 @@ class RestFormatter(logging.Formatter):
 
     """
 
+    def __init__(self, *args, **kwargs):
+        super(RestFormatter, self).__init__(*args, **kwargs)
+        self._app_id = None
+
+    @property
+    def app_id(self):
+        if self._app_id is None:
+            self._app_id = load_app_config().app_id
+        return self._app_id
+
+    def _required_meta(self):
+        """``[app_id rpc_id request_id]``, cached per call meta."""
+        call_meta = g.call_meta_data
+        key = (call_meta.get('request_id', PLACE_HOLDER),
+               call_meta.get('seq', PLACE_HOLDER))
+        if g.required_logging_meta_key != key:
+            # a byte string, unicode would fail to join utf-8 messages
+            g.required_logging_meta = '[%s %s %s]' % (
+                obj2str(self.app_id), obj2str(key[1]), obj2str(key[0]))
+            g.required_logging_meta_key = key
+        return g.required_logging_meta
+
     def _format(self, msg):
         # required meta
-        app_id = load_app_config().app_id
-        request_id = g.get_call_meta('request_id')
-        rpc_id = g.get_call_meta('seq')
-        required_meta = '[{0} {1} {2}]'.format(app_id, rpc_id, request_id)
+        required_meta = self._required_meta()
 
         # extra_meta
-        metas = [required_meta]
+        extra_meta = ''
         if g.logging_meta:
-            for item in g.logging_meta.iteritems():
-                k, v = map(obj2str, item)
-                extra_meta = '%s => %s' % (k, v)
-                metas.append(extra_meta)
-
-        # meta
-        meta = ' '.join(metas)
-        # body
-        body = obj2str(msg)
+            extra_meta = g.rendered_logging_meta
+            if extra_meta is None:
+                extra_meta = render_logging_meta(g.logging_meta)
+
         # join msg
-        return ' ## '.join([meta, body])
+        return '%s%s ## %s' % (required_meta, extra_meta, obj2str(msg))
 
     def format(self, record):
         record.msg = self._format(record.msg)
         return super(RestFormatter, self).format(record)
 
 
+class StructuredFormatter(RestFormatter):
+    """Serialize record, call meta and logging meta as a compact JSON
+    line or msgpack frame, instead of the ``k => v .. ## msg`` text::
+
+        {"ts":1476778222.1,"level":"INFO","name":"foo","pid":1,
+         "app_id":"skt.foo","rpc_id":"1","request_id":"ab12",
+         "meta":{"k":"v"},"msg":"hello"}
+
+    :param serializer: ``json`` or ``msgpack``
+    """
+
+    def __init__(self, fmt=None, datefmt=None, serializer='json'):
+        super(StructuredFormatter, self).__init__(fmt, datefmt)
+        self.serializer = serializer
+        if serializer == 'json':
+            self._encode = json.JSONEncoder(
+                separators=(',', ':'), default=lambda o: obj2text(obj2str(o)),
+                ensure_ascii=False).encode
+        elif serializer == 'msgpack':
+            if msgpack is None:
+                raise RuntimeError('msgpack is required by {!r} serializer'
+                                   .format(serializer))
+            self._encode = msgpack.Packer(default=obj2str).pack
+        else:
+            raise ValueError('Unknown serializer: {!r}'.format(serializer))
+
+    def format(self, record):
+        call_meta = g.call_meta_data
+        data = {
+            'ts': record.created,
+            'level': record.levelname,
+            'name': record.name,
+            'pid': record.process,
+            'app_id': self.app_id,
+            'rpc_id': call_meta.get('seq', PLACE_HOLDER),
+            'request_id': call_meta.get('request_id', PLACE_HOLDER),
+            'msg': record.getMessage(),
+        }
+        if g.logging_meta:
+            data['meta'] = g.logging_meta
+        if record.exc_info:
+            if not record.exc_text:
+                record.exc_text = self.formatException(record.exc_info)
+            data['exc'] = record.exc_text
+        return self._encode(obj2text(data))
+
+
+class StructuredStreamHandler(logging.StreamHandler):
+    """Write :class:`StructuredFormatter` output, JSON lines are
+    newline terminated while msgpack frames are written as is."""
+
+    def emit(self, record):
+        try:
+            data = self.format(record)
+            if isinstance(data, unicode):
+                data = data.encode('utf8')
+            if getattr(self.formatter, 'serializer', 'json') == 'json':
+                data += '\n'
+            self.stream.write(data)
+            self.flush()
+        except (KeyboardInterrupt, SystemExit):
+            raise
+        except:
+            self.handleError(record)
+
+
+class SysLogSendMixin(object):
+    """Encode and send records the way :class:`SysLogHandler` does, with
+    the trailing NUL byte controlled by ``append_nul``."""
+    append_nul = True
+
+    def encode_record(self, record):
+        msg = self.format(record)
+        if self.append_nul:
+            msg += '\000'
+        prio = '<%d>' % self.encodePriority(
+            self.facility, self.mapPriority(record.levelname))
+        if type(msg) is unicode:
+            msg = msg.encode('utf-8')
+        return prio + msg
+
+    def send(self, msg):
+        if self.unixsocket:
+            try:
+                self.socket.send(msg)
+            except socket.error:
+                self.socket.close()
+                self._connect_unixsocket(self.address)
+                self.socket.send(msg)
+        elif self.socktype == socket.SOCK_DGRAM:
+            self.socket.sendto(msg, self.address)
+        else:
+            self.socket.sendall(msg)
+
+
+class StructuredSysLogHandler(SysLogSendMixin, SysLogHandler):
+    """SysLogHandler without the trailing NUL byte, so each datagram
+    carries exactly one structured record."""
+    append_nul = False
+
+    def emit(self, record):
+        try:
+            self.send(self.encode_record(record))
+        except (KeyboardInterrupt, SystemExit):
+            raise
+        except:
+            self.handleError(record)
+
+
+class BufferedSysLogHandler(SysLogSendMixin, SysLogHandler):
+    """Non-blocking SysLogHandler: records are formatted on the caller
+    (call meta is request scoped) and queued, a background worker sends
+    them in batches of at most ``batch_size`` records, one datagram per
+    record.
+
+    When syslog stalls, the worker backs off and the queue fills up, then
+    new records are dropped (``overflow='drop'``) or the caller waits up
+    to ``block_timeout`` seconds for room (``overflow='block'``) before
+    dropping. Counters are available in :meth:`stats`.
+    """
+
+    def __init__(self, address=('localhost', SYSLOG_UDP_PORT),
+                 facility=SysLogHandler.LOG_USER, socktype=None,
+                 capacity=10000, batch_size=100, flush_interval=0.05,
+                 overflow='drop', block_timeout=0.1):
+        if socktype is None:
+            SysLogHandler.__init__(self, address, facility)
+        else:
+            SysLogHandler.__init__(self, address, facility, socktype)
+        self.capacity = capacity
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.overflow = overflow
+        self.block_timeout = block_timeout
+        self.queued = 0
+        self.sent = 0
+        self.dropped = 0
+        self.errors = 0
+        self._queue = collections.deque()
+        self._send_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._worker_pid = None
+        buffered_handlers.add(self)
+
+    def _ensure_worker(self):
+        # started lazily so that forked workers run their own
+        if self._worker_pid == os.getpid():
+            return
+        self._worker_pid = os.getpid()
+        worker = threading.Thread(target=self._worker, args=())
+        worker.setDaemon(True)
+        worker.start()
+
+    def emit(self, record):
+        try:
+            msg = self.encode_record(record)
+        except (KeyboardInterrupt, SystemExit):
+            raise
+        except:
+            self.handleError(record)
+            return
+        self._ensure_worker()
+        if len(self._queue) >= self.capacity and self.overflow == 'block':
+            deadline = time.time() + self.block_timeout
+            while len(self._queue) >= self.capacity and \
+                    time.time() < deadline:
+                self._wakeup.set()
+                time.sleep(0.001)
+        if len(self._queue) >= self.capacity:
+            self.dropped += 1
+            return
+        self._queue.append(msg)
+        self.queued += 1
+        if len(self._queue) >= self.batch_size:
+            self._wakeup.set()
+
+    def _send_batch(self):
+        """Send at most ``batch_size`` queued records, return whether the
+        queue is drained, raise if syslog fails."""
+        with self._send_lock:
+            for _ in xrange(self.batch_size):
+                try:
+                    msg = self._queue.popleft()
+                except IndexError:
+                    return True
+                try:
+                    self.send(msg)
+                except Exception:
+                    self._queue.appendleft(msg)
+                    raise
+                self.sent += 1
+        return not self._queue
+
+    def _worker(self):
+        # started lazily in a request, don't keep its context (a patched
+        # thread is a greenlet)
+        g.clear_all()
+        backoff = 0
+        while True:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                while not self._send_batch():
+                    pass
+                backoff = 0
+            except Exception:
+                self.errors += 1
+                backoff = min(backoff * 2 or 0.01, 1)
+                time.sleep(backoff)
+
+    def flush(self, timeout=1):
+        """Send queued records in current thread, give up after
+        ``timeout`` seconds."""
+        deadline = time.time() + timeout
+        try:
+            while not self._send_batch() and time.time() < deadline:
+                pass
+        except Exception:
+            self.errors += 1
+
+    def close(self):
+        self.flush()
+        buffered_handlers.discard(self)
+        SysLogHandler.close(self)
+
+    def stats(self):
+        return {
+            'queued': self.queued,
+            'sent': self.sent,
+            'dropped': self.dropped,
+            'errors': self.errors,
+            'pending': len(self._queue),
+        }
+
+
+class BufferedStructuredSysLogHandler(BufferedSysLogHandler):
+    """:class:`BufferedSysLogHandler` for structured records."""
+    append_nul = False
+
+
+buffered_handlers = weakref.WeakSet()
+
+
+def flush_buffered_handlers(timeout=1):
+    """Flush all :class:`BufferedSysLogHandler`, called when gunicorn
+    worker exits."""
+    for handler in list(buffered_handlers):
+        handler.flush(timeout)
+
+
 #########
 # SQL Logging
 #########
 
+_PARAM_RE = re.compile(r"%\((\w+)\)s|%s|\?|(?<![:\w]):(\w+)")
+_IDENT = r"([`\"]?[A-Za-z_][\w$]*[`\"]?(?:\.[`\"]?[A-Za-z_][\w$]*[`\"]?)?)"
+_WORD_RE = re.compile(r"[A-Za-z_][\w$]*")
+_PH = r"(?:%\(\w+\)s|%s|\?|:\w+)"
+# column of the param at the end of statement prefix
+_COLUMN_RES = [re.compile(p, re.I) for p in (
+    _IDENT + r"\s*(?:=|!=|<>|<=|>=|<|>)\s*$",
+    _IDENT + r"\s+(?:NOT\s+)?(?:LIKE|REGEXP)\s*$",
+    _IDENT + r"\s+(?:NOT\s+)?IN\s*\((?:\s*" + _PH + r"\s*,)*\s*$",
+    _IDENT + r"\s+(?:NOT\s+)?BETWEEN\s+(?:" + _PH + r"\s+AND\s+)?$",
+)]
+_INSERT_RE = re.compile(
+    r"^\s*(?:INSERT|REPLACE)\s+(?:IGNORE\s+)?(?:INTO\s+)?\S+\s*"
+    r"\(([^)]*)\)\s*VALUES", re.I)
+
+
+def strip_sql_comment(statement):
+    """Strip the comment prepended by :func:`rest_arch.db.sql_commenter`,
+    which differs per request."""
+    if statement.startswith(SQL_COMMENT_START):
+        end = statement.find(SQL_COMMENT_END)
+        if end != -1:
+            return statement[end + len(SQL_COMMENT_END):]
+    return statement
+
+
+def _normalize_column(ident):
+    return ident.replace('`', '').replace('"', '').rsplit('.', 1)[-1]
+
+
+def _values_end(statement, start):
+    """End of the ``(..), (..)`` row list of ``VALUES`` at ``start``."""
+    end = start
+    depth = 0
+    quote = None
+    for pos in xrange(start, len(statement)):
+        c = statement[pos]
+        if quote:
+            if c == quote:
+                quote = None
+        elif c in '\'"`':
+            quote = c
+        elif c == '(':
+            depth += 1
+        elif c == ')':
+            depth -= 1
+            if depth == 0:
+                end = pos + 1
+        elif depth == 0 and c != ',' and not c.isspace():
+            break
+    return end
+
+
+class StatementTemplate(object):
+    """Precomputed logging text and per parameter sensitive mask of a
+    statement, params of sensitive columns (or of unknown columns if
+    any sensitive field appears in the statement) are redacted.
+    """
+
+    def __init__(self, statement, sens_fields):
+        tokens = statement.split()
+        self.text = obj2str(' '.join(tokens))
+        self.positions = set()
+        self.names = set()
+        if not sens_fields:
+            return
+        has_sens_field = bool(set(_WORD_RE.findall(statement)) & sens_fields)
+
+        insert = _INSERT_RE.match(statement)
+        if insert:
+            columns = [_normalize_column(c.strip())
+                       for c in insert.group(1).split(',')]
+            values_start = insert.end()
+            values_end = _values_end(statement, values_start)
+        values_index = 0
+
+        for index, match in enumerate(_PARAM_RE.finditer(statement)):
+            name = match.group(1) or match.group(2)
+            column = None
+            if insert and values_start < match.start() < values_end:
+                # params of the rows map to the columns by position
+                column = columns[values_index % len(columns)]
+                values_index += 1
+            else:
+                prefix = statement[max(0, match.start() - 256):match.start()]
+                for regex in _COLUMN_RES:
+                    found = regex.search(prefix)
+                    if found:
+                        column = _normalize_column(found.group(1))
+                        break
+            if column is None:
+                sensitive = has_sens_field
+            else:
+                sensitive = column in sens_fields
+            if sensitive:
+                self.positions.add(index)
+                if name:
+                    self.names.add(name)
+
+    def _mask(self, params):
+        if isinstance(params, dict):
+            return {k: SENSITIVE_PLACE_HOLDER if k in self.names else v
+                    for k, v in params.iteritems()}
+        return tuple(SENSITIVE_PLACE_HOLDER if i in self.positions else v
+                     for i, v in enumerate(params))
+
+    def mask_params(self, params):
+        if params is None:
+            return PLACE_HOLDER
+        if not self.positions:
+            return obj2str(params)
+        if isinstance(params, list) and params and \
+                isinstance(params[0], (tuple, list, dict)):
+            # executemany
+            return obj2str([self._mask(p) for p in params])
+        return obj2str(self._mask(params))
+
+
+class StatementTemplateCache(object):
+    """LRU cache of :class:`StatementTemplate` keyed by statement, as
+    SQLAlchemy reuses the same statement string across executions."""
+
+    def __init__(self, sens_fields, maxsize=1000):
+        self.sens_fields = sens_fields
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._templates = collections.OrderedDict()
+
+    def __len__(self):
+        return len(self._templates)
+
+    def get(self, statement):
+        statement = strip_sql_comment(statement)
+        try:
+            template = self._templates.pop(statement)
+        except KeyError:
+            self.misses += 1
+            template = StatementTemplate(statement, self.sens_fields)
+            while len(self._templates) >= self.maxsize:
+                self._templates.popitem(last=False)
+        else:
+            self.hits += 1
+        self._templates[statement] = template
+        return template
+
 
 class SQLLogger(object):
     """SQL logger listens sqlalchemy events on ``engines`` and emits
@@ -117,6 +571,9 @@ class SQLLogger(object):
         self.ctx.disable_sql_logging = False
         self.ctx.sql_start_time = None
         self.switch = lambda: False
+        self.listeners = []
+        self.buffer = None
+        self.templates = StatementTemplateCache(self.DB_SENSFIELDS)
 
     def use_switch(self, fn):
         """
@@ -126,6 +583,20 @@ class SQLLogger(object):
         """
         self.switch = fn
 
+    def add_listener(self, listener):
+        """Add a listener which is notified of every cursor execution, no
+        matter the logging switch is on or not. A listener provides::
+
+            on_sql_start(conn, statement, params)
+            on_sql_end(conn, statement, params, cost, exc=None)
+        """
+        if listener not in self.listeners:
+            self.listeners.append(listener)
+
+    def remove_listener(self, listener):
+        if listener in self.listeners:
+            self.listeners.remove(listener)
+
     def register(self, engine):
         event.listen(engine, 'before_cursor_execute',
                      self.before_cursor_execute)
@@ -157,26 +628,47 @@ class SQLLogger(object):
         if not hasattr(self.ctx, 'disable_sql_logging'):
             self.ctx.disable_sql_logging = False
         self.ctx.sql_start_time = time.time()
+        for listener in self.listeners:
+            try:
+                listener.on_sql_start(conn, statement, params)
+            except Exception:
+                logger.exception(
+                    'Error notifying sql listener %r', listener)
 
     def after_cursor_execute(self, conn, cursor, statement,
                              params, context, executemany):
-        self._do_logging(self._get_logging_ctx(conn), statement,
-                         params=params, exc=None)
+        self._notify_sql_end(conn, statement, params, None)
+        self._log(conn.connection.connection, conn.engine.driver,
+                  statement, params=params, exc=None)
 
     def handle_dbapi_error(self, conn, cursor, statement,
                            params, context, exception):
-        self._do_logging(self._get_logging_ctx(conn), statement,
-                         params=params, exc=exception)
+        self._notify_sql_end(conn, statement, params, exception)
+        self._log(conn.connection.connection, conn.engine.driver,
+                  statement, params=params, exc=exception)
+
+    def _notify_sql_end(self, conn, statement, params, exc):
+        if not self.listeners:
+            return
+        cost = None
+        if getattr(self.ctx, 'sql_start_time', None) is not None:
+            cost = time.time() - self.ctx.sql_start_time
+        for listener in self.listeners:
+            try:
+                listener.on_sql_end(conn, statement, params, cost, exc)
+            except Exception:
+                logger.exception(
+                    'Error notifying sql listener %r', listener)
 
     def on_commit(self, conn):
-        self._do_logging(self._get_logging_ctx(conn), 'COMMIT')
+        self._log(conn.connection.connection, conn.engine.driver, 'COMMIT')
 
     def on_rollback(self, conn):
-        self._do_logging(self._get_logging_ctx(conn), 'ROLLBACK')
+        self._log(conn.connection.connection, conn.engine.driver,
+                  'ROLLBACK')
 
     def on_connect(self, dbapi_conn, conn_record):
-        self._do_logging(self._get_logging_ctx_by_dbapi_conn(dbapi_conn),
-                         'Connection Open')
+        self._log(dbapi_conn, None, 'Connection Open')
 
     def _get_logging_ctx(self, conn):
         return self._get_logging_ctx_by_dbapi_conn(conn.connection.connection,
@@ -208,18 +700,21 @@ class SQLLogger(object):
                         autocommit=dbapi_conn.autocommit)
         return default
 
-    def _do_logging(self, ctx, statement, params=None, exc=None):
+    def _should_log(self):
         if not hasattr(self, 'switch') or (
                 callable(self.switch) and not self.switch()):
             # there's not a switch or there's a switch and it gives us `off`
-            return
+            return False
 
         if getattr(self.ctx, 'disable_sql_logging', False):
             # switch is `on` but logging is temply disabled for
             # current thread.
-            return
+            return False
+        return True
 
-        meta = {}
+    def _log(self, dbapi_conn, driver, statement, params=None, exc=None):
+        if not self._should_log():
+            return
 
         # time cost
         cost = None
@@ -227,6 +722,26 @@ class SQLLogger(object):
             cost = time.time() - self.ctx.sql_start_time
             self.ctx.sql_start_time = None
 
+        session_id = getattr(self.ctx, 'current_session_id', PLACE_HOLDER)
+
+        # read now, the connection may be closed or reused by the time an
+        # async record is emitted
+        ctx = self._get_logging_ctx_by_dbapi_conn(dbapi_conn, driver)
+
+        if self.buffer is not None:
+            # async mode, only keep a compact record on the hot path
+            self.buffer.push((ctx, statement, params, exc, cost, session_id,
+                              g.get_call_meta('request_id'),
+                              g.get_call_meta('seq')))
+            return
+
+        self._do_logging(ctx, statement, params=params, exc=exc, cost=cost,
+                         session_id=session_id)
+
+    def _do_logging(self, ctx, statement, params=None, exc=None, cost=None,
+                    session_id=PLACE_HOLDER):
+        meta = {}
+
         if cost is None:
             meta['cost'] = PLACE_HOLDER
         else:
@@ -243,19 +758,12 @@ class SQLLogger(object):
         # result
         meta['res'] = exc or 'ok'
         # session id
-        meta['session'] = getattr(self.ctx, 'current_session_id', PLACE_HOLDER)
+        meta['session'] = session_id
 
         # filter senstive fields
-        statement_list = statement.split()
-        has_sens_field = set(statement_list) & SQLLogger.DB_SENSFIELDS
-        statement_ = obj2str(' '.join(statement_list))
-
-        if has_sens_field or params is None:
-            params_ = PLACE_HOLDER
-        else:
-            params_ = obj2str(params)
-
-        content = '{0} ## {1}'.format(statement_, params_)
+        template = self.templates.get(statement)
+        content = '{0} ## {1}'.format(template.text,
+                                      template.mask_params(params))
 
         with logging_meta(**meta):
             if exc is None:
@@ -268,6 +776,110 @@ class SQLLogger(object):
             else:
                 self.logger.error(content)
 
+    # async mode
+
+    def start_async(self, buffer_size=10000, batch_size=500,
+                    interval=0.1):
+        """Switch to async mode: the request greenlet only pushes a compact
+        record onto a bounded ring buffer, formatting, masking and
+        emitting are done in batches by a background worker. Oldest
+        records are dropped and counted when the buffer overflows.
+        """
+        if self.buffer is not None:
+            return
+        self.buffer = RingBuffer(buffer_size)
+        self.batch_size = batch_size
+        self.interval = interval
+        self.emitted = 0
+        worker = threading.Thread(target=self._async_worker, args=())
+        worker.setDaemon(True)
+        worker.start()
+        atexit.register(self.flush)
+
+    def _async_worker(self):
+        g.clear_all()
+        while True:
+            time.sleep(self.interval)
+            try:
+                while self._emit_batch():
+                    pass
+            except Exception:
+                logger.exception('Error emitting sql logs')
+
+    def _emit_batch(self):
+        """Emit at most ``batch_size`` records, return if there are more
+        records left."""
+        records = self.buffer.pop_many(self.batch_size)
+        if not records:
+            return False
+        call_meta = g.call_meta_data
+        origin = dict(call_meta)
+        try:
+            for (ctx, statement, params, exc, cost, session_id, request_id,
+                 rpc_id) in records:
+                call_meta['request_id'] = request_id
+                call_meta['seq'] = rpc_id
+                self._do_logging(ctx, statement, params=params, exc=exc,
+                                 cost=cost, session_id=session_id)
+                self.emitted += 1
+        finally:
+            call_meta.clear()
+            call_meta.update(origin)
+        return len(records) == self.batch_size
+
+    def flush(self):
+        """Emit all buffered records in current thread."""
+        if self.buffer is None:
+            return
+        while self._emit_batch():
+            pass
+
+    def stats(self):
+        stats = {
+            'template_hits': self.templates.hits,
+            'template_misses': self.templates.misses,
+            'template_size': len(self.templates),
+        }
+        if self.buffer is not None:
+            stats.update({
+                'pushed': self.buffer.pushed,
+                'dropped': self.buffer.dropped,
+                'pending': len(self.buffer),
+                'emitted': self.emitted,
+            })
+        return stats
+
+
+class RingBuffer(object):
+    """Bounded FIFO buffer which overwrites (and counts) the oldest
+    items once full."""
+
+    def __init__(self, size):
+        self.size = size
+        self.pushed = 0
+        self.dropped = 0
+        self._items = collections.deque()
+
+    def __len__(self):
+        return len(self._items)
+
+    def push(self, item):
+        if len(self._items) >= self.size:
+            self._items.popleft()
+            self.dropped += 1
+        self._items.append(item)
+        self.pushed += 1
+
+    def pop_many(self, n):
+        items = []
+        popleft = self._items.popleft
+        try:
+            for _ in xrange(n):
+                items.append(popleft())
+        except IndexError:
+            pass
+        return items
+
 sql_logger = None
 
 
@@ -277,4 +889,10 @@ def get_sql_logger():
         sql_logger = SQLLogger()
         env.require('settings_updated')
         sql_logger.use_switch(settings.SQLLOGGER_SWITCH)
+        sql_logger.templates.maxsize = settings.SQLLOGGER_TEMPLATE_CACHE_SIZE
+        if settings.SQLLOGGER_ASYNC:
+            sql_logger.start_async(
+                buffer_size=settings.SQLLOGGER_BUFFER_SIZE,
+                batch_size=settings.SQLLOGGER_BATCH_SIZE,
+                interval=settings.SQLLOGGER_FLUSH_INTERVAL)
     return sql_logger
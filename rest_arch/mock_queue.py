@@ -1,13 +1,19 @@
 # -*- coding: utf-8 -*-
+import os
+import time
+import heapq
 import logging
+import itertools
 
 import functools
-import threading
 import gevent
-from gevent.queue import Queue
-from .client import clients
+from gevent.event import Event
+from gevent.queue import Queue, Full
 from .conf import settings
-from .ves.env import is_in_container, is_in_dev
+from .ctx import g
+from .exc import ArchTooBusyExc
+from .routing import get_routing_table
+from .skt.env import is_in_container, is_in_dev
 
 logger = logging.getLogger(__name__)
 
@@ -28,12 +34,7 @@ class Task(object):
         return SimpleTask(service, api, args, kwargs)
 
     def call_api(self, service):
-        from .async import find_client
-
-        client = find_client(service, self.api)
-        countdown = self.kwargs.get('countdown')
-        if countdown:
-            gevent.sleep(countdown)
+        client = get_routing_table().find_client(service, self.api)
 
         if is_in_container():
             _client_ctx = client.connection_ctx
@@ -49,32 +50,130 @@ class Task(object):
 
 class SimpleTask(Task):
     def execute(self):
-        if self.service == 'ees':
+        if get_routing_table().is_skipped_in_memory_mq(self.service,
+                                                       self.api):
             return
         self.call_api(self.service)
 
 
 class SignalTask(Task):
     def execute(self):
-        signal = self.api
-
-        _get_slug = lambda x: x.split('.')[1]
-
-        for i in clients:
-            if signal in clients[i].apis:
-                self.call_api(_get_slug(i))
-
-
-def worker():
-    while True:
-        service, api, args, kwargs = tasks.get()
-        task = Task.create(service, api, args, kwargs)
-        t = threading.Thread(target=task.execute, args=())
-        t.setDaemon(True)
-        t.start()
-
+        for slug in get_routing_table().subscribers(self.api):
+            self.call_api(slug)
+
+
+class MemoryQueue(object):
+    """In-memory MQ used when ``USE_MEMORY_MQ`` is on: a bounded queue
+    consumed by a fixed number of worker greenlets, delayed tasks wait in
+    a timer heap instead of occupying workers::
+
+        tasks = MemoryQueue(maxsize=10000, workers=10)
+        tasks.put(('foo', 'bar', (1, ), {'countdown': 5}))
+
+    :param maxsize: max queued and delayed tasks, :meth:`put` blocks for
+                    ``put_timeout`` seconds then raises
+                    :class:`rest_arch.exc.ArchTooBusyExc` when full
+    """
+
+    def __init__(self, maxsize=10000, workers=10, put_timeout=1):
+        self.maxsize = maxsize
+        self.workers = workers
+        self.put_timeout = put_timeout
+        self.queue = Queue(maxsize)
+        self.running = 0
+        self.processed = 0
+        self.failed = 0
+        self.rejected = 0
+        self._delayed = []
+        self._seq = itertools.count()
+        self._delayed_changed = Event()
+        self._last_stats = (time.time(), 0)
+        self._greenlets = []
+        self._pid = None
+
+    def __len__(self):
+        return self.queue.qsize() + len(self._delayed)
+
+    def _ensure_workers(self):
+        if self._pid == os.getpid():
+            return
+        self._pid = os.getpid()
+        self._greenlets = [gevent.spawn(self._work)
+                           for _ in range(self.workers)]
+        self._greenlets.append(gevent.spawn(self._tick))
+
+    def put(self, item, block=True, timeout=None):
+        """Enqueue ``(service, api, args, kwargs)``, tasks with a
+        ``countdown`` in kwargs are delayed."""
+        self._ensure_workers()
+        countdown = item[3].get('countdown')
+        if countdown:
+            if len(self) >= self.maxsize:
+                self.rejected += 1
+                raise ArchTooBusyExc()
+            heapq.heappush(self._delayed,
+                           (time.time() + countdown, next(self._seq), item))
+            self._delayed_changed.set()
+            return
+        if timeout is None:
+            timeout = self.put_timeout
+        try:
+            self.queue.put(item, block=block, timeout=timeout)
+        except Full:
+            self.rejected += 1
+            raise ArchTooBusyExc()
+
+    def put_nowait(self, item):
+        self.put(item, block=False)
+
+    def _tick(self):
+        """Move due tasks of the timer heap into the queue."""
+        # workers may be started in a request, don't keep its context
+        g.clear_all()
+        delayed = self._delayed
+        while True:
+            self._delayed_changed.clear()
+            now = time.time()
+            while delayed and delayed[0][0] <= now:
+                self.queue.put(heapq.heappop(delayed)[2])
+            timeout = delayed[0][0] - now if delayed else None
+            self._delayed_changed.wait(timeout)
+
+    def _work(self):
+        g.clear_all()
+        while True:
+            service, api, args, kwargs = self.queue.get()
+            self.running += 1
+            try:
+                Task.create(service, api, args, kwargs).execute()
+            except Exception:
+                self.failed += 1
+                logger.exception('Error executing task {}.{}{}'.format(
+                    service, api, args))
+            finally:
+                self.running -= 1
+                self.processed += 1
+
+    def stats(self):
+        """Queue depth and throughput (tasks per second since the last
+        call)."""
+        now = time.time()
+        last_time, last_processed = self._last_stats
+        self._last_stats = (now, self.processed)
+        elapsed = now - last_time
+        return {
+            'depth': self.queue.qsize(),
+            'delayed': len(self._delayed),
+            'running': self.running,
+            'processed': self.processed,
+            'failed': self.failed,
+            'rejected': self.rejected,
+            'throughput': ((self.processed - last_processed) / elapsed
+                           if elapsed > 0 else 0),
+        }
+
+
+tasks = None
 if settings.USE_MEMORY_MQ:
-    tasks = Queue()
-    worker_thread = threading.Thread(target=worker, args=())
-    worker_thread.setDaemon(True)
-    worker_thread.start()
+    tasks = MemoryQueue(settings.MEMORY_MQ_SIZE, settings.MEMORY_MQ_WORKERS,
+                        settings.MEMORY_MQ_PUT_TIMEOUT)
@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+
+"""
+rest_arch.replication
+~~~~~~~~~~~~~~~~~~~~~
+
+Cheap replication position probes, used by
+:class:`rest_arch.db.RoutingSession` to tell whether a replica has caught
+up with a write. Positions are cached per engine for ``ttl`` seconds::
+
+    probe = make_replication_probe('mysql', ttl=0.5)
+    position = probe.position(master, cached=False)
+    probe.caught_up(slave, position)
+"""
+
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class ReplicationProbe(object):
+    """Base probe, subclasses implement :meth:`_probe_master` and
+    :meth:`_probe_slave` which return comparable positions or ``None``
+    if unknown.
+    """
+
+    def __init__(self, ttl=0.5):
+        self.ttl = ttl
+        self._cache = {}
+
+    def position(self, engine, role='slave', cached=True):
+        now = time.time()
+        if cached:
+            hit = self._cache.get(engine)
+            if hit is not None and hit[0] > now:
+                return hit[1]
+        try:
+            if role == 'master':
+                pos = self._probe_master(engine)
+            else:
+                pos = self._probe_slave(engine)
+        except Exception:
+            logger.exception('Error probing replication position')
+            pos = None
+        self._cache[engine] = (now + self.ttl, pos)
+        return pos
+
+    def caught_up(self, engine, position):
+        """Whether replica ``engine`` has applied master ``position``,
+        unknown positions are never considered caught up."""
+        if position is None:
+            return False
+        pos = self.position(engine)
+        return pos is not None and pos >= position
+
+    def _probe_master(self, engine):
+        raise NotImplementedError
+
+    def _probe_slave(self, engine):
+        raise NotImplementedError
+
+
+class MySQLReplicationProbe(ReplicationProbe):
+    """Compare binlog coordinates: ``SHOW MASTER STATUS`` on master and
+    the executed coordinates of ``SHOW SLAVE STATUS`` on replicas."""
+
+    def _probe_master(self, engine):
+        row = engine.execute('SHOW MASTER STATUS').first()
+        if row is None:
+            return None
+        return (row['File'], int(row['Position']))
+
+    def _probe_slave(self, engine):
+        row = engine.execute('SHOW SLAVE STATUS').first()
+        if row is None:
+            return None
+        return (row['Relay_Master_Log_File'], int(row['Exec_Master_Log_Pos']))
+
+
+PROBES = {
+    'mysql': MySQLReplicationProbe,
+}
+
+
+def make_replication_probe(name, **kwds):
+    """Create probe by name (see :data:`PROBES`) or by a
+    :class:`ReplicationProbe` subclass, ``None`` disables probing."""
+    if name is None:
+        return None
+    if isinstance(name, basestring):
+        try:
+            cls = PROBES[name]
+        except KeyError:
+            raise ValueError('Unknown replication probe: {!r}'.format(name))
+    else:
+        cls = name
+    return cls(**kwds)
@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+
+"""
+rest_arch.retry
+~~~~~~~~~~~~~~~
+
+Retry policy of :func:`rest_arch.async.async_api`: exponential backoff
+with full jitter, per service retry budgets and a dead letter queue::
+
+    policy = get_retry_policy()
+    policy.record_call(service)
+    if policy.allow_retry(service, retries, max_retries):
+        task.retry(countdown=policy.backoff(retries, base=5))
+    else:
+        policy.dead_letter(service, api, args, kwargs, exc)
+
+A service may retry at most ``TASK_RETRY_BUDGET_RATIO`` of its fresh
+calls (plus ``TASK_RETRY_BUDGET_MIN``) in ``TASK_RETRY_BUDGET_WINDOW``
+seconds, so an outage downstream doesn't turn into a retry storm.
+"""
+
+import time
+import random
+import logging
+import collections
+
+from .conf import settings
+
+logger = logging.getLogger(__name__)
+
+
+def backoff(retries, base=1, cap=300):
+    """Full jitter exponential backoff: uniform in
+    ``[0, min(cap, base * 2 ** retries)]``."""
+    return random.uniform(0, min(cap, base * 2 ** min(retries, 32)))
+
+
+def max_retries_within(total, base=1, cap=300):
+    """Retries whose expected :func:`backoff` adds up to ``total``
+    seconds."""
+    retries, elapsed = 0, 0
+    while True:
+        elapsed += min(cap, base * 2 ** min(retries, 32)) / 2.0
+        if elapsed > total:
+            return retries
+        retries += 1
+
+
+class RollingCounter(object):
+    """Count of events in the last ``window`` seconds, kept in one second
+    buckets."""
+
+    def __init__(self, window=60):
+        self.window = window
+        self._buckets = collections.deque()
+        self._total = 0
+
+    def _expire(self, now):
+        buckets = self._buckets
+        while buckets and buckets[0][0] <= now - self.window:
+            self._total -= buckets.popleft()[1]
+
+    def add(self, n=1):
+        now = int(time.time())
+        self._expire(now)
+        if self._buckets and self._buckets[-1][0] == now:
+            self._buckets[-1][1] += n
+        else:
+            self._buckets.append([now, n])
+        self._total += n
+
+    def count(self):
+        self._expire(int(time.time()))
+        return self._total
+
+
+class RetryBudget(object):
+    """Retries allowed in the window: ``ratio`` of fresh calls plus
+    ``min_retries``."""
+
+    def __init__(self, ratio=0.2, window=60, min_retries=10):
+        self.ratio = ratio
+        self.min_retries = min_retries
+        self.calls = RollingCounter(window)
+        self.retries = RollingCounter(window)
+        self.exhausted = 0
+
+    def record_call(self):
+        self.calls.add()
+
+    def acquire(self):
+        """Take one retry from the budget, ``False`` if exhausted."""
+        if self.retries.count() >= \
+                self.min_retries + self.ratio * self.calls.count():
+            self.exhausted += 1
+            return False
+        self.retries.add()
+        return True
+
+    def stats(self):
+        calls, retries = self.calls.count(), self.retries.count()
+        return {
+            'calls': calls,
+            'retries': retries,
+            'retry_rate': float(retries) / calls if calls else 0,
+            'exhausted': self.exhausted,
+        }
+
+
+class RetryPolicy(object):
+
+    def __init__(self, backoff_cap=300, budget_ratio=0.2, budget_window=60,
+                 budget_min=10, dlq=None):
+        """
+        :param dlq: callable ``(service, api, args, kwargs, exc, retries)``
+                    publishing dead letters, they are only logged if not
+                    provided
+        """
+        self.backoff_cap = backoff_cap
+        self.budget_ratio = budget_ratio
+        self.budget_window = budget_window
+        self.budget_min = budget_min
+        self.dlq = dlq
+        self.dead_lettered = collections.Counter()
+        self.budgets = {}
+
+    def budget(self, service):
+        budget = self.budgets.get(service)
+        if budget is None:
+            budget = self.budgets[service] = RetryBudget(
+                self.budget_ratio, self.budget_window, self.budget_min)
+        return budget
+
+    def record_call(self, service):
+        """Record a fresh (not retried) call of ``service``."""
+        self.budget(service).record_call()
+
+    def allow_retry(self, service, retries, max_retries=None):
+        if max_retries is not None and retries >= max_retries:
+            return False
+        return self.budget(service).acquire()
+
+    def backoff(self, retries, base=1):
+        return backoff(retries, base, self.backoff_cap)
+
+    def dead_letter(self, service, api, args, kwargs, exc, retries=0):
+        self.dead_lettered[service] += 1
+        logger.warn('dead letter {}.{}{} after {} retries: {!r}'.format(
+            service, api, args, retries, exc))
+        if self.dlq is None:
+            return
+        try:
+            self.dlq(service, api, args, kwargs, exc, retries)
+        except Exception:
+            logger.exception('Error publishing dead letter {}.{}{}'.format(
+                service, api, args))
+
+    def stats(self):
+        """``{service: {calls, retries, retry_rate, exhausted,
+        dead_lettered}}``"""
+        stats = {}
+        for service in set(self.budgets) | set(self.dead_lettered):
+            stats[service] = dict(self.budget(service).stats(),
+                                  dead_lettered=self.dead_lettered[service])
+        return stats
+
+
+retry_policy = None
+
+
+def get_retry_policy(dlq=None):
+    global retry_policy
+    if retry_policy is None:
+        retry_policy = RetryPolicy(
+            backoff_cap=settings.TASK_RETRY_BACKOFF_CAP,
+            budget_ratio=settings.TASK_RETRY_BUDGET_RATIO,
+            budget_window=settings.TASK_RETRY_BUDGET_WINDOW,
+            budget_min=settings.TASK_RETRY_BUDGET_MIN,
+            dlq=dlq)
+    return retry_policy
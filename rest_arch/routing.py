@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+
+"""
+rest_arch.routing
+~~~~~~~~~~~~~~~~~
+
+Routing table of async tasks, built once from the client registry
+(:data:`rest_arch.client.clients`, a
+:class:`rest_arch.client.ClientRegistry`) and rebuilt when it changes::
+
+    client = find_client('test', 'ping')
+    for slug in get_routing_table().subscribers('signal_foo'):
+        ...
+
+Celery tasks are skipped by ``ASYNC_SKIP_RULES`` and tasks of the memory
+queue by ``MEMORY_MQ_SKIP_RULES``, dicts of service to the apis to skip,
+``None`` to skip all apis of the service.
+"""
+
+from .client import clients
+from .conf import settings
+
+
+def _slug(app_name):
+    # `skt.test` -> `test`
+    return app_name.split('.', 1)[-1]
+
+
+def _compile_rules(rules):
+    return {service: None if apis is None else set(apis)
+            for service, apis in (rules or {}).iteritems()}
+
+
+def _match(rules, service, api):
+    if service not in rules:
+        return False
+    apis = rules[service]
+    return apis is None or api in apis
+
+
+class RoutingTable(object):
+    """``(service, api) -> client`` and ``signal -> [service slug]``
+    lookups of ``registry``."""
+
+    def __init__(self, registry, skip_rules=None,
+                 memory_mq_skip_rules=None):
+        self.registry = registry
+        self.skip_rules = _compile_rules(skip_rules)
+        self.memory_mq_skip_rules = _compile_rules(memory_mq_skip_rules)
+        self.version = None
+        self._services = {}
+        self._apis = {}
+        self._subscribers = {}
+
+    def build(self):
+        services, apis, subscribers = {}, {}, {}
+        for app_name, client in self.registry.iteritems():
+            slug = _slug(app_name)
+            services[app_name] = services[slug] = client
+            for api in getattr(client, 'apis', ()):
+                apis[(app_name, api)] = apis[(slug, api)] = client
+                subscribers.setdefault(api, []).append(slug)
+        self._services, self._apis = services, apis
+        self._subscribers = {k: tuple(v) for k, v in subscribers.iteritems()}
+        self.version = getattr(self.registry, 'version', None)
+
+    def _ensure_built(self):
+        if self.version is None or \
+                self.version != getattr(self.registry, 'version', None):
+            self.build()
+
+    def find_client(self, service, api):
+        """Client serving ``api`` of ``service``, raises ``LookupError``
+        if not registered."""
+        self._ensure_built()
+        client = self._apis.get((service, api)) or \
+            self._services.get(service)
+        if client is None:
+            raise LookupError(
+                'No client registered for {}.{}'.format(service, api))
+        return client
+
+    def subscribers(self, signal):
+        """Slugs of services subscribing ``signal``."""
+        self._ensure_built()
+        return self._subscribers.get(signal, ())
+
+    def is_skipped(self, service, api):
+        return _match(self.skip_rules, service, api)
+
+    def is_skipped_in_memory_mq(self, service, api):
+        return _match(self.memory_mq_skip_rules, service, api)
+
+
+routing_table = None
+
+
+def get_routing_table():
+    global routing_table
+    if routing_table is None:
+        routing_table = RoutingTable(clients, settings.ASYNC_SKIP_RULES,
+                                     settings.MEMORY_MQ_SKIP_RULES)
+    return routing_table
+
+
+def find_client(service, api):
+    return get_routing_table().find_client(service, api)
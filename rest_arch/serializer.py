@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+
+"""
+rest_arch.serializer
+~~~~~~~~~~~~~~~~~~~~
+
+Serializers shared by :mod:`rest_arch.client` and
+:class:`rest_arch.app.SKT`. JSON is encoded by ``simplejson`` if
+available, set to produce the same bytes as stdlib ``json``, ``ujson`` is
+only used when ``SERIALIZER_UJSON`` is on as its output differs (float
+precision, ``/`` escaping, no ``default``). msgpack is picked by content
+negotiation::
+
+    serializer = negotiate(request.headers.get('Accept'))
+    body = serializer.dumps({'a': 1})
+"""
+
+import json
+import datetime
+import itertools
+
+try:
+    import ujson
+except ImportError:
+    ujson = None
+
+try:
+    import simplejson
+except ImportError:
+    simplejson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+from .conf import settings
+
+JSON_CONTENT_TYPE = 'application/json'
+MSGPACK_CONTENT_TYPE = 'application/msgpack'
+
+
+def default(obj):
+    """Encode objects the stdlib encoders don't know."""
+    if isinstance(obj, (datetime.datetime, datetime.date)):
+        return obj.isoformat()
+    if isinstance(obj, (set, frozenset)):
+        return list(obj)
+    raise TypeError('{!r} is not serializable'.format(obj))
+
+
+def _chunks(items, size):
+    items = iter(items)
+    while True:
+        chunk = list(itertools.islice(items, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+class JSONSerializer(object):
+    content_type = JSON_CONTENT_TYPE
+
+    def __init__(self, encoder_cls=None, use_ujson=None):
+        """
+        :param encoder_cls: a :class:`json.JSONEncoder` subclass, disables
+                            the fast encoders when provided
+        :param use_ujson: encode and decode by ``ujson`` if installed,
+                          defaults to ``SERIALIZER_UJSON``
+        """
+        self.encoder_cls = encoder_cls
+        if use_ujson is None:
+            use_ujson = settings.SERIALIZER_UJSON
+        use_ujson = use_ujson and ujson is not None
+        if encoder_cls is not None:
+            self._encode = encoder_cls(separators=(',', ':')).encode
+            self._fast_dumps = None
+        else:
+            self._encode = json.JSONEncoder(separators=(',', ':'),
+                                            default=default).encode
+            if use_ujson:
+                self._fast_dumps = ujson.dumps
+            elif simplejson is not None:
+                # stdlib `json` doesn't know decimals and namedtuples
+                self._fast_dumps = simplejson.JSONEncoder(
+                    separators=(',', ':'), default=default,
+                    use_decimal=False, namedtuple_as_object=False).encode
+            else:
+                self._fast_dumps = None
+        if use_ujson:
+            self._loads = ujson.loads
+        elif simplejson is not None:
+            self._loads = simplejson.loads
+        else:
+            self._loads = json.loads
+
+    def dumps(self, obj):
+        if self._fast_dumps is not None:
+            try:
+                return self._fast_dumps(obj)
+            except (TypeError, ValueError, OverflowError):
+                pass
+        return self._encode(obj)
+
+    def loads(self, data):
+        return self._loads(data)
+
+    def iter_list(self, items, chunk_size=100):
+        """Encode a (large) list chunk by chunk."""
+        yield '['
+        first = True
+        for chunk in _chunks(items, chunk_size):
+            data = ','.join(self.dumps(item) for item in chunk)
+            yield data if first else ',' + data
+            first = False
+        yield ']'
+
+
+class MsgpackSerializer(object):
+    content_type = MSGPACK_CONTENT_TYPE
+
+    def __init__(self):
+        if msgpack is None:
+            raise RuntimeError('msgpack is not installed')
+        self._packer = msgpack.Packer(default=default)
+
+    def dumps(self, obj):
+        return self._packer.pack(obj)
+
+    def loads(self, data):
+        return msgpack.unpackb(data, raw=False)
+
+    def iter_list(self, items, chunk_size=100):
+        if not isinstance(items, (list, tuple)):
+            items = list(items)
+        yield self._packer.pack_array_header(len(items))
+        for chunk in _chunks(items, chunk_size):
+            yield ''.join(self._packer.pack(item) for item in chunk)
+
+
+SERIALIZERS = {
+    JSON_CONTENT_TYPE: JSONSerializer,
+    MSGPACK_CONTENT_TYPE: MsgpackSerializer,
+}
+
+_serializers = {}
+
+
+def get_serializer(content_type=JSON_CONTENT_TYPE):
+    """Shared serializer instance of ``content_type``, ``json`` and
+    ``msgpack`` are accepted as shortcuts."""
+    content_type = {
+        'json': JSON_CONTENT_TYPE,
+        'msgpack': MSGPACK_CONTENT_TYPE,
+    }.get(content_type, content_type)
+    serializer = _serializers.get(content_type)
+    if serializer is None:
+        try:
+            cls = SERIALIZERS[content_type]
+        except KeyError:
+            raise ValueError(
+                'Unknown content type: {!r}'.format(content_type))
+        serializer = _serializers[content_type] = cls()
+    return serializer
+
+
+def negotiate(accept=None, content_type=None):
+    """Pick serializer by ``Accept`` (or ``Content-Type``) header, JSON
+    unless msgpack is asked for and available."""
+    header = accept or content_type or ''
+    if MSGPACK_CONTENT_TYPE in header and msgpack is not None:
+        return get_serializer(MSGPACK_CONTENT_TYPE)
+    return get_serializer(JSON_CONTENT_TYPE)
@@ -13,8 +13,10 @@ from .consts import (
     DEFAULT_WORKER_CLASS,
     DEFAULT_WORKER_NUMBER_DEV,
     DEFAULT_WORKER_NUMBER_PROD,
-    ENV_DEV
+    ENV_DEV,
+    LOG_FORMAT_TEXT
 )
+from ..consts import SHIELDED_API_KEY
 import rest_arch
 from .exc import AppConfigLoadFailException
 from ..utils import EnvvarReader, cached_property
@@ -198,6 +200,16 @@ class BareAppConfig(object):
                     arch_version = line.strip()
         return arch_version or "rest_arch==%s" % rest_arch.__version__
 
+    @cached_property
+    def log_format(self):
+        """``text`` (default), ``json`` or ``msgpack``"""
+        return self.config.get('log_format', LOG_FORMAT_TEXT)
+
+    @cached_property
+    def shielded_apis(self):
+        """Endpoints or url rules never shed by admission control"""
+        return self.config.get(SHIELDED_API_KEY) or []
+
     @cached_property
     def message_consumers(self):
         consumers = self.config.get('message_consumer')
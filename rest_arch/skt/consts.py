@@ -16,3 +16,5 @@ DEFAULT_WORKER_CLASS = 'gevent'
 ENV_DEV = 'dev'
 ENV_TESTING = 'testing'
 ENV_PROD = 'prod'
+
+LOG_FORMAT_TEXT = 'text'
@@ -92,7 +92,8 @@ def init_loggers():
     if loggers_initialized:
         logger.warn("logging is already initialized, skipping")
         return
-    setup_loggers(load_app_config().logger_name, env())
+    app_config = load_app_config()
+    setup_loggers(app_config.logger_name, env(), app_config.log_format)
     loggers_initialized = True
 
 
@@ -1,8 +1,9 @@
 # -*- coding: utf-8 -*-
 
 import logging
+import logging.config
 
-from .consts import ENV_DEV
+from .consts import ENV_DEV, LOG_FORMAT_TEXT
 
 
 def setup_logger_cls():
@@ -89,14 +90,14 @@ def _gen_syslog_logging_config(logger_name):
         'handlers': {
             'syslog_udp': {
                 'level': 'INFO',
-                'class': 'logging.handlers.SysLogHandler',
+                'class': 'rest_arch.log.BufferedSysLogHandler',
                 'address': ('localhost', 514),
                 'facility': 'local6',
                 'formatter': 'syslog',
             },
             'syslog': {
                 'level': 'INFO',
-                'class': 'logging.handlers.SysLogHandler',
+                'class': 'rest_arch.log.BufferedSysLogHandler',
                 'address': '/dev/log',
                 'facility': 'local6',
                 'formatter': 'syslog',
@@ -111,15 +112,43 @@ def _gen_syslog_logging_config(logger_name):
     }
 
 
-def gen_logging_dictconfig(logger_name, env):
+STRUCTURED_HANDLER_CLASSES = {
+    'logging.StreamHandler': 'rest_arch.log.StructuredStreamHandler',
+    'logging.handlers.SysLogHandler': 'rest_arch.log.StructuredSysLogHandler',
+    'rest_arch.log.BufferedSysLogHandler':
+        'rest_arch.log.BufferedStructuredSysLogHandler',
+}
+
+
+def _use_structured_logging(conf, serializer):
+    """Replace formatters and handlers of ``conf`` with the structured
+    ones, see :class:`rest_arch.log.StructuredFormatter`."""
+    for name in conf['formatters']:
+        conf['formatters'][name] = {
+            '()': 'rest_arch.log.StructuredFormatter',
+            'serializer': serializer,
+        }
+    for handler in conf['handlers'].itervalues():
+        handler['class'] = STRUCTURED_HANDLER_CLASSES.get(handler['class'],
+                                                          handler['class'])
+    return conf
+
+
+def gen_logging_dictconfig(logger_name, env, log_format=LOG_FORMAT_TEXT):
+    """
+    :param log_format: ``text`` for :class:`rest_arch.log.RestFormatter`,
+                       ``json`` or ``msgpack`` for structured output
+    """
     if env == ENV_DEV:
         conf = _gen_console_logging_config(logger_name)
     else:
         conf = _gen_syslog_logging_config(logger_name)
+    if log_format != LOG_FORMAT_TEXT:
+        conf = _use_structured_logging(conf, log_format)
     return conf
 
 
-def setup_loggers(logger_name, env=ENV_DEV):
+def setup_loggers(logger_name, env=ENV_DEV, log_format=LOG_FORMAT_TEXT):
     setup_logger_cls()
-    conf = gen_logging_dictconfig(logger_name, env)
+    conf = gen_logging_dictconfig(logger_name, env, log_format)
     logging.config.dictConfig(conf)
@@ -35,6 +35,7 @@ class ArchWsgiApp(SetAppMixin, WSGIApplication):
         self.cfg.set('syslog_prefix', "{0}.wsgi".format(
             self.app_config.app_name))
         self.cfg.set('post_fork', hooks.post_fork)
+        self.cfg.set('worker_exit', hooks.worker_exit)
         self.cfg.set('accesslog', '-')
         self.cfg.set('errorlog', '-')
         self.cfg.set('statsd_prefix',
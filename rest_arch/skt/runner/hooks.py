@@ -11,6 +11,17 @@ def worker_term(worker):
     os.environ['SERVER_SHUTTINGDOWN'] = '1'
 
 
+def worker_exit(arbitor, worker):
+    _flush_logs()
+
+
+def _flush_logs():
+    from ... import log
+    if log.sql_logger is not None:
+        log.sql_logger.flush()
+    log.flush_buffered_handlers()
+
+
 def post_worker_init(worker):
     os.environ.pop('SERVER_SHUTTINGDOWN', None)
 
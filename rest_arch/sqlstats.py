@@ -0,0 +1,220 @@
+# -*- coding: utf-8 -*-
+
+"""
+rest_arch.sqlstats
+~~~~~~~~~~~~~~~~~~
+
+Per request SQL statistics and a process-wide slow query digest, fed by
+the :class:`rest_arch.log.SQLLogger` listener hook::
+
+    sql_stats = get_sql_stats()
+    # at the end of a request
+    sql_stats.finish_request()
+    # on demand
+    sql_stats.dump_digest(top=20)
+"""
+
+import re
+import logging
+import collections
+
+from .consts import PLACE_HOLDER
+from .ctx import g
+from .conf import settings
+from .log import get_sql_logger, logging_meta, strip_sql_comment
+
+logger = logging.getLogger(__name__)
+
+# latency histogram buckets, in seconds
+BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5)
+
+_NORMALIZE_RES = [(re.compile(p, re.I), r) for p, r in (
+    (r"'(?:[^'\\]|\\.|'')*'", '?'),
+    (r"\b\d+(?:\.\d+)?\b", '?'),
+    (r"%\(\w+\)s|%s|(?<![:\w]):\w+", '?'),
+    (r"\(\s*\?(?:\s*,\s*\?)+\s*\)", '(?+)'),
+    (r"\s+", ' '),
+)]
+
+OTHER_STATEMENTS = '<other>'
+
+
+def normalize_statement(statement):
+    """Fingerprint of a statement: literals and binds become ``?`` and
+    ``IN`` lists collapse into ``(?+)``."""
+    statement = strip_sql_comment(statement)
+    for regex, repl in _NORMALIZE_RES:
+        statement = regex.sub(repl, statement)
+    return statement.strip()
+
+
+class StatementDigest(object):
+    """Latency stats of a normalized statement."""
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.histogram = [0] * (len(BUCKETS) + 1)
+
+    def add(self, cost, exc=None):
+        self.count += 1
+        if exc is not None:
+            self.errors += 1
+        if cost is None:
+            return
+        self.total += cost
+        self.max = max(self.max, cost)
+        for i, bucket in enumerate(BUCKETS):
+            if cost <= bucket:
+                self.histogram[i] += 1
+                break
+        else:
+            self.histogram[-1] += 1
+
+    def to_dict(self):
+        histogram = collections.OrderedDict(
+            ('<=%gs' % b, n) for b, n in zip(BUCKETS, self.histogram))
+        histogram['>%gs' % BUCKETS[-1]] = self.histogram[-1]
+        return {
+            'count': self.count,
+            'errors': self.errors,
+            'total': self.total,
+            'avg': self.total / self.count if self.count else 0,
+            'max': self.max,
+            'histogram': histogram,
+        }
+
+
+class RequestSQLStats(object):
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.roles = collections.defaultdict(lambda: [0, 0.0])
+        self.statements = collections.Counter()
+
+    def add(self, role, fingerprint, cost):
+        cost = cost or 0
+        self.count += 1
+        self.total += cost
+        self.roles[role][0] += 1
+        self.roles[role][1] += cost
+        self.statements[fingerprint] += 1
+
+
+class SQLStats(object):
+    """SQLLogger listener aggregating statements per request (keyed by
+    ``request_id`` of call meta) and into a process-wide digest.
+
+    :param n_plus_one_threshold: a select statement executed this many
+                                 times in a request is reported as N+1
+    """
+
+    def __init__(self, n_plus_one_threshold=5, max_digests=1000,
+                 max_requests=10000):
+        self.n_plus_one_threshold = n_plus_one_threshold
+        self.max_digests = max_digests
+        self.max_requests = max_requests
+        self.digests = {}
+        self._requests = collections.OrderedDict()
+        self._fingerprints = collections.OrderedDict()
+
+    def _fingerprint(self, statement):
+        # LRU by statement without the per request comment
+        statement = strip_sql_comment(statement)
+        fingerprints = self._fingerprints
+        try:
+            fingerprint = fingerprints.pop(statement)
+        except KeyError:
+            fingerprint = normalize_statement(statement)
+            if len(fingerprints) >= self.max_digests:
+                fingerprints.popitem(last=False)
+        fingerprints[statement] = fingerprint
+        return fingerprint
+
+    def on_sql_start(self, conn, statement, params):
+        pass
+
+    def on_sql_end(self, conn, statement, params, cost, exc=None):
+        fingerprint = self._fingerprint(statement)
+
+        digest = self.digests.get(fingerprint)
+        if digest is None:
+            if len(self.digests) >= self.max_digests:
+                fingerprint = OTHER_STATEMENTS
+            digest = self.digests.setdefault(fingerprint, StatementDigest())
+        digest.add(cost, exc)
+
+        request_id = g.get_call_meta('request_id')
+        if request_id == PLACE_HOLDER:
+            return
+        stats = self._requests.get(request_id)
+        if stats is None:
+            if len(self._requests) >= self.max_requests:
+                # requests never finished
+                self._requests.popitem(last=False)
+            stats = self._requests[request_id] = RequestSQLStats()
+        role = conn._execution_options.get('role', 'unknown')
+        stats.add(role, fingerprint, cost)
+
+    def finish_request(self, request_id=None):
+        """Emit one summary line of current request's statements."""
+        if request_id is None:
+            request_id = g.get_call_meta('request_id')
+        stats = self._requests.pop(request_id, None)
+        if stats is None:
+            return None
+
+        meta = {
+            'queries': stats.count,
+            'db_time': '%.2fms' % (stats.total * 1000),
+        }
+        for role, (count, total) in stats.roles.iteritems():
+            meta[role] = '%d/%.2fms' % (count, total * 1000)
+        n_plus_one = [
+            (fingerprint, count)
+            for fingerprint, count in stats.statements.most_common()
+            if count >= self.n_plus_one_threshold and
+            fingerprint.upper().startswith('SELECT')
+        ]
+        meta['n+1'] = len(n_plus_one)
+
+        body = 'SQL summary'
+        if n_plus_one:
+            body = '{0}, N+1 suspects: {1}'.format(body, '; '.join(
+                '{0} x{1}'.format(f, c) for f, c in n_plus_one))
+        with logging_meta(**meta):
+            logger.info(body)
+        return stats
+
+    def dump_digest(self, top=None):
+        """Digests of normalized statements, sorted by total time."""
+        digests = sorted(self.digests.iteritems(),
+                         key=lambda item: item[1].total, reverse=True)
+        if top is not None:
+            digests = digests[:top]
+        return [dict(d.to_dict(), statement=s) for s, d in digests]
+
+    def log_digest(self, top=20):
+        for digest in self.dump_digest(top):
+            statement = digest.pop('statement')
+            digest['histogram'] = ','.join(
+                '%s:%d' % kv for kv in digest['histogram'].iteritems())
+            with logging_meta(**digest):
+                logger.info(statement)
+
+    def reset_digest(self):
+        self.digests.clear()
+
+
+sql_stats = None
+
+
+def get_sql_stats():
+    global sql_stats
+    if sql_stats is None:
+        sql_stats = SQLStats(
+            n_plus_one_threshold=settings.SQLSTATS_N_PLUS_ONE_THRESHOLD)
+        get_sql_logger().add_listener(sql_stats)
+    return sql_stats
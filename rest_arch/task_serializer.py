@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+
+"""
+rest_arch.task_serializer
+~~~~~~~~~~~~~~~~~~~~~~~~~
+
+Compact kombu serializer and size aware compression of async tasks,
+registered by :func:`register` and used by
+:func:`rest_arch.async.async_api`:
+
+``arch_msgpack``
+    task messages are packed as a fixed msgpack array
+    ``[version, task, id, args, kwargs, {other fields}]``. Tuples are
+    packed as an ext type and come back as tuples, bodies with any other
+    object msgpack can't pack as is (including subclasses of builtin
+    types) fall back to a pickle wrapped in the envelope. Only registered
+    if msgpack is installed.
+
+``arch_zlib``
+    bodies shorter than ``TASK_COMPRESSION_THRESHOLD`` bytes are sent
+    as is, the first byte marks whether the rest is zlib compressed.
+"""
+
+import zlib
+import functools
+import cPickle as pickle
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+from .conf import settings
+
+SERIALIZER_NAME = 'arch_msgpack'
+CONTENT_TYPE = 'application/x-arch-msgpack'
+
+COMPRESSION_NAME = 'arch_zlib'
+COMPRESSION_TYPE = 'application/x-arch-zlib'
+
+ENVELOPE_PICKLE = 0
+ENVELOPE_TASK = 1
+ENVELOPE_PLAIN = 2
+
+TASK_FIELDS = ('task', 'id', 'args', 'kwargs')
+
+EXT_TUPLE = 1
+
+_RAW = '\x00'
+_ZLIB = '\x01'
+
+
+def _default(obj):
+    # other objects msgpack can't represent exactly are pickled
+    if type(obj) is tuple:
+        # skip the checks of `ExtType.__new__`
+        return _new_ext((EXT_TUPLE, _packb_nested(list(obj))))
+    raise TypeError('{!r} is not packed as is'.format(type(obj)))
+
+
+def _ext_hook(code, data):
+    if code == EXT_TUPLE:
+        return tuple(_unpackb(data))
+    return msgpack.ExtType(code, data)
+
+
+def _new_packer():
+    return msgpack.Packer(use_bin_type=True, strict_types=True,
+                          default=_default)
+
+
+# `Packer.pack` isn't reentrant, tuples are packed by a free one
+_free_packers = []
+
+
+def _packb_nested(obj):
+    try:
+        packer = _free_packers.pop()
+    except IndexError:
+        packer = _new_packer()
+    try:
+        return packer.pack(obj)
+    finally:
+        _free_packers.append(packer)
+
+
+def _unpackb(data):
+    return msgpack.unpackb(data, **_unpack_options)
+
+
+if msgpack is not None:
+    _packb = _new_packer().pack
+    _new_ext = functools.partial(tuple.__new__, msgpack.ExtType)
+    _unpack_options = {'raw': False, 'ext_hook': _ext_hook}
+    if msgpack.version >= (0, 6, 1):
+        # msgpack>=1.0 rejects map keys other than str and bytes by
+        # default, while the packer takes them
+        _unpack_options['strict_map_key'] = False
+
+
+def dumps(body):
+    try:
+        if isinstance(body, dict) and 'task' in body:
+            extra = body.copy()
+            try:
+                envelope = [ENVELOPE_TASK] + [
+                    extra.pop(f) for f in TASK_FIELDS] + [extra]
+            except KeyError:
+                envelope = [ENVELOPE_PLAIN, body]
+        else:
+            envelope = [ENVELOPE_PLAIN, body]
+        return _packb(envelope)
+    except (TypeError, ValueError, OverflowError):
+        return _packb([ENVELOPE_PICKLE,
+                       pickle.dumps(body, pickle.HIGHEST_PROTOCOL)])
+
+
+def loads(data):
+    envelope = _unpackb(data)
+    version = envelope[0]
+    if version == ENVELOPE_TASK:
+        body = envelope[-1]
+        body.update(zip(TASK_FIELDS, envelope[1:-1]))
+        return body
+    if version == ENVELOPE_PLAIN:
+        return envelope[1]
+    if version == ENVELOPE_PICKLE:
+        return pickle.loads(envelope[1])
+    raise ValueError('Unknown task envelope: {!r}'.format(version))
+
+
+def compress(body, threshold=None):
+    if threshold is None:
+        threshold = settings.TASK_COMPRESSION_THRESHOLD
+    if len(body) < threshold:
+        return _RAW + body
+    return _ZLIB + zlib.compress(body)
+
+
+def decompress(data):
+    if data[:1] == _ZLIB:
+        return zlib.decompress(data[1:])
+    return data[1:]
+
+
+_registered = False
+
+
+def register():
+    """Register ``arch_msgpack`` (if msgpack is installed) and
+    ``arch_zlib`` to kombu, both producers and consumers need it."""
+    global _registered
+    if _registered:
+        return
+    from kombu import compression, serialization
+    if msgpack is not None:
+        serialization.register(SERIALIZER_NAME, dumps, loads,
+                               content_type=CONTENT_TYPE,
+                               content_encoding='binary')
+    compression.register(compress, decompress, COMPRESSION_TYPE,
+                         aliases=[COMPRESSION_NAME])
+    _registered = True
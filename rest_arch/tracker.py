@@ -1,5 +1,327 @@
 # -*- coding: utf-8 -*-
 
+"""
+rest_arch.tracker
+~~~~~~~~~~~~~~~~~
+
+In-process tracing: :class:`ArchTracker` records spans of api calls (by
+the ``before_api_called``/``after_api_called`` signals), SQL statements
+(as a :class:`rest_arch.log.SQLLogger` listener), :class:`Client` calls
+and ``send_task``, all tagged with ``request_id`` and ``seq`` of the
+call meta::
+
+    with span('cache', 'get user', key=key):
+        ...
+
+Traces are head sampled by ``TRACKER_SAMPLE_RATE``: the decision is
+taken once per request from a hash of its ``request_id``, so services
+sharing the request id keep or drop the same traces, and spans of a
+dropped request cost one dict lookup.
+
+Finished spans are pushed onto a ring buffer, a background worker
+exports them in batches to ``TRACKER_EXPORT``, ``file:///path/to/file``
+or ``udp://host:port``, one JSON object per line or datagram.
+"""
+
+import os
+import json
+import zlib
+import time
+import random
+import socket
+import atexit
+import logging
+import threading
+import urlparse
+
+from .conf import settings
+from .consts import PLACE_HOLDER
+from .ctx import g
+from .log import RingBuffer, get_sql_logger, obj2str, strip_sql_comment
+from .signals import before_api_called, after_api_called
+
+logger = logging.getLogger(__name__)
+
+# the api span of current request, in call meta
+SPAN_KEY = 'span'
+SAMPLED_KEY = 'sampled'
+
+
+class Span(object):
+    """A timed operation, finished when used as a context manager
+    exits."""
+
+    __slots__ = ('tracker', 'kind', 'name', 'request_id', 'seq', 'span_id',
+                 'parent_id', 'start', 'duration', 'tags', 'error')
+
+    def __init__(self, tracker, kind, name, tags, parent=None, start=None):
+        self.tracker = tracker
+        self.kind = kind
+        self.name = name
+        self.request_id = g.get_call_meta('request_id')
+        self.seq = g.get_call_meta('seq')
+        self.span_id = '%016x' % random.getrandbits(64)
+        self.parent_id = parent.span_id if parent is not None else None
+        self.start = time.time() if start is None else start
+        self.duration = None
+        self.tags = tags
+        self.error = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.finish(exc)
+
+    def set_tag(self, key, value):
+        self.tags[key] = value
+
+    def finish(self, exc=None, duration=None):
+        if self.duration is not None:
+            return
+        self.duration = time.time() - self.start \
+            if duration is None else duration
+        if exc is not None:
+            self.error = repr(exc)
+        self.tracker.record(self)
+
+    def to_dict(self):
+        return {
+            'kind': self.kind,
+            'name': self.name,
+            'request_id': self.request_id,
+            'seq': self.seq,
+            'span_id': self.span_id,
+            'parent_id': self.parent_id,
+            'start': self.start,
+            'duration': self.duration,
+            'tags': self.tags,
+            'error': self.error,
+        }
+
+
+class _NoopSpan(object):
+    """Span of requests not sampled."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        pass
+
+    def set_tag(self, key, value):
+        pass
+
+    def finish(self, exc=None, duration=None):
+        pass
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+##
+# exporters
+##
+class FileExporter(object):
+
+    def __init__(self, path):
+        self.path = path
+
+    def export(self, lines):
+        with open(self.path, 'a') as f:
+            f.write(''.join(line + '\n' for line in lines))
+
+
+class UDPExporter(object):
+
+    def __init__(self, host, port):
+        self.address = (host, port)
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def export(self, lines):
+        for line in lines:
+            self.sock.sendto(line, self.address)
+
+
+def make_exporter(url):
+    """Exporter of ``file:///path`` or ``udp://host:port``."""
+    parsed = urlparse.urlparse(url)
+    if parsed.scheme == 'file':
+        return FileExporter(parsed.path)
+    if parsed.scheme == 'udp':
+        return UDPExporter(parsed.hostname, parsed.port)
+    raise ValueError('Unknown span exporter: {!r}'.format(url))
+
 
 class ArchTracker(object):
-    pass
+    """
+    :param sample_rate: ratio of requests traced, ``0`` to ``1``
+    :param exporter: object with an ``export(lines)`` method, spans are
+                     kept in the buffer if not provided
+    """
+
+    def __init__(self, sample_rate=0, exporter=None, buffer_size=10000,
+                 batch_size=100, interval=1):
+        self.sample_rate = sample_rate
+        self.exporter = exporter
+        self.buffer = RingBuffer(buffer_size)
+        self.batch_size = batch_size
+        self.interval = interval
+        self.exported = 0
+        self.errors = 0
+        self._export_lock = threading.Lock()
+        self._worker_pid = None
+
+    # sampling
+
+    def sample(self, request_id=None):
+        if self.sample_rate >= 1:
+            return True
+        if self.sample_rate <= 0:
+            return False
+        if request_id is None or request_id == PLACE_HOLDER:
+            return random.random() < self.sample_rate
+        bucket = zlib.crc32(obj2str(request_id)) & 0xffffffff
+        return bucket < self.sample_rate * 0x100000000
+
+    def is_sampled(self):
+        """Sampling decision of current request, taken on first call."""
+        call_meta = g.call_meta_data
+        sampled = call_meta.get(SAMPLED_KEY)
+        if sampled is None:
+            request_id = call_meta.get('request_id')
+            sampled = self.sample(request_id)
+            if request_id is not None:
+                call_meta[SAMPLED_KEY] = sampled
+        return sampled
+
+    # spans
+
+    def span(self, kind, name, **tags):
+        """Start a span, child of the api span of current request."""
+        if not self.is_sampled():
+            return NOOP_SPAN
+        return Span(self, kind, name, tags, g.call_meta_data.get(SPAN_KEY))
+
+    def record(self, span):
+        self._ensure_worker()
+        self.buffer.push(span)
+
+    # api calls, see `rest_arch.app.SKT`
+
+    def on_before_api_called(self, sender, api=None, **tags):
+        if not self.is_sampled():
+            return
+        g.call_meta_data[SPAN_KEY] = Span(self, 'api', api, tags)
+
+    def on_after_api_called(self, sender, exc=None, **tags):
+        span = g.call_meta_data.pop(SPAN_KEY, None)
+        if span is not None:
+            span.tags.update(tags)
+            span.finish(exc)
+
+    # SQLLogger listener interface
+
+    def on_sql_start(self, conn, statement, params):
+        pass
+
+    def on_sql_end(self, conn, statement, params, cost, exc=None):
+        if not self.is_sampled():
+            return
+        tags = {'role': conn._execution_options.get('role', 'unknown')}
+        now = time.time()
+        span = Span(self, 'sql', strip_sql_comment(statement), tags,
+                    g.call_meta_data.get(SPAN_KEY), now - (cost or 0))
+        span.finish(exc, cost or 0)
+
+    def install(self):
+        """Trace api calls and SQL statements."""
+        before_api_called.connect(self.on_before_api_called)
+        after_api_called.connect(self.on_after_api_called)
+        get_sql_logger().add_listener(self)
+
+    # export
+
+    def _ensure_worker(self):
+        # started lazily so that forked workers run their own
+        if self.exporter is None or self._worker_pid == os.getpid():
+            return
+        self._worker_pid = os.getpid()
+        worker = threading.Thread(target=self._worker, args=())
+        worker.setDaemon(True)
+        worker.start()
+
+    def _worker(self):
+        # started lazily in a request, don't keep its context
+        g.clear_all()
+        while True:
+            time.sleep(self.interval)
+            try:
+                while self._export_batch():
+                    pass
+            except Exception:
+                self.errors += 1
+                logger.exception('Error exporting spans')
+
+    def _export_batch(self):
+        """Export at most ``batch_size`` spans, return if there are more
+        spans left."""
+        with self._export_lock:
+            spans = self.buffer.pop_many(self.batch_size)
+            if not spans:
+                return False
+            self.exporter.export([json.dumps(s.to_dict(), default=obj2str)
+                                  for s in spans])
+            self.exported += len(spans)
+        return len(spans) == self.batch_size
+
+    def flush(self):
+        """Export all buffered spans in current thread."""
+        if self.exporter is None:
+            return
+        try:
+            while self._export_batch():
+                pass
+        except Exception:
+            self.errors += 1
+            logger.exception('Error exporting spans')
+
+    def stats(self):
+        return {
+            'recorded': self.buffer.pushed,
+            'dropped': self.buffer.dropped,
+            'pending': len(self.buffer),
+            'exported': self.exported,
+            'errors': self.errors,
+        }
+
+
+tracker = None
+
+
+def get_tracker():
+    global tracker
+    if tracker is None:
+        exporter = None
+        if settings.TRACKER_EXPORT:
+            exporter = make_exporter(settings.TRACKER_EXPORT)
+        tracker = ArchTracker(
+            sample_rate=settings.TRACKER_SAMPLE_RATE,
+            exporter=exporter,
+            buffer_size=settings.TRACKER_BUFFER_SIZE,
+            batch_size=settings.TRACKER_BATCH_SIZE,
+            interval=settings.TRACKER_FLUSH_INTERVAL)
+        tracker.install()
+        atexit.register(tracker.flush)
+    return tracker
+
+
+def span(kind, name, **tags):
+    """Span of current request if tracing is on and it is sampled::
+
+        with span('client', 'GET /foo', url=url) as s:
+            s.set_tag('status', 200)
+    """
+    if tracker is None:
+        return NOOP_SPAN
+    return tracker.span(kind, name, **tags)
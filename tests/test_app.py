@@ -9,3 +9,83 @@ def test_app():
     with mock.patch.object(app, 'make_app', mock_obj):
         res = app.make_app("test")
         assert res == "app"
+
+
+def test_load_shedding():
+    import json
+    from rest_arch.admission import AdmissionController
+    from rest_arch.consts import DEFAULT_TOO_BUSY_ERROR_CODE
+
+    skt = app.SKT(__name__, settings={}, shielded_apis=['ping'])
+    skt.admission = AdmissionController(max_concurrency=1)
+
+    @skt.route('/ping')
+    def ping():
+        return 'pong'
+
+    @skt.route('/foo')
+    def foo():
+        return 'foo'
+
+    client = skt.test_client()
+    assert client.get('/foo').data == 'foo'
+    assert skt.load_stats()['inflight'] == 0
+
+    # a request is in flight
+    skt.admission.inflight = 1
+    resp = client.get('/foo')
+    assert resp.status_code == 503
+    assert json.loads(resp.data)['code'] == DEFAULT_TOO_BUSY_ERROR_CODE
+    assert client.get('/ping').data == 'pong'
+    assert skt.load_stats()['shed'] == 1
+
+
+def test_admission_controller():
+    import time
+    from rest_arch.admission import AdmissionController, parse_request_start
+
+    assert parse_request_start('t=1462519427123') == 1462519427.123
+    controller = AdmissionController(queue_timeout=1, latency_target=0.01,
+                                     interval=0)
+    assert not controller.admit(time.time() - 2)
+    assert controller.admit(time.time())
+    assert controller.admit()
+    controller.release(0.1)
+    assert controller.overloaded and controller.limit == 1
+    assert not controller.admit()
+    controller.release(0.001)
+    assert not controller.overloaded and controller.limit == 0
+
+
+def test_request_deadline():
+    import json
+    from rest_arch.ctx import g
+    from rest_arch.consts import REQUEST_TIMEOUT_HEADER
+    from rest_arch.exc import ArchDeadlineExceededExc
+
+    skt = app.SKT(__name__, settings={})
+    remaining = []
+
+    @skt.route('/foo')
+    @skt.timeout(5)
+    def foo():
+        remaining.append(g.get_remaining_time())
+        return 'foo'
+
+    @skt.route('/slow')
+    def slow():
+        raise ArchDeadlineExceededExc()
+
+    client = skt.test_client()
+    assert client.get('/foo').data == 'foo'
+    assert 4 < remaining[-1] <= 5
+    client.get('/foo', headers={REQUEST_TIMEOUT_HEADER: '0.5'})
+    assert 0 < remaining[-1] <= 0.5
+    assert g.get_remaining_time() is None
+
+    resp = client.get('/foo', headers={REQUEST_TIMEOUT_HEADER: '0'})
+    assert resp.status_code == 504
+    assert len(remaining) == 2
+    resp = client.get('/slow')
+    assert resp.status_code == 504
+    assert json.loads(resp.data)['name'] == ArchDeadlineExceededExc.name
@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+
+import mock
+import pytest
+
+from rest_arch.conf import settings, CeleryConfig
+from rest_arch.exc import TaskBatchSendExc
+
+
+class _CeleryConfig(object):
+    BROKER_URL = 'memory://'
+    CELERY_DEFAULT_EXCHANGE = 'SKT'
+
+
+if not hasattr(settings, 'celeryconfig'):
+    settings.celeryconfig = CeleryConfig()
+    settings.celeryconfig.from_object(_CeleryConfig)
+
+from rest_arch import async  # noqa
+
+
+class FakeSignature(object):
+
+    def __init__(self, published, service_slug, api):
+        self.published = published
+        self.task = (service_slug, api)
+
+    def apply_async(self, producer=None, **kwargs):
+        if self.task[1].startswith('bad'):
+            raise IOError('publish failed')
+        self.published.append((self.task, producer))
+        return self.task
+
+
+@pytest.fixture
+def published():
+    published = []
+
+    def signature(service_slug, api, args, kwargs):
+        return FakeSignature(published, service_slug, api)
+
+    with mock.patch.object(async, '_signature', signature):
+        yield published
+
+
+def test_task_batch(published):
+    with async.task_batch() as batch:
+        async.send_task('foo', 'bar', 1)
+        with async.task_batch():
+            async.send_task('foo', 'baz', 2)
+        assert len(batch) == 2
+        assert not published
+    assert [task for task, _ in published] == [('foo', 'bar'),
+                                              ('foo', 'baz')]
+    # one producer for the batch
+    assert published[0][1] is published[1][1] is not None
+
+
+def test_task_batch_dropped(published):
+    with pytest.raises(ValueError):
+        with async.task_batch():
+            async.send_task('foo', 'bar', 1)
+            raise ValueError
+    assert not published
+    async.send_task('foo', 'bar', 1)
+    assert published == [(('foo', 'bar'), None)]
+
+
+def test_task_batch_partial_failure(published):
+    with pytest.raises(TaskBatchSendExc) as exc_info:
+        async.send_tasks([('foo', 'bad1', (), {}), ('foo', 'bar', (), {}),
+                          ('foo', 'bad2', (), {})])
+    exc = exc_info.value
+    assert [task[1] for task, _ in exc.errors] == ['bad1', 'bad2']
+    assert all(isinstance(e, IOError) for _, e in exc.errors)
+    assert exc.results == [None, ('foo', 'bar'), None]
+    assert [task for task, _ in published] == [('foo', 'bar')]
+
+
+def test_retry_option():
+    assert async._retry_option({}, 'max_retries', None, 5) == 5
+    assert async._retry_option({}, 'max_retries', 0, 5) == 0
+    assert async._retry_option({'max_retries': 1}, 'max_retries', 0, 5) == 1
+
+
+def test_dlq_depth_does_not_declare():
+    assert async.dlq_depth() == 0
+    with async.app.connection_or_acquire() as conn:
+        assert not conn.default_channel._has_queue(
+            settings.ASYNC_DLQ_QUEUE)
+    async.publish_dead_letter('foo', 'ping', (), {}, IOError(), 3)
+    assert async.dlq_depth() == 1
@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+
+import mock
+
+from rest_arch.balancer import make_balancer, P2CBalancer
+
+
+class OperationalError(Exception):
+    pass
+
+
+class IntegrityError(Exception):
+    pass
+
+
+def _conn(engine):
+    return mock.Mock(engine=engine)
+
+
+def test_p2c_prefers_fast_replica():
+    fast, slow = object(), object()
+    balancer = make_balancer('p2c', {'fast': fast, 'slow': slow})
+    assert isinstance(balancer, P2CBalancer)
+    balancer.on_sql_start(_conn(fast), 'SELECT 1', None)
+    balancer.on_sql_end(_conn(fast), 'SELECT 1', None, 0.001)
+    balancer.on_sql_start(_conn(slow), 'SELECT 1', None)
+    balancer.on_sql_end(_conn(slow), 'SELECT 1', None, 0.5)
+    assert all(balancer.choose() is fast for _ in range(20))
+
+    stats = balancer.stats()
+    assert stats['fast']['latency'] == 0.001
+    assert stats['slow']['outstanding'] == 0
+
+
+def test_eject_failing_replica():
+    good, bad = object(), object()
+    balancer = make_balancer('random', {'good': good, 'bad': bad},
+                             max_fails=2)
+    for _ in range(2):
+        balancer.on_sql_start(_conn(bad), 'SELECT 1', None)
+        balancer.on_sql_end(_conn(bad), 'SELECT 1', None, None,
+                            exc=IntegrityError())
+    assert not balancer.stats()['bad']['ejected']
+    for _ in range(2):
+        balancer.on_sql_start(_conn(bad), 'SELECT 1', None)
+        balancer.on_sql_end(_conn(bad), 'SELECT 1', None, None,
+                            exc=OperationalError())
+    assert balancer.stats()['bad']['ejected']
+    assert all(balancer.choose() is good for _ in range(20))
+
+
+def test_weights():
+    a, b = object(), object()
+    balancer = make_balancer('least_outstanding', {'a': a, 'b': b},
+                             weights={'a': 2})
+    balancer.set_weight('a', 4)
+    assert balancer.stats()['a']['weight'] == 4
+
+
+def test_interrupted_statement_not_outstanding():
+    a, b = object(), object()
+    balancer = make_balancer('least_outstanding', {'a': a, 'b': b})
+    conn = _conn(a)
+    balancer.on_sql_start(conn, 'SELECT 1', None)
+    balancer.on_sql_start(conn, 'SELECT 1', None)
+    assert balancer.stats()['a']['outstanding'] == 1
+    assert all(balancer.choose() is b for _ in range(20))
+
+    # interrupted, no `on_sql_end` before the connection is dropped
+    del conn
+    assert balancer.stats()['a']['outstanding'] == 0
@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+
+import mock
+from sqlalchemy import Column, Integer, String, create_engine
+from sqlalchemy.orm import scoped_session, sessionmaker
+
+from rest_arch.cache import Cache, CacheHook, CacheMixinBase, LRUCache
+from rest_arch.db import RoutingSession, model_base
+
+
+class FakeRedis(dict):
+    def setex(self, key, value, ttl):
+        self[key] = value
+
+    def delete(self, *keys):
+        for key in keys:
+            self.pop(key, None)
+
+    def mget(self, keys):
+        return [self.get(key) for key in keys]
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self)
+
+
+class FakePipeline(object):
+    def __init__(self, redis):
+        self.redis = redis
+        self.commands = []
+
+    def setex(self, *args):
+        self.commands.append(args)
+
+    def execute(self):
+        for args in self.commands:
+            self.redis.setex(*args)
+
+
+engine = create_engine('sqlite://')
+DBSession = scoped_session(sessionmaker(
+    class_=RoutingSession, expire_on_commit=False,
+    engines={'master': engine, 'slave': engine}))
+redis = FakeRedis()
+CacheMixin = type('CacheMixin', (CacheMixinBase, ), {
+    '_hook': CacheHook(),
+    '_cache': Cache(redis, namespace='test'),
+    '_db_session': DBSession,
+})
+Model = model_base()
+
+
+class User(Model, CacheMixin):
+    __tablename__ = 'user'
+    __cache_unique_keys__ = (('email', ), )
+    id = Column(Integer, primary_key=True)
+    email = Column(String(64), unique=True)
+
+Model.metadata.create_all(engine)
+
+
+def test_lru_cache():
+    lru = LRUCache(maxsize=2)
+    lru.set('a', 1)
+    lru.set('b', 2)
+    lru.get('a')
+    lru.set('c', 3)
+    assert lru.get('b') is None
+    assert lru.get('a') == 1
+    assert (lru.hits, lru.misses) == (2, 1)
+
+
+def test_read_through_and_invalidate():
+    assert User in CacheMixin._hook.models
+    session = DBSession()
+    session.add(User(id=1, email='a@b.c'))
+    session.commit()
+
+    assert User.get(1).email == 'a@b.c'
+    assert 'test:user:pk:1' in redis
+    assert User.get_by(email='a@b.c').id == 1
+    assert 'test:user:uk:email=a@b.c' in redis
+
+    user = User.get(1)
+    user.email = 'x@y.z'
+    session.commit()
+    assert 'test:user:pk:1' not in redis
+    assert 'test:user:uk:email=a@b.c' not in redis
+    DBSession.remove()
+    assert User.get(1).email == 'x@y.z'
+
+
+def test_mget():
+    session = DBSession()
+    session.add_all([User(id=2, email='2'), User(id=3, email='3')])
+    session.commit()
+    DBSession.remove()
+
+    User.get(3)
+    users = User.mget([3, 4, 2])
+    assert [u and u.id for u in users] == [3, None, 2]
+    assert 'test:user:pk:2' in redis
+
+
+def test_fill_from_master():
+    stale = create_engine('sqlite://')
+    Model.metadata.create_all(stale)
+    stale.execute(User.__table__.insert(), id=5, email='old')
+    session = DBSession()
+    session.add(User(id=5, email='new'))
+    session.commit()
+    DBSession.remove()
+
+    StaleSession = scoped_session(sessionmaker(
+        class_=RoutingSession, expire_on_commit=False,
+        engines={'master': engine, 'slave': stale}))
+    with mock.patch.object(User, '_db_session', StaleSession):
+        assert User.get_by(email='new').id == 5
+        assert User.get(5).email == 'new'
+        assert User.mget([5])[0].email == 'new'
+    # reads outside of cache fills still go to the replica
+    StaleSession.remove()
+    assert StaleSession().query(User).get(5).email == 'old'
@@ -0,0 +1,291 @@
+# -*- coding: utf-8 -*-
+
+import threading
+from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+from SocketServer import ThreadingMixIn
+
+import pytest
+
+from rest_arch import client as client_module
+from rest_arch.client import Client, pool_stats
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def _reply(self, body):
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        self._reply(self.path)
+
+    def do_POST(self):
+        length = int(self.headers.getheader('Content-Length'))
+        self._reply(self.rfile.read(length))
+
+    def log_message(self, *args):
+        pass
+
+
+class Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+@pytest.fixture
+def server():
+    server = Server(('127.0.0.1', 0), Handler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.setDaemon(True)
+    thread.start()
+    yield server
+    server.shutdown()
+    client_module.pools.clear()
+
+
+def test_pooled_client(server):
+    host, port = server.server_address
+    client = Client(host, port, pool_size=2)
+    assert client.get('/ping').text == '/ping'
+    assert Client(host, port).post('/add', {'a': 1}).json() == {'a': 1}
+
+    stats = pool_stats()['{}:{}'.format(host, port)]
+    assert stats['created'] == 1
+    assert stats['reused'] == 1
+    assert stats['idle'] == 1
+    assert stats['in_use'] == 0
+
+
+def test_gather():
+    import gevent
+    from rest_arch.client import gather
+
+    def slow():
+        gevent.sleep(1)
+
+    def fail():
+        raise ValueError
+
+    results = gather([lambda: 1, fail, slow, slow], concurrency=2,
+                     call_timeout=0.05)
+    assert results[0] == 1
+    assert isinstance(results[1], ValueError)
+    assert all(isinstance(r, gevent.Timeout) for r in results[2:])
+
+    results = gather([slow, lambda: 2], timeout=0.05)
+    assert isinstance(results[0], gevent.Timeout)
+    assert results[1] == 2
+
+
+def test_multi(server):
+    host, port = server.server_address
+    results = Client(host, port).multi([('get', '/a'), ('post', '/b', 1)])
+    assert [r.text for r in results] == ['/a', '1']
+
+
+def test_single_flight():
+    import gevent
+    from rest_arch.client import SingleFlight
+
+    calls = []
+
+    def fetch():
+        calls.append(1)
+        gevent.sleep(0.01)
+        return 'value'
+
+    single_flight = SingleFlight()
+    greenlets = [gevent.spawn(single_flight.do, 'key', fetch)
+                 for _ in range(10)]
+    gevent.joinall(greenlets)
+    assert [g.value for g in greenlets] == ['value'] * 10
+    assert len(calls) == 1
+    assert single_flight.coalesced == 9
+    assert not single_flight.calls
+
+
+def test_single_flight_failures():
+    import gevent
+    from rest_arch.client import SingleFlight
+
+    def timeout():
+        with gevent.Timeout(0.01):
+            gevent.sleep(10)
+
+    single_flight = SingleFlight()
+    greenlets = [gevent.spawn(single_flight.do, 'key', timeout)
+                 for _ in range(2)]
+    gevent.joinall(greenlets, timeout=1)
+    assert all(isinstance(g.exception, gevent.Timeout) for g in greenlets)
+    assert not single_flight.calls
+
+    def slow():
+        gevent.sleep(0.1)
+        return 'value'
+
+    # the caller who started the call gives up, the others still get it
+    greenlets = [gevent.spawn(single_flight.do, 'key', slow, timeout=0.01),
+                 gevent.spawn(single_flight.do, 'key', slow)]
+    gevent.joinall(greenlets, timeout=1)
+    assert isinstance(greenlets[0].exception, gevent.Timeout)
+    assert greenlets[1].value == 'value'
+
+
+def test_coalesced_get_deadline():
+    import gevent
+    from rest_arch.ctx import g
+    from rest_arch.exc import ArchDeadlineExceededExc
+
+    client = Client('127.0.0.1', 0, coalesce=True)
+    remaining = []
+
+    def _get(route):
+        remaining.append(g.get_remaining_time())
+        gevent.sleep(0.1)
+        return route
+
+    client._get = _get
+
+    def get(timeout):
+        g.set_deadline(timeout)
+        return client.get('/slow')
+
+    # a short deadline of the first caller doesn't fail the others
+    greenlets = [gevent.spawn(get, 0.01), gevent.spawn(get, 5)]
+    gevent.joinall(greenlets, timeout=5)
+    assert isinstance(greenlets[0].exception, ArchDeadlineExceededExc)
+    assert greenlets[1].value == '/slow'
+    assert remaining == [None]
+
+
+def test_cached_get(server):
+    import time
+    import gevent
+
+    host, port = server.server_address
+    client = Client(host, port, cache_ttl=0.2, stale_ttl=10)
+    first = client.get('/cached')
+    assert client.get('/cached') is first
+    assert client.cache.hits == 1
+
+    time.sleep(0.25)
+    # stale response served, revalidated in background
+    assert client.get('/cached') is first
+    gevent.sleep(0.05)
+    second = client.get('/cached')
+    assert second is not first and second.text == '/cached'
+
+
+def test_revalidate_after_request_deadline():
+    import time
+    import gevent
+    from rest_arch.ctx import g
+
+    class Response(object):
+        ok = True
+
+        def __init__(self, text):
+            self.text = text
+
+    client = Client('127.0.0.1', 0, cache_ttl=0.01, stale_ttl=10)
+    responses = iter([Response('first'), Response('second')])
+    client._get = lambda route: next(responses)
+    assert client.get('/cached').text == 'first'
+    time.sleep(0.02)
+
+    def request():
+        g.set_deadline(0.01)
+        assert client.get('/cached').text == 'first'
+        # the request ends before the revalidation starts
+        time.sleep(0.02)
+
+    gevent.spawn(request).join()
+    gevent.sleep(0.01)
+    assert client.get('/cached').text == 'second'
+
+
+def test_circuit_breaker():
+    import time
+    from rest_arch.client import CircuitBreaker
+    from rest_arch.exc import ArchBackoffExc
+
+    breaker = CircuitBreaker(failure_rate=0.5, min_calls=4, open_seconds=0.05)
+    for failed in (False, True, False, True):
+        breaker.before_call()
+        breaker.record(0.01, failed)
+    assert breaker.state == CircuitBreaker.OPEN
+    with pytest.raises(ArchBackoffExc):
+        breaker.before_call()
+
+    time.sleep(0.06)
+    breaker.before_call()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    with pytest.raises(ArchBackoffExc):
+        breaker.before_call()
+    breaker.record(0.01, False)
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_adaptive_limiter(server):
+    from rest_arch.client import AdaptiveLimiter, get_pool
+    from rest_arch.exc import ArchTooBusyExc
+
+    limiter = AdaptiveLimiter(initial=2, backoff=0.5)
+    limiter.acquire()
+    limiter.acquire()
+    with pytest.raises(ArchTooBusyExc):
+        limiter.acquire()
+    limiter.release(0.01, True)
+    assert limiter.limit == 1
+    limiter.release(0.01, False)
+    assert limiter.limit == 2
+
+    host, port = server.server_address
+    get_pool(host, port, limiter=AdaptiveLimiter(initial=1))
+    client = Client(host, port)
+    assert client.get('/ok').text == '/ok'
+    stats = pool_stats()['{}:{}'.format(host, port)]
+    assert stats['limiter'] == {'limit': 2, 'inflight': 0, 'rejected': 0}
+
+
+def test_half_open_probe_rejected_by_limiter(server):
+    from rest_arch.client import AdaptiveLimiter, CircuitBreaker, get_pool
+    from rest_arch.exc import ArchTooBusyExc
+
+    host, port = server.server_address
+    breaker = CircuitBreaker(open_seconds=0)
+    limiter = AdaptiveLimiter(initial=1)
+    pool = get_pool(host, port, breaker=breaker, limiter=limiter)
+    breaker._open(0)
+    limiter.inflight = 1
+    with pytest.raises(ArchTooBusyExc):
+        pool.request('GET', pool.url + 'ok')
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+
+    # the probe slot is given back
+    limiter.inflight = 0
+    assert pool.request('GET', pool.url + 'ok').text == '/ok'
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_deadline(server):
+    import time
+    from rest_arch.ctx import g
+    from rest_arch.exc import ArchDeadlineExceededExc
+
+    host, port = server.server_address
+    client = Client(host, port)
+    g.set_deadline(10)
+    try:
+        options = client._request_options({})
+        assert options['timeout'][0] == client.timeout[0]
+        assert 9 < options['timeout'][1] <= 10
+        assert client.get('/ok').text == '/ok'
+
+        g.set_call_meta('deadline', time.time() - 1)
+        with pytest.raises(ArchDeadlineExceededExc):
+            client.get('/ok')
+    finally:
+        g.clear_api_ctx()
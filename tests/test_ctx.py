@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+
+import gevent
+
+from rest_arch.consts import PLACE_HOLDER
+from rest_arch.ctx import g
+
+
+def test_spawn_inherits_call_meta():
+    g.clear_all()
+    g.set_call_meta('request_id', 'r1')
+    g.set_call_meta('seq', '1.2')
+
+    def child():
+        meta = (g.get_call_meta('request_id'), g.get_call_meta('seq'))
+        g.set_call_meta('seq', '1.2.1')
+        return meta
+
+    assert gevent.spawn(child).get() == ('r1', '1.2')
+    # changes of the child stay in the child
+    assert g.get_call_meta('seq') == '1.2'
+    g.clear_all()
+
+
+def test_greenlets_are_isolated():
+    g.clear_all()
+
+    def worker(i):
+        g.set_call_meta('request_id', i)
+        gevent.sleep(0)
+        return g.get_call_meta('request_id')
+
+    assert [gr.get() for gr in [gevent.spawn(worker, i)
+                                for i in range(5)]] == range(5)
+    assert g.get_call_meta('request_id') == PLACE_HOLDER
+
+
+def test_detach():
+    g.clear_all()
+    g.set_call_meta('request_id', 'r1')
+    g.set_deadline(1)
+
+    def background():
+        g.detach()
+        return g.get_call_meta('request_id'), g.get_remaining_time()
+
+    assert gevent.spawn(background).get() == ('r1', None)
+    assert g.get_remaining_time() is not None
+    g.clear_all()
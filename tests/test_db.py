@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+
+from sqlalchemy import Column, Integer, create_engine
+from sqlalchemy.ext.declarative import declarative_base
+
+from rest_arch.db import RoutingSession
+from rest_arch.replication import ReplicationProbe
+
+Model = declarative_base()
+
+
+class Foo(Model):
+    __tablename__ = 'foo'
+    id = Column(Integer, primary_key=True)
+
+
+class FakeProbe(ReplicationProbe):
+    slave_position = 0
+
+    def _probe_master(self, engine):
+        return 10
+
+    def _probe_slave(self, engine):
+        return self.slave_position
+
+
+def _make_session(**kwds):
+    engines = {'master': create_engine('sqlite://'),
+               'slave': create_engine('sqlite://')}
+    Model.metadata.create_all(engines['master'])
+    return RoutingSession(engines, **kwds)
+
+
+def test_read_your_writes_window():
+    session = _make_session(sticky_window=60)
+    assert session.get_bind() is session.engines['slave']
+    session.add(Foo(id=1))
+    session.flush()
+    assert session.get_bind() is session.engines['master']
+    session.commit()
+    assert session.get_bind() is session.engines['master']
+
+    session._sticky_until = 0
+    assert session.get_bind() is session.engines['slave']
+
+
+def test_read_your_writes_replica_caught_up():
+    probe = FakeProbe(ttl=0)
+    session = _make_session(sticky_window=60, replication_probe=probe)
+    session.add(Foo(id=1))
+    session.commit()
+    assert session.get_bind() is session.engines['master']
+    probe.slave_position = 10
+    assert session.get_bind() is session.engines['slave']
+
+
+def test_session_args_not_bound_to_routing_options():
+    engines = {'master': create_engine('sqlite://'),
+               'slave': create_engine('sqlite://')}
+    session = RoutingSession(engines, None, False)
+    assert session.balancer is None
+    assert session.autoflush is False
+
+
+def test_deadline_guard_before_sql_listeners():
+    import pytest
+    from rest_arch import db
+    from rest_arch.ctx import g
+    from rest_arch.exc import ArchDeadlineExceededExc
+    from rest_arch.log import get_sql_logger
+
+    class Listener(object):
+        started = ended = 0
+
+        def on_sql_start(self, conn, statement, params):
+            self.started += 1
+
+        def on_sql_end(self, conn, statement, params, cost, exc=None):
+            self.ended += 1
+
+    listener = Listener()
+    get_sql_logger().add_listener(listener)
+    engine = db.create_engine('sqlite://')
+    try:
+        g.set_deadline(0)
+        with pytest.raises(ArchDeadlineExceededExc):
+            engine.execute('select 1')
+        g.clear_api_ctx()
+        engine.execute('select 1')
+    finally:
+        get_sql_logger().remove_listener(listener)
+        g.clear_api_ctx()
+    assert listener.started == listener.ended == 1
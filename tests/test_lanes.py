@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+
+import time
+
+from rest_arch.lanes import Lanes
+
+
+def test_lanes():
+    lanes = Lanes.from_config([
+        {'name': 'order'},
+        {'name': 'critical', 'priority': 10,
+         'match': ['order.make_order'], 'time_limit': 10, 'prefetch': 1},
+        {'name': 'signals', 'priority': -10, 'match': ['*.signal_*'],
+         'concurrency': 4, 'unknown': 1},
+    ])
+
+    assert lanes.select('order', 'make_order').route() == {
+        'queue': 'critical', 'time_limit': 10}
+    assert lanes.select('order', 'cancel').name == 'order'
+    assert lanes.select('order', 'signal_foo').name == 'order'
+    assert lanes.select('member', 'signal_foo').name == 'signals'
+    assert lanes.select('member', 'other') is None
+    assert lanes.select('member', 'other', lane='signals').name == 'signals'
+
+    assert lanes.get('signals').worker_settings() == {
+        'CELERYD_CONCURRENCY': 4}
+    assert lanes.get('critical').routing_key == 'api.critical'
+
+    lane = lanes.get('order')
+    lanes.record_latency(lane, time.time() - 0.2)
+    lanes.record_latency(lane, time.time() - 5.5, countdown=5)
+    stats = lanes.stats()['order']
+    assert stats['count'] == 2
+    assert 0.2 <= stats['max'] < 1
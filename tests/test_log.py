@@ -0,0 +1,221 @@
+# -*- coding: utf-8 -*-
+
+import logging
+
+import mock
+from sqlalchemy import create_engine
+
+from rest_arch.log import SQLLogger, RingBuffer
+
+
+class ListHandler(logging.Handler):
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+
+def _make_sql_logger(name):
+    sql_logger = SQLLogger(name=name)
+    sql_logger.use_switch(lambda: True)
+    handler = ListHandler()
+    sql_logger.logger.addHandler(handler)
+    sql_logger.logger.propagate = False
+    sql_logger.logger.setLevel(logging.INFO)
+    engine = create_engine('sqlite://')
+    sql_logger.register(engine)
+    return sql_logger, handler, engine
+
+
+def test_ring_buffer():
+    buf = RingBuffer(2)
+    for i in range(3):
+        buf.push(i)
+    assert buf.dropped == 1
+    assert buf.pop_many(5) == [1, 2]
+
+
+def test_async_sql_logging():
+    sql_logger, handler, engine = _make_sql_logger('test.async_sql_logger')
+    sql_logger.start_async(buffer_size=10, interval=60)
+    engine.execute('SELECT 1')
+    assert not handler.records
+    # `Connection Open` and `SELECT 1`
+    assert sql_logger.stats()['pending'] == 2
+    sql_logger.flush()
+    assert 'SELECT 1' in handler.records[-1].msg
+    assert sql_logger.stats()['emitted'] == 2
+
+
+def test_async_sql_logging_reads_conn_on_push():
+    sql_logger, handler, engine = _make_sql_logger(
+        'test.async_conn_sql_logger')
+    sql_logger.start_async(buffer_size=10, interval=60)
+    with mock.patch.object(sql_logger, '_get_logging_ctx_by_dbapi_conn',
+                           return_value={'host': 'h', 'db': 'd'}) as get_ctx:
+        engine.execute('SELECT 1')
+        assert get_ctx.call_count == 2
+        sql_logger.flush()
+        assert get_ctx.call_count == 2
+    assert len(handler.records) == 2
+
+
+def test_faulty_sql_listener():
+    sql_logger, handler, engine = _make_sql_logger('test.faulty_listener')
+    listener = mock.Mock()
+    listener.on_sql_start.side_effect = ValueError()
+    listener.on_sql_end.side_effect = ValueError()
+    sql_logger.add_listener(listener)
+    assert engine.execute('SELECT 1').scalar() == 1
+    assert listener.on_sql_start.call_count == 1
+
+
+def test_statement_template_masking():
+    sql_logger = SQLLogger(name='test.masking_sql_logger')
+    sql_logger.templates.sens_fields = set(['password'])
+    insert = 'INSERT INTO user (id, password) VALUES (?, ?)'
+    template = sql_logger.templates.get(insert)
+    assert template.mask_params((1, 'secret')) == "(1, '***')"
+    assert template.mask_params([(1, 'a'), (2, 'b')]) == \
+        "[(1, '***'), (2, '***')]"
+
+    select = 'SELECT * FROM user WHERE user.password = %(password_1)s ' \
+        'AND id IN (%(id_1)s, %(id_2)s)'
+    template = sql_logger.templates.get(select)
+    masked = template.mask_params(
+        {'password_1': 'secret', 'id_1': 1, 'id_2': 2})
+    assert 'secret' not in masked and "'id_1': 1" in masked
+
+    template = sql_logger.templates.get(
+        'UPDATE user SET password = MD5(?) WHERE id = ?')
+    assert template.mask_params(('secret', 1)) == "('***', 1)"
+
+    sql_logger.templates.get(insert)
+    stats = sql_logger.stats()
+    assert (stats['template_hits'], stats['template_misses']) == (1, 3)
+
+    # params after the rows are not mapped to the columns by position
+    template = sql_logger.templates.get(
+        'INSERT INTO user (id, name, password) VALUES (%s,%s,%s), '
+        '(%s,%s,%s) ON DUPLICATE KEY UPDATE name=%s, password=%s')
+    assert template.mask_params((1, 'n', 'sec', 2, 'm', 'sec', 'x', 'sec2')) \
+        == "(1, 'n', '***', 2, 'm', '***', 'x', '***')"
+
+
+def test_sql_stats():
+    from rest_arch.ctx import g
+    from rest_arch.sqlstats import SQLStats, normalize_statement
+
+    assert normalize_statement(
+        "/* E:rid=1&rpcid=1&role=slave:E */ SELECT * FROM t "
+        "WHERE a = 'x' AND id IN (1, 2,3)") == \
+        'SELECT * FROM t WHERE a = ? AND id IN (?+)'
+
+    sql_logger, handler, engine = _make_sql_logger('test.sql_stats')
+    stats = SQLStats(n_plus_one_threshold=3)
+    sql_logger.add_listener(stats)
+    g.set_call_meta('request_id', 'abc')
+    try:
+        for i in range(3):
+            engine.execute('SELECT %d' % i)
+    finally:
+        g.clear_api_ctx()
+    summary = stats.finish_request('abc')
+    assert summary.count == 3
+    assert summary.statements['SELECT ?'] == 3
+    assert stats.dump_digest()[0]['count'] == 3
+
+    # one fingerprint per statement, whatever the request comment is
+    stats = SQLStats(max_digests=2)
+    for statement in ('SELECT 1', 'SELECT 2', 'SELECT 1', 'SELECT 3'):
+        for rid in range(3):
+            stats._fingerprint('/* E:rid=%d&rpcid=1&role=slave:E */ %s' % (
+                rid, statement))
+    # `SELECT 1` is recently used, `SELECT 2` is evicted
+    assert list(stats._fingerprints) == ['SELECT 1', 'SELECT 3']
+
+
+def test_rest_formatter():
+    from rest_arch.ctx import g
+    from rest_arch.log import RestFormatter, logging_meta
+
+    formatter = RestFormatter('%(message)s')
+    formatter._app_id = 'skt.test'
+    record = logging.LogRecord('test', logging.INFO, __file__, 1, 'hi',
+                               None, None)
+    g.set_call_meta('request_id', 'rid')
+    try:
+        with logging_meta(k='v'):
+            assert formatter.format(record) == \
+                '[skt.test - rid] k => v ## hi'
+    finally:
+        g.clear_api_ctx()
+    record.msg = 'hi'
+    assert formatter.format(record) == '[skt.test - -] ## hi'
+
+    # unicode call meta from request headers, utf-8 message
+    g.set_call_meta('request_id', u'abc')
+    try:
+        record.msg = '\xe4\xb8\xad'
+        assert formatter.format(record) == '[skt.test - abc] ## \xe4\xb8\xad'
+    finally:
+        g.clear_api_ctx()
+
+
+def test_structured_logging():
+    import json
+    import msgpack
+    from rest_arch.log import StructuredFormatter
+    from rest_arch.skt.log import gen_logging_dictconfig
+
+    conf = gen_logging_dictconfig('test', 'dev', 'json')
+    assert conf['formatters']['console'] == {
+        '()': 'rest_arch.log.StructuredFormatter', 'serializer': 'json'}
+    assert conf['handlers']['console']['class'] == \
+        'rest_arch.log.StructuredStreamHandler'
+
+    record = logging.LogRecord('test', logging.INFO, __file__, 1, 'hi %s',
+                               ('there', ), None)
+    for serializer, loads in (('json', json.loads),
+                              ('msgpack', msgpack.unpackb)):
+        formatter = StructuredFormatter(serializer=serializer)
+        formatter._app_id = 'skt.test'
+        data = loads(formatter.format(record))
+        assert data['msg'] == 'hi there'
+        assert data['app_id'] == 'skt.test'
+
+    # utf-8 byte strings mixed with unicode
+    from rest_arch.log import logging_meta
+    record = logging.LogRecord('test', logging.INFO, __file__, 1,
+                               '中文 %s', (1, ), None)
+    formatter = StructuredFormatter(serializer='json')
+    formatter._app_id = 'skt.test'
+    with logging_meta(user=u'kiven', city='北京'):
+        data = json.loads(formatter.format(record))
+    assert data['msg'] == u'中文 1'
+    assert data['meta'] == {'user': u'kiven', 'city': u'北京'}
+
+
+def test_buffered_syslog_handler():
+    import os
+    import socket
+    from rest_arch.log import BufferedSysLogHandler
+
+    server = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    server.bind(('127.0.0.1', 0))
+    server.settimeout(1)
+    handler = BufferedSysLogHandler(address=server.getsockname(),
+                                    capacity=2, flush_interval=60)
+    handler._worker_pid = os.getpid()  # no background worker
+    record = logging.LogRecord('test', logging.INFO, __file__, 1, 'hi',
+                               None, None)
+    for _ in range(3):
+        handler.emit(record)
+    assert handler.stats()['dropped'] == 1
+    handler.flush()
+    assert server.recv(1024) == '<14>hi\000'
+    assert handler.stats()['sent'] == 2
+    handler.close()
+    server.close()
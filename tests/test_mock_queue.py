@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+
+import time
+
+import gevent
+import mock
+import pytest
+
+from rest_arch import mock_queue
+from rest_arch.exc import ArchTooBusyExc
+
+
+def test_memory_queue():
+    executed = []
+
+    class FakeTask(object):
+        def __init__(self, service, api, args, kwargs):
+            self.api = api
+
+        def execute(self):
+            gevent.sleep(0.01)
+            if self.api == 'fail':
+                raise ValueError
+            executed.append((self.api, time.time()))
+
+    queue = mock_queue.MemoryQueue(maxsize=1, workers=2)
+    with mock.patch.object(mock_queue.Task, 'create', FakeTask):
+        start = time.time()
+        queue.put(('foo', 'delayed', (), {'countdown': 0.05}))
+        queue.put(('foo', 'fail', (), {}))
+        with pytest.raises(ArchTooBusyExc):
+            queue.put_nowait(('foo', 'full', (), {}))
+        gevent.sleep(0.1)
+
+    assert [api for api, _ in executed] == ['delayed']
+    assert executed[0][1] - start >= 0.05
+    stats = queue.stats()
+    assert stats['processed'] == 2
+    assert stats['failed'] == 1
+    assert stats['rejected'] == 1
+    assert stats['depth'] == stats['delayed'] == stats['running'] == 0
@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+
+from rest_arch.conf import settings
+from rest_arch.retry import RetryPolicy, backoff, max_retries_within
+
+
+def test_backoff():
+    for retries in range(10):
+        countdown = backoff(retries, base=5, cap=60)
+        assert 0 <= countdown <= min(60, 5 * 2 ** retries)
+    assert backoff(1000, base=1, cap=10) <= 10
+
+
+def test_max_retries_within():
+    # expected waits 1 + 2 + 4 + 5 + 5
+    assert max_retries_within(17, base=2, cap=10) == 5
+    half_day = 12 * 60 * 60
+    cap = settings.TASK_RETRY_BACKOFF_CAP
+    assert settings.TASK_MAX_RETRY_COUNT == max_retries_within(
+        half_day, settings.TASK_THRIFT_ERROR_RETRY_WAIT, cap)
+    assert settings.TASK_TE_MAX_RETRY_COUNT == max_retries_within(
+        half_day, settings.TASK_THRIFT_ERROR_RETRY_WAIT, cap)
+    assert settings.TASK_UE_MAX_RETRY_COUNT == max_retries_within(
+        half_day, settings.TASK_UNKOWN_ERROR_RETRY_WAIT, cap)
+
+
+def test_retry_budget():
+    dead_letters = []
+    policy = RetryPolicy(budget_ratio=0.5, budget_min=1,
+                         dlq=lambda *args: dead_letters.append(args))
+    for _ in range(4):
+        policy.record_call('foo')
+    # 1 + 0.5 * 4
+    assert [policy.allow_retry('foo', 0) for _ in range(4)] == [
+        True, True, True, False]
+    assert not policy.allow_retry('bar', 3, max_retries=3)
+
+    policy.dead_letter('foo', 'bar', (1, ), {}, ValueError(), 3)
+    assert dead_letters[0][:2] == ('foo', 'bar')
+    stats = policy.stats()['foo']
+    assert stats['calls'] == 4
+    assert stats['retries'] == 3
+    assert stats['retry_rate'] == 0.75
+    assert stats['exhausted'] == 1
+    assert stats['dead_lettered'] == 1
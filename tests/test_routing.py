@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+
+import pytest
+
+from rest_arch.client import ClientRegistry
+from rest_arch.conf import settings
+from rest_arch.routing import RoutingTable
+
+
+class FakeClient(object):
+    def __init__(self, apis=()):
+        self.apis = apis
+
+
+def test_routing_table():
+    foo = FakeClient(['ping', 'signal_a'])
+    bar = FakeClient(['signal_a'])
+    registry = ClientRegistry({'skt.foo': foo})
+    table = RoutingTable(registry, skip_rules={'foo': ['skipped'],
+                                               'baz': None},
+                         memory_mq_skip_rules={'qux': None})
+
+    assert table.find_client('foo', 'ping') is foo
+    assert table.find_client('skt.foo', 'other') is foo
+    assert table.subscribers('signal_a') == ('foo', )
+    with pytest.raises(LookupError):
+        table.find_client('bar', 'signal_a')
+
+    # rebuilt once registry changes
+    registry['skt.bar'] = bar
+    assert table.find_client('bar', 'signal_a') is bar
+    assert sorted(table.subscribers('signal_a')) == ['bar', 'foo']
+
+    assert table.is_skipped('foo', 'skipped')
+    assert not table.is_skipped('foo', 'ping')
+    assert table.is_skipped('baz', 'anything')
+    assert not table.is_skipped('qux', 'anything')
+    assert table.is_skipped_in_memory_mq('qux', 'anything')
+    assert not table.is_skipped_in_memory_mq('baz', 'anything')
+
+
+def test_default_skip_rules_kept_apart():
+    table = RoutingTable(ClientRegistry(), settings.ASYNC_SKIP_RULES,
+                         settings.MEMORY_MQ_SKIP_RULES)
+    assert table.is_skipped('ess', 'ping')
+    assert not table.is_skipped('ees', 'ping')
+    assert table.is_skipped_in_memory_mq('ees', 'ping')
+    assert not table.is_skipped_in_memory_mq('ess', 'ping')
+    assert not table.is_skipped_in_memory_mq('biz.member',
+                                             'signal_post_make_order')
@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+
+import json
+import datetime
+import collections
+
+import mock
+
+from rest_arch.app import SKT
+from rest_arch.serializer import (
+    get_serializer, negotiate, default, JSONSerializer, JSON_CONTENT_TYPE,
+    MSGPACK_CONTENT_TYPE)
+
+
+def test_serializers():
+    json_serializer = get_serializer('json')
+    obj = {'a': [1, 2], 'b': u'中文'}
+    assert json_serializer.loads(json_serializer.dumps(obj)) == obj
+    assert json_serializer.dumps({'d': datetime.date(2016, 1, 2)}) == \
+        '{"d":"2016-01-02"}'
+    items = [{'i': i} for i in range(250)]
+    assert json_serializer.loads(
+        ''.join(json_serializer.iter_list(items))) == items
+
+    msgpack_serializer = get_serializer('msgpack')
+    assert msgpack_serializer.loads(msgpack_serializer.dumps(obj)) == obj
+    assert msgpack_serializer.loads(
+        ''.join(msgpack_serializer.iter_list(items))) == items
+
+    assert negotiate('application/msgpack, */*') is msgpack_serializer
+    assert negotiate('text/html') is json_serializer
+
+
+def test_json_same_as_stdlib():
+    point = collections.namedtuple('Point', 'x y')
+    obj = {'f': [0.1 + 0.2, 1e16, 1.0 / 3], 'url': 'http://a/b',
+           'u': u'中文\u2028', 'd': datetime.datetime(2016, 1, 2, 3, 4, 5),
+           'p': point(1, 2), 'big': 2 ** 64}
+    expected = json.dumps(obj, separators=(',', ':'), default=default)
+    assert JSONSerializer().dumps(obj) == expected
+
+
+def test_ujson_opt_in():
+    fake_ujson = mock.Mock()
+    with mock.patch('rest_arch.serializer.ujson', fake_ujson):
+        assert JSONSerializer()._fast_dumps is not fake_ujson.dumps
+        serializer = JSONSerializer(use_ujson=True)
+        assert serializer._fast_dumps is fake_ujson.dumps
+        assert serializer._loads is fake_ujson.loads
+
+
+def test_app_negotiation():
+    app = SKT(__name__, settings={})
+
+    @app.route('/items')
+    def items():
+        return [{'i': i} for i in range(3)]
+
+    @app.route('/stream')
+    def stream():
+        return ({'i': i} for i in range(3)), 201
+
+    client = app.test_client()
+    resp = client.get('/items')
+    assert resp.mimetype == JSON_CONTENT_TYPE
+    assert resp.data == '[{"i":0},{"i":1},{"i":2}]'
+
+    resp = client.get('/items', headers={'Accept': MSGPACK_CONTENT_TYPE})
+    assert resp.mimetype == MSGPACK_CONTENT_TYPE
+    assert get_serializer('msgpack').loads(resp.data) == [
+        {'i': 0}, {'i': 1}, {'i': 2}]
+
+    resp = client.get('/stream')
+    assert resp.status_code == 201
+    assert resp.data == '[{"i":0},{"i":1},{"i":2}]'
@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+
+import datetime
+
+from kombu import compression, serialization
+
+from rest_arch import task_serializer
+
+
+def test_task_envelope():
+    task_serializer.register()
+    body = {'task': 'rest_arch.async.async_api', 'id': 'abc',
+            'args': ['foo', 'bar', 1, u'中文'], 'kwargs': {'a': 1},
+            'retries': 0, 'eta': None, 'timelimit': [None, None]}
+    content_type, encoding, data = serialization.dumps(
+        body, serializer=task_serializer.SERIALIZER_NAME)
+    assert content_type == task_serializer.CONTENT_TYPE
+    assert serialization.loads(data, content_type, encoding) == body
+
+    # not representable by msgpack
+    body['args'].append(datetime.date(2016, 1, 1))
+    assert task_serializer.loads(task_serializer.dumps(body)) == body
+    assert task_serializer.loads(task_serializer.dumps([1])) == [1]
+
+
+def test_tuple_args():
+    body = {'task': 'rest_arch.async.async_api', 'id': 'abc',
+            'args': ('foo', 'bar', (1, [2, (3, )]), [4]), 'kwargs': {},
+            'timelimit': (None, None)}
+    loaded = task_serializer.loads(task_serializer.dumps(body))
+    assert loaded == body
+    assert type(loaded['args']) is tuple
+    assert type(loaded['args'][2][1]) is list
+    assert type(loaded['args'][3]) is list
+
+
+def test_non_str_map_keys():
+    body = {'task': 'rest_arch.async.async_api', 'id': 'abc',
+            'args': ({1: 'a', 2.5: 'b'}, ), 'kwargs': {'m': {None: 1}}}
+    data = task_serializer.dumps(body)
+    assert task_serializer._unpackb(data)[0] == task_serializer.ENVELOPE_TASK
+    assert task_serializer.loads(data) == body
+
+
+def test_compression_threshold():
+    task_serializer.register()
+    small, large = 'x' * 10, 'x' * 2000
+    assert task_serializer.compress(small, 1024) == '\x00' + small
+    data = task_serializer.compress(large, 1024)
+    assert len(data) < len(large)
+    assert compression.decompress(
+        data, task_serializer.COMPRESSION_TYPE) == large
+    assert task_serializer.decompress(
+        task_serializer.compress(small, 1024)) == small
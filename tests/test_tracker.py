@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+
+import json
+
+from rest_arch.ctx import g
+from rest_arch.signals import before_api_called, after_api_called
+from rest_arch.tracker import ArchTracker
+
+
+class ListExporter(object):
+
+    def __init__(self):
+        self.spans = []
+
+    def export(self, lines):
+        self.spans.extend(json.loads(line) for line in lines)
+
+
+def test_sampling():
+    tracker = ArchTracker(sample_rate=0.5)
+    decisions = [tracker.sample('req-%d' % i) for i in range(1000)]
+    assert 400 < sum(decisions) < 600
+    # same request id, same decision
+    assert decisions == [tracker.sample('req-%d' % i) for i in range(1000)]
+    assert not ArchTracker(sample_rate=0).sample('req-1')
+    assert ArchTracker(sample_rate=1).sample('req-1')
+
+
+def test_api_spans():
+    exporter = ListExporter()
+    tracker = ArchTracker(sample_rate=1, exporter=exporter)
+    before_api_called.connect(tracker.on_before_api_called)
+    after_api_called.connect(tracker.on_after_api_called)
+    try:
+        g.clear_all()
+        g.set_call_meta('request_id', 'r1')
+        g.set_call_meta('seq', '1')
+        before_api_called.send(None, api='/foo', method='GET')
+        with tracker.span('client', 'GET /bar') as span:
+            span.set_tag('status', 200)
+        after_api_called.send(None, exc=ValueError())
+        tracker.flush()
+    finally:
+        before_api_called.disconnect(tracker.on_before_api_called)
+        after_api_called.disconnect(tracker.on_after_api_called)
+        g.clear_all()
+
+    client_span, api_span = exporter.spans
+    assert api_span['kind'] == 'api' and api_span['name'] == '/foo'
+    assert api_span['error'] == 'ValueError()'
+    assert client_span['parent_id'] == api_span['span_id']
+    assert client_span['tags'] == {'status': 200}
+    assert client_span['request_id'] == 'r1' and client_span['seq'] == '1'
+    assert tracker.stats()['exported'] == 2
@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""Compare per request cost of the greenlet context
+:class:`rest_arch.ctx.ConnCtx` with the former ``threading.local`` one
+(as monkeypatched by gevent), e.g.::
+
+    python tools/bench_ctx.py -n 100000
+"""
+import argparse
+import timeit
+
+import gevent
+import gevent.local
+
+from rest_arch.consts import PLACE_HOLDER
+from rest_arch.ctx import ConnCtx
+
+
+class LocalConnCtx(gevent.local.local):
+    """``ConnCtx`` before greenlet contexts, ``threading.local`` is
+    ``gevent.local.local`` once patched."""
+
+    def __init__(self):
+        super(LocalConnCtx, self).__init__()
+        self.conn_ctx = {}
+        self.call_meta_data = {}
+        self.logging_meta = {}
+        self.user_request_ctx = {}
+        self.rendered_logging_meta = None
+
+    def clear_api_ctx(self):
+        self.call_meta_data.clear()
+        self.logging_meta.clear()
+        self.rendered_logging_meta = None
+
+    def clear_conn_ctx(self):
+        self.conn_ctx.clear()
+
+    def clear_user_request_ctx(self):
+        self.user_request_ctx.clear()
+
+    def set_call_meta(self, key, value):
+        self.call_meta_data[key] = value
+
+    def get_call_meta(self, key):
+        return self.call_meta_data.get(key, PLACE_HOLDER)
+
+    def clear_all(self):
+        self.clear_api_ctx()
+        self.clear_conn_ctx()
+        self.clear_user_request_ctx()
+
+
+def request(ctx, reads):
+    # setup, lookups by logging and clients, teardown of an api call
+    ctx.set_call_meta('request_id', 'abc')
+    ctx.set_call_meta('seq', '1.1')
+    ctx.set_call_meta('deadline', None)
+    ctx.logging_meta['user_id'] = 1
+    for _ in xrange(reads):
+        ctx.get_call_meta('request_id')
+        ctx.call_meta_data
+    ctx.clear_all()
+
+
+def fan_out(ctx, width, copy):
+    ctx.set_call_meta('request_id', 'abc')
+    ctx.set_call_meta('seq', '1.1')
+    call_meta = dict(ctx.call_meta_data) if copy else None
+
+    def child():
+        if copy:
+            ctx.call_meta_data.update(call_meta)
+        return ctx.get_call_meta('request_id')
+
+    gevent.joinall([gevent.spawn(child) for _ in xrange(width)])
+    ctx.clear_all()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', '--number', type=int, default=100000)
+    parser.add_argument('--reads', type=int, default=10,
+                        help='context reads per request')
+    parser.add_argument('--width', type=int, default=10,
+                        help='greenlets per fan-out')
+    args = parser.parse_args()
+
+    # the former context copies call meta to children by hand
+    contexts = [('threading.local', LocalConnCtx(), True),
+                ('greenlet', ConnCtx(), False)]
+    print('%-16s %14s %14s' % ('context', 'request us', 'fan-out us'))
+    for name, ctx, copy in contexts:
+        cost = timeit.timeit(lambda: request(ctx, args.reads),
+                             number=args.number)
+        number = max(args.number / 10, 1)
+        fan_out_cost = timeit.timeit(
+            lambda: fan_out(ctx, args.width, copy), number=number)
+        print('%-16s %14.2f %14.2f' % (
+            name, cost / args.number * 1e6, fan_out_cost / number * 1e6))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""Compare per message CPU time and size of async task serialization
+options, e.g.::
+
+    python tools/bench_task_serialization.py -n 20000
+"""
+import argparse
+import timeit
+import uuid
+
+from kombu import compression, serialization
+
+from rest_arch import task_serializer
+
+
+def _task_body(args):
+    # body of a celery 3.1 `async_api` message
+    return {
+        'task': 'rest_arch.async.async_api',
+        'id': str(uuid.uuid4()),
+        'args': args,
+        'kwargs': {},
+        'retries': 0,
+        'eta': None,
+        'expires': None,
+        'utc': True,
+        'callbacks': None,
+        'errbacks': None,
+        'timelimit': (None, None),
+        'taskset': None,
+        'chord': None,
+    }
+
+
+PAYLOADS = {
+    'tiny': _task_body(('biz.order', 'signal_post_make_order', 12345)),
+    'large': _task_body(('biz.order', 'bulk_update',
+                         [{'id': i, 'status': 'paid', 'amount': i * 100}
+                          for i in range(200)])),
+}
+
+OPTIONS = [
+    ('pickle', None),
+    ('pickle', 'gzip'),
+    ('json', 'gzip'),
+    ('msgpack', None),
+    ('msgpack', 'gzip'),
+    (task_serializer.SERIALIZER_NAME, None),
+    (task_serializer.SERIALIZER_NAME, task_serializer.COMPRESSION_NAME),
+]
+
+
+def _encode(body, serializer, compress_with):
+    _, _, data = serialization.dumps(body, serializer=serializer)
+    if compress_with is not None:
+        data, _ = compression.compress(data, compress_with)
+    return data
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', '--number', type=int, default=10000)
+    parser.add_argument('--threshold', type=int, default=1024,
+                        help='arch_zlib compression threshold in bytes')
+    args = parser.parse_args()
+
+    task_serializer.register()
+    # don't read settings in the benchmark
+    compression.register(
+        lambda body: task_serializer.compress(body, args.threshold),
+        task_serializer.decompress, task_serializer.COMPRESSION_TYPE,
+        aliases=[task_serializer.COMPRESSION_NAME])
+
+    print('%-8s %-24s %8s %12s' % ('payload', 'option', 'bytes', 'us/msg'))
+    for name, body in sorted(PAYLOADS.items()):
+        for serializer, compress_with in OPTIONS:
+            size = len(_encode(body, serializer, compress_with))
+            cost = timeit.timeit(
+                lambda: _encode(body, serializer, compress_with),
+                number=args.number)
+            option = serializer + ('+' + compress_with if compress_with
+                                   else '')
+            print('%-8s %-24s %8d %12.2f' % (
+                name, option, size, cost / args.number * 1e6))
+
+
+if __name__ == '__main__':
+    main()